@@ -1,20 +1,39 @@
 """Executes several performance tests."""
 import json
 import os.path
-import subprocess
 import sys
-import time
 import webbrowser
 from contextlib import suppress
 from pathlib import Path
 
 import click
-from pyinstrument.renderers import JSONRenderer
 
 from sphinx_performance.call import Call
-from sphinx_performance.config import MEMORY_HTML, MEMORY_PROFILE, RUNTIME_PROFILE
+from sphinx_performance.config import (
+    EVENTS_JSON,
+    LISTENERS_JSON,
+    MEMORY_EVENTS_JSON,
+    MEMORY_HTML,
+    MEMORY_PROFILE,
+    MEMORY_SUMMARY_JSON,
+    RUNTIME_PROFILE,
+)
+from sphinx_performance.flamegraph import (
+    export_cprofile,
+    export_profile_areas,
+    export_stacks,
+    session_stacks,
+)
+from sphinx_performance.memory import (
+    print_memory_summary,
+    print_stats,
+    print_summary,
+    write_flamegraph,
+)
 from sphinx_performance.projectenv import ProjectEnv
-from sphinx_performance.renderers.html import HTMLRendererFromJson
+from sphinx_performance.renderers.html import ScalableHTMLRenderer
+from sphinx_performance.sphinx_events import event_runtime, listener_timing_overhead
+from sphinx_performance.timing import write_docs_csv
 from sphinx_performance.utils import console
 
 
@@ -69,7 +88,10 @@ from sphinx_performance.utils import console
     "--flamegraph",
     is_flag=True,
     default=False,
-    help="Opens a flamegraph view if 'runtime' or 'memray' is used.",
+    help=(
+        "Stores and opens flamegraphs of 'runtime', 'pyinstrument', 'memray' and"
+        " --profile."
+    ),
 )
 @click.option(
     "--debug",
@@ -105,7 +127,7 @@ from sphinx_performance.utils import console
     "--memray",
     is_flag=True,
     default=False,
-    help="Activates memory profiling for the complete build.",
+    help="Activates memory profiling for the complete build, incl. parallel workers.",
 )
 @click.option(
     "--memray-live",
@@ -136,8 +158,24 @@ from sphinx_performance.utils import console
     default=None,
     type=float,
     help=(
-        "For tree view, remove nodes that represent less than X seconds of the total"
-        " time."
+        "For tree view, remove nodes that represent less than this share of the total"
+        " time, e.g. 0.01."
+    ),
+)
+@click.option(
+    "--tree-depth",
+    default=0,
+    type=click.IntRange(min=0),
+    help="For tree view, remove nodes deeper than X frames. 0 keeps all nodes.",
+)
+@click.option(
+    "--tree-collapse",
+    default=[],
+    type=str,
+    multiple=True,
+    help=(
+        "For tree view, merge the frames of this package, which are called by each"
+        " other, e.g. docutils"
     ),
 )
 @click.option(
@@ -145,11 +183,27 @@ from sphinx_performance.utils import console
     is_flag=True,
     default=False,
     help=(
-        "Generates a JSON runtime summary for each Sphinx event. Only usable if"
-        " --pyinstrument is given. This works by monkey patching the Sphinx"
-        " EventManager.emit function. The modification is visible in the call tree."
+        "Generates a JSON runtime summary for each Sphinx event. Without"
+        " --pyinstrument, each event listener measures its own runtime. With"
+        " --pyinstrument, the Sphinx EventManager.emit function gets monkey patched,"
+        " which is visible in the call tree. With --memray, the allocated memory"
+        " gets reported per event instead."
     ),
 )
+@click.option(
+    "--slowest-docs",
+    default=10,
+    type=click.IntRange(min=0),
+    show_default=True,
+    help="Number of documents shown in the slowest documents table.",
+)
+@click.option(
+    "--docs-csv",
+    "docs_csv_file",
+    default=None,
+    type=str,
+    help="CSV file path, which shall store the read and write time of each document.",
+)
 @click.pass_context
 def cli_analysis(
     ctx,
@@ -171,7 +225,11 @@ def cli_analysis(
     temp,
     tree,
     tree_filter,
+    tree_depth,
+    tree_collapse,
     sphinx_events,
+    slowest_docs,
+    docs_csv_file,
 ):
     """CLI analysis handling."""
     max_profile_cnt = 2
@@ -212,6 +270,7 @@ def cli_analysis(
                 sys.exit(0)
 
     counter = 1
+    docs_runs = []
     for project in projects:
         for build_config in call.build_configs:
             for project_config in call.project_configs:
@@ -240,6 +299,43 @@ def cli_analysis(
                 console.print(
                     f"Build done in {build_time:.3f}s with status code {app_code}",
                 )
+                project_obj.print_slowest_docs(slowest_docs)
+                if sphinx_events and not (pyinstrument or memray):
+                    project_obj.print_slowest_listeners()
+                    listener_times = project_obj.listener_times
+                    calls = sum(
+                        measured["calls"]
+                        for listeners in listener_times.values()
+                        for measured in listeners.values()
+                    )
+                    overhead = calls * listener_timing_overhead()
+                    console.print(
+                        f"[bold]Timing overhead[/bold]:\t {overhead * 1000:.1f} ms for"
+                        f" {calls} listener calls,"
+                        f" {overhead / build_time * 100 if build_time else 0:.2f} % of"
+                        " the build",
+                    )
+                    with Path(EVENTS_JSON).open("w") as events_json_file:
+                        json.dump(
+                            event_runtime(listener_times),
+                            events_json_file,
+                            indent=2,
+                            sort_keys=True,
+                        )
+                    with Path(LISTENERS_JSON).open("w") as listeners_json_file:
+                        json.dump(
+                            listener_times,
+                            listeners_json_file,
+                            indent=2,
+                            sort_keys=True,
+                        )
+                    console.print(f"Event runtimes stored: {EVENTS_JSON}")
+                docs_runs.append(
+                    (
+                        {"run": counter, "project": project, **project_config},
+                        project_obj.doc_times,
+                    ),
+                )
                 project_obj.post_processing()
 
                 if runtime:
@@ -248,71 +344,74 @@ def cli_analysis(
                         all_profile.print_stats()
 
                 if memray:
+                    # The reports merge the captures of the main process and its workers
+                    print_memory_summary(console, project_obj.memory_summary)
+                    with Path(MEMORY_SUMMARY_JSON).open("w") as summary_json_file:
+                        json.dump(
+                            project_obj.memory_summary,
+                            summary_json_file,
+                            indent=2,
+                        )
+                    if sphinx_events:
+                        project_obj.print_largest_listener_allocations()
+                        with Path(MEMORY_EVENTS_JSON).open("w") as events_json_file:
+                            json.dump(
+                                project_obj.memory_events,
+                                events_json_file,
+                                indent=2,
+                                sort_keys=True,
+                            )
+                        console.print(f"Event allocations stored: {MEMORY_EVENTS_JSON}")
                     if stats:
-                        args = ["memray", "stats", "-n", "10", MEMORY_PROFILE]
-                        subprocess.run(args)
+                        print_stats(console, MEMORY_PROFILE, 10)
                     if summary:
-                        args = ["memray", "summary", MEMORY_PROFILE]
-                        subprocess.run(args)
+                        print_summary(MEMORY_PROFILE)
 
                 if pyinstrument:
                     all_profile.save("pyinstrument_profile.json")
 
-    if pyinstrument and (tree or sphinx_events):
-        processor_options = {}
-        show_all = True
-        if tree and tree_filter:
-            show_all = False
-            processor_options["filter_threshold"] = tree_filter
+                counter += 1
 
-        json_str = JSONRenderer(
-            show_all=show_all,
-            processor_options=processor_options,
-        ).render(
-            all_profile,
-        )
+    if docs_csv_file:
+        write_docs_csv(docs_csv_file, docs_runs)
+        console.print(f"Documents CSV file stored: {docs_csv_file}")
 
-        if tree:
-            html_data = HTMLRendererFromJson(
-                show_all=show_all,
-                processor_options=processor_options,
-            ).render(
-                json_str,
-            )
-            with Path("pyinstrument_profile.html").open("w") as events_json_file:
-                events_json_file.write(html_data)
-                webbrowser.open_new_tab("pyinstrument_profile.html")
+    if pyinstrument and tree:
+        renderer = ScalableHTMLRenderer(
+            filter_threshold=tree_filter or 0.0,
+            max_depth=tree_depth,
+            collapse=list(tree_collapse),
+        )
+        data_path = renderer.render_to_file(all_profile, "pyinstrument_profile.html")
+        console.print(
+            f"Runtime tree stored: pyinstrument_profile.html (data: {data_path})",
+        )
+        webbrowser.open_new_tab("pyinstrument_profile.html")
 
-        if sphinx_events:
-            from sphinx_performance.sphinx_events import aggregate_event_runtime
+    if pyinstrument and sphinx_events:
+        from sphinx_performance.sphinx_events import aggregate_session_events
 
-            json_obj = json.loads(json_str)
-            aggregate_json = aggregate_event_runtime(json_obj)
-            with Path("pyinstrument_sphinx_events.json").open("w") as events_json_file:
-                json.dump(aggregate_json, events_json_file, indent=2, sort_keys=True)
+        aggregate_json = aggregate_session_events(all_profile)
+        with Path("pyinstrument_sphinx_events.json").open("w") as events_json_file:
+            json.dump(aggregate_json, events_json_file, indent=2, sort_keys=True)
 
     if flamegraph:
+        # Static files, which need no server and can be archived
+        svg_paths = export_profile_areas(profile)
         if runtime:
-            console.print("\nStarting snakeviz servers\n")
-            procs = []
-            for p in profile:
-                proc = subprocess.Popen(["snakeviz", f"profile/{p}.prof"])
-                procs.append(proc)
-
-            if runtime:
-                proc = subprocess.Popen(["snakeviz", RUNTIME_PROFILE])
-                procs.append(proc)
-
-            console.print(f"\nKilling snakeviz server in {len(procs)*5} secs.")
-            time.sleep(len(procs) * 5)
-            for proc in procs:
-                proc.kill()
+            svg_paths.append(export_cprofile(RUNTIME_PROFILE))
+        if pyinstrument:
+            svg_paths.append(
+                export_stacks(session_stacks(all_profile), "pyinstrument_profile.json"),
+            )
+        for svg_path in filter(None, svg_paths):
+            with suppress(Exception):
+                webbrowser.open_new_tab(svg_path.resolve().as_uri())
         if memray:
-            args = ["memray", "flamegraph", "-f", "-o", MEMORY_HTML, MEMORY_PROFILE]
-            subprocess.run(args)
+            write_flamegraph(MEMORY_PROFILE, MEMORY_HTML)
             with suppress(Exception):
                 webbrowser.open_new_tab(MEMORY_HTML)
 
 
-if "main" in __name__:
+if __name__ == "__main__":
     cli_analysis()
@@ -0,0 +1,174 @@
+"""
+Read the output of a running sphinx-build and detect its build phases.
+
+Lines get timestamped as soon as they arrive, without polling the process.
+"""
+from __future__ import annotations
+
+import os
+import queue
+import selectors
+import threading
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import subprocess
+
+STATUS_INTERVAL = 0.1  # Seconds without output, after which an empty tick gets yielded
+
+# Phase name and the beginnings of the sphinx-build output lines, which start it.
+# The order is the usual order of the phases in a build.
+# ``startup`` lasts from the start of the process till the first detected phase.
+PHASES = [
+    ("startup", ()),
+    ("loading", ("loading pickled environment",)),
+    ("reading", ("reading sources", "updating environment")),
+    ("pickling", ("pickling environment",)),
+    ("checking consistency", ("checking consistency",)),
+    ("preparing", ("preparing documents",)),
+    (
+        "copying",
+        (
+            "copying static files",
+            "copying extra files",
+            "copying images",
+            "copying assets",
+        ),
+    ),
+    ("writing", ("writing output", "generating indices", "writing additional pages")),
+    ("dumping search index", ("dumping search index", "dumping object inventory")),
+    ("finishing", ("build succeeded", "build finished")),
+]
+
+
+def detect_phase(line: str) -> str | None:
+    """Return the name of the phase, which gets started by the given output line."""
+    line = line.lstrip()
+    for phase, markers in PHASES:
+        if line.startswith(markers):
+            return phase
+    return None
+
+
+class PhaseTimeline:
+    """
+    Collect the start time of each phase from the build output.
+
+    A phase lasts till the next phase starts. Phases may occur more than once, e.g. ``writing``
+    for message catalogs before ``reading`` starts, so their durations get summed up.
+    """
+
+    def __init__(self, start_time: float) -> None:
+        self.changes = [(start_time, "startup")]  # (timestamp, phase)
+
+    @property
+    def current(self) -> str:
+        return self.changes[-1][1]
+
+    def add_line(self, timestamp: float, line: str):
+        phase = detect_phase(line)
+        if phase is not None and phase != self.current:
+            self.changes.append((timestamp, phase))
+
+    def durations(self, end_time: float) -> dict[str, float]:
+        """Return the duration of each phase, the last phase lasts till ``end_time``."""
+        durations = {phase: 0.0 for phase, _ in PHASES}
+        for i, (timestamp, phase) in enumerate(self.changes):
+            next_timestamp = (
+                self.changes[i + 1][0] if i + 1 < len(self.changes) else end_time
+            )
+            durations[phase] += next_timestamp - timestamp
+        return durations
+
+
+class LineSplitter:
+    """
+    Split chunks of output into lines, timestamped by the arrival of their first bytes.
+
+    Sphinx prints the start of some phases without a newline, e.g.
+    ``pickling environment... ``, and ends the line with ``done`` after the phase.
+    So the time of the newline would be the end of the phase and not its start.
+    """
+
+    def __init__(self) -> None:
+        self.buffer = b""
+        self.buffer_time = None  # Arrival of the first bytes in the buffer
+
+    def feed(self, timestamp: float, chunk: bytes) -> list[tuple[float, str]]:
+        """Return the lines completed by the chunk."""
+        if not self.buffer:
+            self.buffer_time = timestamp
+        *lines, self.buffer = (self.buffer + chunk).split(b"\n")
+        completed = []
+        for line in lines:
+            completed.append((self.buffer_time, line.decode("utf8", errors="replace")))
+            self.buffer_time = timestamp
+        return completed
+
+    def flush(self) -> list[tuple[float, str]]:
+        """Return the last line, which has no newline."""
+        if not self.buffer:
+            return []
+        line = self.buffer.decode("utf8", errors="replace")
+        self.buffer = b""
+        return [(self.buffer_time, line)]
+
+
+def read_lines(process: subprocess.Popen, timeout: float = STATUS_INTERVAL):
+    """
+    Yield ``(timestamp, line)`` for each line of the process stdout, as soon as it arrives.
+
+    The timestamp is the arrival of the first bytes of the line, see :class:`LineSplitter`.
+    If no output arrived for ``timeout`` seconds, ``(timestamp, None)`` gets yielded, so the
+    caller can update its status.
+    The output gets read till the pipe is closed, so no output gets lost, if the process
+    finishes while some of it is still buffered.
+    """
+    if os.name == "nt":
+        # Windows does not support selectors for pipes
+        yield from _read_lines_threaded(process, timeout)
+        return
+
+    fd = process.stdout.fileno()
+    splitter = LineSplitter()
+    with selectors.DefaultSelector() as selector:
+        selector.register(fd, selectors.EVENT_READ)
+        while True:
+            if not selector.select(timeout):
+                yield time.perf_counter(), None
+                continue
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            yield from splitter.feed(time.perf_counter(), chunk)
+    yield from splitter.flush()
+
+
+def _read_lines_threaded(process: subprocess.Popen, timeout: float):
+    lines = queue.Queue()
+
+    def reader():
+        splitter = LineSplitter()
+        # read1() returns the available output and does not wait for a newline
+        while True:
+            chunk = process.stdout.read1(65536)
+            if not chunk:
+                break
+            for line in splitter.feed(time.perf_counter(), chunk):
+                lines.put(line)
+        for line in splitter.flush():
+            lines.put(line)
+        lines.put(None)
+
+    threading.Thread(target=reader, daemon=True).start()
+    while True:
+        try:
+            item = lines.get(timeout=timeout)
+        except queue.Empty:
+            yield time.perf_counter(), None
+            continue
+        if item is None:
+            break
+        timestamp, line = item
+        yield timestamp, line.rstrip("\r")
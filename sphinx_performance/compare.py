@@ -0,0 +1,175 @@
+"""Compare the results of runs against a stored baseline."""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import rich.table
+from rich import box
+from rich.style import Style
+
+from sphinx_performance.resultstore import config_key
+from sphinx_performance.stats import summarize, welch_test
+
+if TYPE_CHECKING:
+    from rich.console import Console
+
+COMPARE_METRICS = ["total", "reading", "writing"]
+
+REGRESSION = "regression"
+IMPROVEMENT = "improvement"
+UNCHANGED = "-"
+
+
+def compare_results(
+    results: list[dict],
+    baseline: dict,
+    threshold: float = 5.0,
+    outlier_method: str = "mad",
+) -> list[dict]:
+    """
+    Compare the measured values of each run with the baseline run of the same config.
+
+    A metric regresses, if its mean got bigger by more than ``threshold`` percent and the
+    difference is significant by Welch's t-test. If significance can not be tested, as one
+    side has only a single build, the threshold decides alone.
+
+    :param results: run results of sphinx-performance
+    :param baseline: baseline runs by config key, see
+        :meth:`~sphinx_performance.resultstore.ResultStore.baseline`
+    :param threshold: allowed change in percent
+    :param outlier_method: see :func:`~sphinx_performance.stats.find_outliers`
+    :return: one dict per run, with the baseline run and the comparison of each metric.
+        The baseline run is None, if the config has no baseline.
+    """
+    comparisons = []
+    for result in results:
+        base_run = baseline.get(config_key(result["project"], result["config"]))
+        metrics = {}
+        if base_run is not None:
+            for metric in COMPARE_METRICS:
+                base_values = [
+                    sample[metric] for sample in base_run["samples"] if metric in sample
+                ]
+                values = [
+                    sample[metric] for sample in result["samples"] if metric in sample
+                ]
+                if not base_values or not values:
+                    continue
+                metrics[metric] = _compare_metric(
+                    base_values,
+                    values,
+                    threshold,
+                    outlier_method,
+                )
+        comparisons.append({"result": result, "baseline": base_run, "metrics": metrics})
+    return comparisons
+
+
+def _compare_metric(base_values, values, threshold, outlier_method) -> dict:
+    base = summarize(base_values, outlier_method)
+    current = summarize(values, outlier_method)
+    test = welch_test(base["values"], current["values"])
+    change = (
+        (current["mean"] - base["mean"]) / base["mean"] * 100 if base["mean"] else 0
+    )
+
+    verdict = UNCHANGED
+    if abs(change) > threshold and test["significant"] is not False:
+        verdict = REGRESSION if change > 0 else IMPROVEMENT
+    return {
+        "baseline": base,
+        "current": current,
+        "change": change,
+        "significant": test["significant"],
+        "verdict": verdict,
+    }
+
+
+def has_regression(comparisons: list[dict]) -> bool:
+    """Return True, if any metric of any run regressed."""
+    return any(
+        metric["verdict"] == REGRESSION
+        for comparison in comparisons
+        for metric in comparison["metrics"].values()
+    )
+
+
+def _host_state(host: str | None, base_run: dict | None) -> str:
+    if base_run is None:
+        return "-"
+    if base_run["host"] == host:
+        return "same"
+    return "[bold yellow]different"
+
+
+def print_comparison(
+    console: Console,
+    comparisons: list[dict],
+    threshold: float,
+    host: str | None = None,
+):
+    """
+    Print the comparison as table, one column per run like the result table.
+
+    :param host: fingerprint of the current host, to mark baselines of other hosts
+    """
+    topic_style = Style(bold=True)
+    verdict_markup = {
+        REGRESSION: f"[bold red]{REGRESSION}",
+        IMPROVEMENT: f"[bold green]{IMPROVEMENT}",
+        UNCHANGED: UNCHANGED,
+    }
+
+    table = rich.table.Table(box=box.ROUNDED)
+    table.add_column("#", justify="center", style=topic_style)
+    for run, _ in enumerate(comparisons, start=1):
+        table.add_column(f"Run {run}", justify="center")
+
+    table.add_row(
+        "project",
+        *[str(comparison["result"]["project"]) for comparison in comparisons],
+    )
+    table.add_row(
+        "baseline",
+        *[
+            (
+                (comparison["baseline"]["git_sha"] or "-")[:10]
+                if comparison["baseline"]
+                else "missing"
+            )
+            for comparison in comparisons
+        ],
+    )
+    table.add_row(
+        "baseline host",
+        *[_host_state(host, comparison["baseline"]) for comparison in comparisons],
+    )
+    table.add_row("")
+    for metric in COMPARE_METRICS:
+        values = {"baseline": [], "current": [], "change": [], "significant": []}
+        verdicts = []
+        for comparison in comparisons:
+            compared = comparison["metrics"].get(metric)
+            if compared is None:
+                for column in values.values():
+                    column.append("-")
+                verdicts.append(UNCHANGED)
+                continue
+            values["baseline"].append(f"{compared['baseline']['mean']:.2f} s")
+            values["current"].append(f"{compared['current']['mean']:.2f} s")
+            values["change"].append(f"{compared['change']:+.1f} %")
+            values["significant"].append(
+                {True: "yes", False: "no", None: "untested"}[compared["significant"]],
+            )
+            verdicts.append(compared["verdict"])
+
+        for name, column in values.items():
+            table.add_row(f"{metric} {name}", *column)
+        table.add_row(metric, *[verdict_markup[verdict] for verdict in verdicts])
+        table.add_row("")
+
+    console.print(table)
+    console.print(
+        f"Threshold: {threshold:.1f} %. Changes are compared by the mean, significance"
+        " by Welch's t-test (95 %). 'untested' needs --repeat 2 or more.",
+    )
@@ -1,4 +1,5 @@
 """Internal configuration."""
+import os
 from pathlib import Path
 
 PROJECTS = {
@@ -11,5 +12,15 @@ PROJECTS = {
 RUNTIME_PROFILE = "runtime_all.prof"
 MEMORY_PROFILE = "memray_all.prof"
 MEMORY_HTML = "memray_all.html"
+MEMORY_SUMMARY_JSON = "memray_summary.json"
+MEMORY_EVENTS_JSON = "memray_sphinx_events.json"
+EVENTS_JSON = "sphinx_events.json"
+LISTENERS_JSON = "sphinx_events_listeners.json"
 
 MEMRAY_PORT = 13167
+
+CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / "sphinx-performance"
+)
+VENV_CACHE_SIZE = 5000  # MB
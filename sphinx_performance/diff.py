@@ -0,0 +1,522 @@
+"""Compare two profiles and show which functions and Sphinx events got slower or faster."""
+from __future__ import annotations
+
+import json
+import pstats
+import re
+import sys
+import webbrowser
+from pathlib import Path
+
+import click
+import rich.table
+from pyinstrument.frame import Frame
+from pyinstrument.session import Session
+from rich import box
+from rich.markup import escape
+
+from sphinx_performance.config import EVENTS_JSON, LISTENERS_JSON
+from sphinx_performance.renderers.html import HTMLRendererFromJson
+from sphinx_performance.sphinx_events import aggregate_session_events
+from sphinx_performance.utils import console
+
+SORT_METHODS = ["absolute", "relative"]
+ROOT = "[root]"
+# Names of events and custom frames in stacks of the listener timing
+REPORT_PREFIXES = ["Event", "Sphinx"]
+
+# Paths of installed packages and the standard library differ between environments
+LIBRARY_PATH = re.compile(r".*/(?:site-packages|dist-packages|lib/python\d+\.\d+)/(.*)")
+
+
+def normalize_path(path: str) -> str:
+    """
+    Return a path, which is the same for the same file in different environments.
+
+    Installed packages and the standard library get their path inside ``site-packages``
+    or the library folder, e.g. ``sphinx/application.py``. Other absolute paths, e.g. of
+    temporary test projects, are reduced to the file name.
+    """
+    path = path.replace("\\", "/")
+    match = LIBRARY_PATH.match(path)
+    if match:
+        return match.group(1)
+    if path.startswith(("/", "../")) or re.match(r"[A-Za-z]:/", path):
+        return path.rsplit("/", 1)[-1]
+    return path
+
+
+def frame_identity(file_path: str | None, qualifier: str) -> str:
+    """Name a frame like the event aggregation does: ``<path>: <qualifier>``."""
+    if not file_path:
+        return qualifier
+    return f"{normalize_path(file_path)}: {qualifier}"
+
+
+def _add_stack(tree: dict, stack: tuple, time: float):
+    """Add the time to each node of the stack, a node is ``[time, children]``."""
+    node = tree.setdefault(ROOT, [0.0, {}])
+    node[0] += time
+    for identity in stack:
+        node = node[1].setdefault(identity, [0.0, {}])
+        node[0] += time
+
+
+def _function_times(stacks: dict) -> dict:
+    """Return the own and total time of each function, recursive calls count once."""
+    functions = {}
+    for stack, time in stacks.items():
+        for identity in set(stack):
+            functions.setdefault(identity, {"self": 0.0, "total": 0.0})
+            functions[identity]["total"] += time
+        if stack:
+            functions[stack[-1]]["self"] += time
+    return functions
+
+
+def load_pyinstrument_session(session: Session) -> dict:
+    """Collect the stacks, functions and events of a pyinstrument session."""
+    identities = {}
+
+    def identity_of(frame_info: str) -> str:
+        identity = identities.get(frame_info)
+        if identity is None:
+            frame = Frame(frame_info)
+            qualifier = (
+                f"{frame.class_name}.{frame.function}"
+                if frame.class_name
+                else frame.function
+            )
+            identity = identities[frame_info] = frame_identity(
+                frame.file_path,
+                qualifier,
+            )
+        return identity
+
+    # The frames, which started the profiler, are different for each caller
+    stem = len(session.start_call_stack) - 1
+    stacks = {}
+    for frame_info_stack, time in session.frame_records:
+        start = (
+            stem if frame_info_stack[:stem] == session.start_call_stack[:stem] else 0
+        )
+        stack = tuple(
+            identity_of(frame_info) for frame_info in frame_info_stack[start:]
+        )
+        stacks[stack] = stacks.get(stack, 0.0) + time
+    return {
+        "kind": "pyinstrument",
+        "stacks": stacks,
+        "functions": _function_times(stacks),
+        "events": event_totals(aggregate_session_events(session)),
+    }
+
+
+def load_pyinstrument_tree(root_frame: dict) -> dict:
+    """Collect the stacks and functions of the JSON of pyinstrument's ``JSONRenderer``."""
+    stacks = {}
+
+    def walk(frame: dict, stack: tuple):
+        qualifier = frame["function"]
+        if frame.get("class_name"):
+            qualifier = f"{frame['class_name']}.{qualifier}"
+        # Frames like [self] or [await] are added by pyinstrument for the time of their parent
+        if not (qualifier.startswith("[") and stack):
+            stack = (*stack, frame_identity(frame.get("file_path"), qualifier))
+        own_time = frame["time"] - sum(child["time"] for child in frame["children"])
+        if own_time > 0:
+            stacks[stack] = stacks.get(stack, 0.0) + own_time
+        for child in frame["children"]:
+            walk(child, stack)
+
+    walk(root_frame, ())
+    return {
+        "kind": "pyinstrument",
+        "stacks": stacks,
+        "functions": _function_times(stacks),
+        "events": {},
+    }
+
+
+def event_totals(report: dict) -> dict:
+    """
+    Return the time per event of pyinstrument's event aggregation.
+
+    The aggregation contains each function called by an event, so the longest one is the
+    time of the whole event.
+    """
+    return {
+        event: max(functions.values(), default=0.0)
+        for event, functions in report.items()
+    }
+
+
+def load_events(report: dict, *, listener_timing: bool) -> dict:
+    """
+    Collect the events of ``pyinstrument_sphinx_events.json`` or of the listener timing.
+
+    :param report: time per event and function, or per event and listener
+    :param listener_timing: the report is ``sphinx_events.json`` or
+        ``sphinx_events_listeners.json``, where the listeners of an event do not overlap
+        and add up to the time of the event
+    """
+    if not listener_timing:
+        return {
+            "kind": "events",
+            "stacks": {},
+            "functions": {},
+            "events": event_totals(report),
+        }
+    stacks = {}
+    for event, listeners in report.items():
+        for listener, time in listeners.items():
+            path, _, qualifier = listener.rpartition(": ")
+            stack = (event, frame_identity(path, qualifier))
+            if isinstance(time, dict):
+                time = time["total"]  # noqa: PLW2901
+            stacks[stack] = stacks.get(stack, 0.0) + time
+    events = {}
+    for (event, _), time in stacks.items():
+        events[event] = events.get(event, 0.0) + time
+    return {"kind": "events", "stacks": stacks, "functions": {}, "events": events}
+
+
+def load_cprofile(path: str | Path) -> dict:
+    """
+    Collect the functions of cProfile stats.
+
+    cProfile does not record stacks, so the flamegraph contains each function with its own
+    time directly below the root.
+    """
+    stats = pstats.Stats(str(path)).stats
+    functions = {}
+    for (file_path, _, function), (_, _, own_time, total_time, _) in stats.items():
+        identity = function if file_path == "~" else frame_identity(file_path, function)
+        times = functions.setdefault(identity, {"self": 0.0, "total": 0.0})
+        times["self"] += own_time
+        times["total"] += total_time
+    stacks = {(identity,): times["self"] for identity, times in functions.items()}
+    return {"kind": "cprofile", "stacks": stacks, "functions": functions, "events": {}}
+
+
+def load_profile(path: str | Path) -> dict:
+    """
+    Load a profile and normalize its frames, so profiles of different runs are comparable.
+
+    Supported are pyinstrument sessions (``pyinstrument_profile.json``), the JSON of
+    pyinstrument's ``JSONRenderer``, cProfile stats (``runtime_all.prof``) and event
+    aggregations (``pyinstrument_sphinx_events.json``, ``sphinx_events.json``).
+
+    :return: dict with the kind of profile, the time per stack, the own and total time per
+        function and the time per event and listener
+    """
+    try:
+        data = json.loads(Path(path).read_text(encoding="utf8"))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        # cProfile stats are stored by marshal
+        try:
+            return load_cprofile(path)
+        except (TypeError, ValueError, EOFError) as exc:
+            msg = f"Unknown profile format: {path}"
+            raise click.ClickException(msg) from exc
+    if "frame_records" in data:
+        return load_pyinstrument_session(Session.from_json(data))
+    if "root_frame" in data:
+        return load_pyinstrument_tree(data["root_frame"])
+    if isinstance(data, dict) and all(
+        isinstance(value, dict) for value in data.values()
+    ):
+        listener_timing = Path(path).name in (EVENTS_JSON, LISTENERS_JSON) or any(
+            isinstance(time, dict)
+            for listeners in data.values()
+            for time in listeners.values()
+        )
+        return load_events(data, listener_timing=listener_timing)
+    msg = f"Unknown profile format: {path}"
+    raise click.ClickException(msg)
+
+
+def compare_times(base: dict, current: dict) -> list[dict]:
+    """
+    Return the change of each name, which is in at least one of both dicts of times.
+
+    :return: list of dicts with name, base and current time, and the absolute and relative
+        change. The relative change is ``None`` for names, which are new.
+    """
+    changes = []
+    for name in base.keys() | current.keys():
+        base_time = base.get(name, 0.0)
+        current_time = current.get(name, 0.0)
+        changes.append(
+            {
+                "name": name,
+                "base": base_time if name in base else None,
+                "current": current_time if name in current else None,
+                "change": current_time - base_time,
+                "relative": (
+                    (current_time - base_time) / base_time if base_time else None
+                ),
+            },
+        )
+    return changes
+
+
+def rank_changes(
+    changes: list[dict],
+    sort: str = "absolute",
+    min_time: float = 0.01,
+) -> list[dict]:
+    """
+    Sort the changes by their absolute or relative size, the biggest one first.
+
+    :param sort: one of :data:`SORT_METHODS`
+    :param min_time: names with less time in both profiles get ignored for the relative
+        ranking, as their relative change is mostly noise
+    """
+    if sort == "relative":
+        changes = [
+            change
+            for change in changes
+            if max(change["base"] or 0.0, change["current"] or 0.0) >= min_time
+        ]
+        return sorted(
+            changes,
+            key=lambda change: (
+                float("inf") if change["relative"] is None else abs(change["relative"]),
+                abs(change["change"]),
+            ),
+            reverse=True,
+        )
+    return sorted(changes, key=lambda change: abs(change["change"]), reverse=True)
+
+
+def _format_time(time: float | None) -> str:
+    return "-" if time is None else f"{time:.3f}"
+
+
+def _format_change(change: dict) -> tuple[str, str]:
+    color = "red" if change["change"] > 0 else "green"
+    if change["base"] is None:
+        relative = "new"
+    elif change["current"] is None:
+        relative = "removed"
+    else:
+        relative = (
+            "-" if change["relative"] is None else f"{change['relative'] * 100:+.1f} %"
+        )
+    return f"[{color}]{change['change']:+.3f}[/{color}]", relative
+
+
+def print_changes(
+    title: str,
+    changes: list[dict],
+    limit: int,
+    total_changes: dict | None = None,
+):
+    """
+    Print the first changes as table.
+
+    :param total_changes: change of the total time by name, e.g. of functions incl. the
+        functions they call. Adds a column for it.
+    """
+    table = rich.table.Table(title=title, box=box.ROUNDED)
+    table.add_column("name")
+    table.add_column("base (s)", justify="right")
+    table.add_column("current (s)", justify="right")
+    table.add_column("Δ (s)", justify="right")
+    table.add_column("Δ %", justify="right")
+    if total_changes is not None:
+        table.add_column("Δ total (s)", justify="right")
+    for change in changes[:limit]:
+        row = [
+            escape(change["name"]),
+            _format_time(change["base"]),
+            _format_time(change["current"]),
+            *_format_change(change),
+        ]
+        if total_changes is not None:
+            row.append(_format_change(total_changes[change["name"]])[0])
+        table.add_row(*row)
+    console.print(table)
+
+
+def diff_tree(base: dict, current: dict) -> dict:
+    """
+    Merge the call stacks of both profiles into a frame tree of pyinstrument's JSON format.
+
+    The frames have the time of the current profile, so the flamegraph shows where the
+    current build spends its time. Each function name gets the change against the base
+    profile, frames which got slower are marked as application code to highlight them.
+    """
+    base_tree = {}
+    for stack, time in base.items():
+        _add_stack(base_tree, stack, time)
+    current_tree = {}
+    for stack, time in current.items():
+        _add_stack(current_tree, stack, time)
+
+    def render(identity: str, node: list, base_node: list | None) -> dict:
+        path, _, qualifier = identity.rpartition(": ")
+        if path in REPORT_PREFIXES:
+            path, qualifier = "", identity
+        base_time, base_children = base_node or (0.0, {})
+        change = node[0] - base_time
+        label = f"{qualifier} [{change:+.3f} s"
+        if base_time:
+            label += f", {change / base_time * 100:+.0f} %"
+        return {
+            "function": f"{label}]",
+            "file_path_short": path,
+            "file_path": path,
+            "line_no": 0,
+            "time": node[0],
+            "await_time": 0.0,
+            "is_application_code": change > 0,
+            "children": [
+                render(child, child_node, base_children.get(child))
+                for child, child_node in sorted(
+                    node[1].items(),
+                    key=lambda item: item[1][0],
+                    reverse=True,
+                )
+            ],
+        }
+
+    return render(
+        ROOT,
+        current_tree.get(ROOT, [0.0, {}]),
+        base_tree.get(ROOT),
+    )
+
+
+def write_diff_html(root_frame: dict, description: str, path: str | Path):
+    """Write the frame tree of :func:`diff_tree` as pyinstrument HTML page."""
+    session_json = json.dumps(
+        {
+            "start_time": 0.0,
+            "duration": root_frame["time"],
+            "sample_count": 0,
+            "target_description": description,
+            "program": (
+                description
+            ),  # name of target_description before pyinstrument 4.6
+            "cpu_time": 0.0,
+            "root_frame": root_frame,
+        },
+    )
+    html_data = HTMLRendererFromJson().render(session_json)
+    with Path(path).open("w", encoding="utf8") as html_file:
+        html_file.write(html_data)
+
+
+@click.command(
+    context_settings={
+        "help_option_names": ["-h", "--help"],
+    },
+)
+@click.argument("base", type=click.Path(exists=True, dir_okay=False))
+@click.argument("current", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--limit",
+    default=20,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Number of functions and events to show",
+)
+@click.option(
+    "--sort",
+    default="absolute",
+    type=click.Choice(SORT_METHODS),
+    show_default=True,
+    help="Ranks by the absolute change in seconds or by the relative change",
+)
+@click.option(
+    "--min-time",
+    default=0.01,
+    type=float,
+    show_default=True,
+    help=(
+        "Ignores functions and events with less seconds in both profiles for --sort"
+        " relative"
+    ),
+)
+@click.option(
+    "--output",
+    default="profile_diff.html",
+    type=str,
+    show_default=True,
+    help="Differential flamegraph to write, an empty value disables it",
+)
+@click.option(
+    "--browser",
+    is_flag=True,
+    help="Opens the differential flamegraph in the browser",
+)
+def cli_diff(base, current, limit, sort, min_time, output, browser):
+    """Compare the profile CURRENT against the profile BASE."""
+    base_profile = load_profile(base)
+    current_profile = load_profile(current)
+
+    compared = False
+    for section, title in [
+        ("functions", "Functions by {} change of their own time"),
+        ("events", "Sphinx events by {} change"),
+    ]:
+        if not base_profile[section] or not current_profile[section]:
+            continue
+        total_changes = None
+        if section == "functions":
+            base_times = {
+                name: times["self"] for name, times in base_profile[section].items()
+            }
+            current_times = {
+                name: times["self"] for name, times in current_profile[section].items()
+            }
+            total_changes = {
+                change["name"]: change
+                for change in compare_times(
+                    {
+                        name: times["total"]
+                        for name, times in base_profile[section].items()
+                    },
+                    {
+                        name: times["total"]
+                        for name, times in current_profile[section].items()
+                    },
+                )
+            }
+        else:
+            base_times = base_profile[section]
+            current_times = current_profile[section]
+        changes = compare_times(base_times, current_times)
+        print_changes(
+            title.format(sort),
+            rank_changes(changes, sort, min_time),
+            limit,
+            total_changes,
+        )
+        if section == "functions":
+            total_change = sum(change["change"] for change in changes)
+            console.print(f"[bold]Total change[/bold]:\t {total_change:+.3f} s")
+        compared = True
+
+    if not compared:
+        console.print(
+            "[bold red]The profiles have no functions or events in common:"
+            f" {base} ({base_profile['kind']}), {current} ({current_profile['kind']})",
+        )
+        sys.exit(1)
+
+    if output and base_profile["stacks"] and current_profile["stacks"]:
+        write_diff_html(
+            diff_tree(base_profile["stacks"], current_profile["stacks"]),
+            f"{current} compared to {base}",
+            output,
+        )
+        console.print(f"Differential flamegraph stored: {output}")
+        if browser:
+            webbrowser.open_new_tab(output)
+
+
+if __name__ == "__main__":
+    cli_diff()
@@ -0,0 +1,253 @@
+"""
+Export runtime profiles as folded stacks and as static flamegraph.
+
+The folded stacks can be used by other tools like Brendan Gregg's ``flamegraph.pl`` or
+speedscope. The flamegraph is a self-contained SVG file, so it can be archived, e.g. as
+artifact of a CI run, and opened in any browser without a running server.
+"""
+from __future__ import annotations
+
+import pstats
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import TYPE_CHECKING
+from xml.sax.saxutils import escape
+
+from pyinstrument.frame import Frame
+
+from sphinx_performance.folded import write_folded
+from sphinx_performance.utils import console
+
+if TYPE_CHECKING:
+    from pyinstrument.session import Session
+
+# Times are stored as integer microseconds, as most tools expect integer counts
+COUNTS_PER_SECOND = 1_000_000
+# Call paths of cProfile with less time get dropped, see cprofile_stacks()
+MIN_PATH_TIME = 0.001
+
+WIDTH = 1200
+FRAME_HEIGHT = 16
+FONT_SIZE = 12
+PADDING = 10
+TITLE_HEIGHT = 30
+MIN_FRAME_WIDTH = 0.1
+MIN_LABEL_CHARS = 3
+
+
+def _frame_name(function: str, file_path: str | None, line_no: int | None) -> str:
+    """Name a frame like :func:`sphinx_performance.sampler_hook.frame_name`."""
+    if not file_path or file_path == "~":
+        return function.replace(";", ":")
+    return f"{function} ({file_path}:{line_no or 0})".replace(";", ":")
+
+
+def session_stacks(session: Session) -> Counter:
+    """Return the microseconds per call stack of a pyinstrument session."""
+    names = {}
+    times = {}
+    for frame_info_stack, time in session.frame_records:
+        stack = []
+        for frame_info in frame_info_stack:
+            name = names.get(frame_info)
+            if name is None:
+                frame = Frame(frame_info)
+                qualifier = (
+                    f"{frame.class_name}.{frame.function}"
+                    if frame.class_name
+                    else frame.function
+                )
+                name = names[frame_info] = _frame_name(
+                    qualifier,
+                    frame.file_path_short,
+                    frame.line_no,
+                )
+            stack.append(name)
+        folded = ";".join(stack)
+        times[folded] = times.get(folded, 0.0) + time
+    return _to_counts(times)
+
+
+def cprofile_stacks(stats: pstats.Stats, min_time: float = MIN_PATH_TIME) -> Counter:
+    """
+    Return the microseconds per call stack, estimated from cProfile stats.
+
+    cProfile only records the time per caller and callee, not whole stacks. So the time of
+    a function is split between its callers by the time each of them spent in it, starting
+    at the functions without callers. Recursive calls end a stack and call paths with less
+    than ``min_time`` seconds get added to the calling frame, which keeps the number of
+    stacks small. cProfile counts the time of recursive functions more than once, so the
+    calls of a frame get scaled down to its time, if needed. The result is only an
+    approximation, but the time of all stacks adds up to the profiled time.
+    """
+    entries = stats.stats
+    callees = {}
+    for function, (_, _, _, _, callers) in entries.items():
+        for caller, (_, _, _, caller_time) in callers.items():
+            if caller in entries:
+                callees.setdefault(caller, []).append((function, caller_time))
+
+    times = {}
+    # Functions of a stack, the stack as folded string, and the time of the stack.
+    # Stacks start with the time of a function, which was not spent in a profiled caller.
+    pending = []
+    for function, (_, _, _, total_time, callers) in entries.items():
+        root_time = total_time - sum(
+            caller_times[3]
+            for caller, caller_times in callers.items()
+            if caller in entries
+        )
+        if root_time >= min_time or (root_time > 0 and not callers):
+            name = _frame_name(function[2], function[0], function[1])
+            pending.append(((function,), name, root_time))
+    while pending:
+        functions, folded, time = pending.pop()
+        _, _, own_time, total_time, _ = entries[functions[-1]]
+        share = time / total_time
+        calls = [
+            (callee, caller_time * share)
+            for callee, caller_time in callees.get(functions[-1], [])
+            if callee not in functions and entries[callee][3]
+        ]
+        # Recursive functions get counted more than once, so the calls may exceed the time
+        called_time = sum(call_time for _, call_time in calls)
+        available = max(time - own_time * share, 0.0)
+        scale = min(1.0, available / called_time) if called_time else 1.0
+        children_time = 0.0
+        for callee, call_time in calls:
+            path_time = call_time * scale
+            # Shorter paths keep the width of the frame, but hide the details
+            if path_time >= min_time:
+                children_time += path_time
+                name = _frame_name(callee[2], callee[0], callee[1])
+                pending.append(((*functions, callee), f"{folded};{name}", path_time))
+        if time > children_time:
+            times[folded] = times.get(folded, 0.0) + time - children_time
+    return _to_counts(times)
+
+
+def _to_counts(times: dict) -> Counter:
+    counts = Counter()
+    for folded, time in times.items():
+        count = round(time * COUNTS_PER_SECOND)
+        if count:
+            counts[folded] = count
+    return counts
+
+
+def _color(name: str) -> str:
+    """Return a warm color, which is the same for a function in every flamegraph."""
+    value = zlib.crc32(name.encode("utf8"))
+    return f"rgb({205 + value % 50},{(value >> 8) % 230},{(value >> 16) % 55})"
+
+
+def render_svg(stacks: Counter, title: str, unit: str = "µs") -> str:
+    """
+    Render folded stacks as flamegraph, the outermost frames at the bottom.
+
+    :param stacks: count per stack, like returned by :func:`sphinx_performance.folded.read_folded`
+    :param title: shown above the flamegraph
+    :param unit: unit of the counts, shown in the tooltips
+    """
+    root = [0, {}]  # count, children by name
+    depth = 0
+    for folded, count in stacks.items():
+        node = root
+        node[0] += count
+        frames = folded.split(";")
+        depth = max(depth, len(frames))
+        for name in frames:
+            node = node[1].setdefault(name, [0, {}])
+            node[0] += count
+
+    height = TITLE_HEIGHT + (depth + 1) * FRAME_HEIGHT + 2 * PADDING
+    scale = (WIDTH - 2 * PADDING) / root[0] if root[0] else 0
+    char_width = FONT_SIZE * 0.59
+    elements = []
+    pending = [("all", root, 0, 0)]
+    while pending:
+        name, (count, children), level, start = pending.pop()
+        width = count * scale
+        if width < MIN_FRAME_WIDTH:
+            continue
+        x = PADDING + start * scale
+        y = height - PADDING - (level + 1) * FRAME_HEIGHT
+        tooltip = f"{name} ({count:,} {unit}, {count / root[0] * 100:.2f} %)"
+        chars = int((width - 6) / char_width)
+        label = ""
+        if chars >= MIN_LABEL_CHARS:
+            label = name if len(name) <= chars else f"{name[: chars - 2]}.."
+        elements.append(
+            f'<g><title>{escape(tooltip)}</title><rect x="{x:.1f}" y="{y}"'
+            f' width="{width:.1f}" height="{FRAME_HEIGHT - 1}" fill="{_color(name)}"'
+            f' rx="2" ry="2"/><text x="{x + 3:.1f}"'
+            f' y="{y + FRAME_HEIGHT - 4}">{escape(label)}</text></g>',
+        )
+        child_start = start
+        for child_name in sorted(children):
+            child = children[child_name]
+            pending.append((child_name, child, level + 1, child_start))
+            child_start += child[0]
+
+    return "\n".join(
+        [
+            '<?xml version="1.0" standalone="no"?>',
+            (
+                f'<svg version="1.1" width="{WIDTH}" height="{height}"'
+                f' viewBox="0 0 {WIDTH} {height}" xmlns="http://www.w3.org/2000/svg">'
+            ),
+            (
+                "<style>text { font-family: Verdana, sans-serif; font-size:"
+                f" {FONT_SIZE}px; }}</style>"
+            ),
+            '<rect width="100%" height="100%" fill="#f8f8f8"/>',
+            (
+                f'<text x="{WIDTH / 2}" y="{PADDING + FONT_SIZE + 4}"'
+                ' text-anchor="middle" style="font-size:'
+                f' {FONT_SIZE + 5}px">{escape(title)}</text>'
+            ),
+            *elements,
+            "</svg>",
+            "",
+        ],
+    )
+
+
+def export_stacks(stacks: Counter, path: str | Path, title: str | None = None) -> Path:
+    """
+    Store the stacks as ``<path>.folded`` and as flamegraph ``<path>.svg``.
+
+    :return: path of the flamegraph
+    """
+    path = Path(path)
+    folded_path = path.with_suffix(".folded")
+    svg_path = path.with_suffix(".svg")
+    write_folded(stacks, folded_path)
+    svg_path.write_text(render_svg(stacks, title or path.name), encoding="utf8")
+    console.print(f"Flamegraph stored: {svg_path} (folded stacks: {folded_path})")
+    return svg_path
+
+
+def export_cprofile(path: str | Path) -> Path | None:
+    """
+    Export the cProfile stats of the given file next to it.
+
+    :return: path of the flamegraph, or ``None`` if the stats were not written
+    """
+    path = Path(path)
+    if not path.exists():
+        console.print(f"[bold red]Profile not found, it was not written: {path}")
+        return None
+    return export_stacks(cprofile_stacks(pstats.Stats(str(path))), path)
+
+
+def export_profile_areas(areas: list[str]) -> list[Path]:
+    """
+    Export the profiles of the given ``--profile`` areas.
+
+    The areas get profiled by the built project, e.g. sphinx-needs, which stores them as
+    ``profile/<area>.prof``.
+    """
+    svg_paths = (export_cprofile(Path("profile") / f"{area}.prof") for area in areas)
+    return [svg_path for svg_path in svg_paths if svg_path is not None]
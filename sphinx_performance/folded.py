@@ -0,0 +1,37 @@
+"""
+Read, merge and write call stacks in the folded format of Brendan Gregg's flamegraph tools.
+
+Each line contains the frames of a stack from the outermost to the innermost one, separated
+by ``;``, followed by a space and the number of samples of this stack.
+"""
+from __future__ import annotations
+
+from collections import Counter
+from pathlib import Path
+
+
+def read_folded(path: str | Path) -> Counter:
+    """Return the number of samples per stack, lines without a number get ignored."""
+    stacks = Counter()
+    with Path(path).open(encoding="utf8") as folded_file:
+        for line in folded_file:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if stack and count.isdigit():
+                stacks[stack] += int(count)
+    return stacks
+
+
+def merge_folded(paths: list[str | Path]) -> Counter:
+    """Add up the samples of the same stacks of several files, e.g. one per process."""
+    stacks = Counter()
+    for path in paths:
+        stacks.update(read_folded(path))
+    return stacks
+
+
+def write_folded(stacks: Counter, path: str | Path):
+    """Write the stacks sorted, so files of different runs can be compared by diff tools."""
+    with Path(path).open("w", encoding="utf8") as folded_file:
+        folded_file.writelines(
+            f"{stack} {count}\n" for stack, count in sorted(stacks.items())
+        )
@@ -0,0 +1,253 @@
+"""
+Generate the pages and folders of a test project.
+
+All folders of the project tree get numbered in level order, like a heap:
+The root folder has number 0 and folder ``k`` inside folder ``n`` has number
+``n * folders + k + 1``. Each file gets its ID from the number of its folder and its position
+inside the folder: The index file ``n * (pages + 1)``, page ``p`` ``n * (pages + 1) + p + 1``.
+So IDs do not depend on the creation order and folders can be rendered in any order by any
+number of processes, always giving the same result.
+"""
+from __future__ import annotations
+
+import functools
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+FOLDERS_PER_TASK = 16  # Folders rendered by a worker in one go
+TASKS_PER_WORKER = 4  # Submitted, but not finished tasks per worker
+
+_renderer = None  # FolderRenderer of the current (worker) process
+
+
+@functools.lru_cache(maxsize=None)
+def template_environment(source_path: str, cache_dir: str) -> Environment:
+    """
+    Return the Jinja environment for the templates of a test project, one per process.
+
+    Compiled templates get stored as bytecode in ``cache_dir``, so other processes and later
+    runs load them without compiling them again.
+    """
+    return Environment(  # noqa: S701 rst files, no HTML to escape
+        loader=FileSystemLoader(source_path),
+        bytecode_cache=FileSystemBytecodeCache(cache_dir),
+        auto_reload=False,
+    )
+
+
+def folder_amount(folders: int, depth: int) -> int:
+    """Return the amount of folders in the tree, including the root folder."""
+    return sum(folders**level for level in range(depth + 1)) if folders > 0 else 1
+
+
+def iter_folders(folders: int, depth: int):
+    """
+    Yield ``(number, path, level)`` for all folders of the tree, in level order.
+
+    The path gets calculated from the folder number, so no tree needs to be kept in memory.
+    """
+    yield 0, "", 0
+    if folders <= 0:
+        return
+    first = 1
+    for level in range(1, depth + 1):
+        for offset in range(folders**level):
+            parts = []
+            rest = offset
+            for _ in range(level):
+                rest, position = divmod(rest, folders)
+                parts.append(f"folder_{position}")
+            yield first + offset, "/".join(reversed(parts)), level
+        first += folders**level
+
+
+class FolderRenderer:
+    """Render the index and pages of single folders. Each process has its own instance."""
+
+    def __init__(
+        self,
+        source_path: str,
+        target_path: str,
+        context: dict,
+        cache_dir: str,
+    ) -> None:
+        self.target_path = Path(target_path)
+        self.context = context
+        self.pages = context["pages"]
+        self.folders = context["folders"]
+        self.depth = context["depth"]
+
+        self.jinja_env = template_environment(source_path, cache_dir)
+        self.templates = {}
+        self.times = {"compile": 0.0, "render": 0.0}
+
+    def get_template(self, name: str):
+        template = self.templates.get(name)
+        if template is None:
+            start_time = time.perf_counter()
+            template = self.jinja_env.get_template(name)
+            self.times["compile"] += time.perf_counter() - start_time
+            self.templates[name] = template
+        return template
+
+    def render_file(self, source: str, target: Path, **kwargs):
+        template = self.get_template(source)
+        start_time = time.perf_counter()
+        rendered = template.render(**self.context, **kwargs)
+        self.times["render"] += time.perf_counter() - start_time
+        with target.open(mode="w") as file:
+            file.write(rendered)
+
+    def render_folder(self, number: int, path: str, level: int) -> int:
+        """Render index and pages of a folder and return the amount of rendered files."""
+        folder_path = self.target_path / path
+        folder_path.mkdir(parents=True, exist_ok=True)
+
+        if level == 0:
+            title = "Performance Test main index"
+            has_folders = self.folders > 0 and self.depth > 0
+        else:
+            title = f"Index folder {path.rsplit('_', 1)[-1]} depth {level}"
+            has_folders = level < self.depth
+        self.render_file(
+            "index.template",
+            folder_path / "index.rst",
+            has_folders=has_folders,
+            title=title,
+            global_page=number * (self.pages + 1),
+        )
+
+        for p in range(self.pages):
+            self.render_file(
+                "page.template",
+                folder_path / f"page_{p}.rst",
+                has_folders=False,
+                title=f"Page {p}",
+                page=p,
+                current_depth=level,
+                global_page=number * (self.pages + 1) + p + 1,
+            )
+        return self.pages + 1
+
+    def render_folders(self, folders: list) -> tuple[int, dict]:
+        """Render a batch of folders and return the amount of files and the needed times."""
+        times_before = dict(self.times)
+        files = sum(self.render_folder(*folder) for folder in folders)
+        times = {key: value - times_before[key] for key, value in self.times.items()}
+        return files, times
+
+
+def _init_worker(source_path: str, target_path: str, context: dict, cache_dir: str):
+    global _renderer
+    _renderer = FolderRenderer(source_path, target_path, context, cache_dir)
+
+
+def _render_folders(folders: list) -> tuple[int, dict]:
+    return _renderer.render_folders(folders)
+
+
+def _batches(iterable, size: int):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ProjectGenerator:
+    """
+    Render all templates of a test project into a target folder.
+
+    With more than one worker, folders get rendered by a pool of processes.
+    Tasks are created only as fast as they get finished, so also projects with millions of
+    pages need only little memory.
+    """
+
+    def __init__(
+        self,
+        source_path: str,
+        context: dict,
+        cache_dir: str,
+        workers: int = 1,
+    ) -> None:
+        self.source_path = str(source_path)
+        self.context = context
+        self.cache_dir = str(cache_dir)
+        self.workers = max(1, workers)
+
+    def generate(self, target_path: str | Path) -> dict:
+        """
+        Render all files of the test project into ``target_path``.
+
+        :return: dict with the amount of files and pages, and the compile, render and total time
+        """
+        start_time = time.perf_counter()
+        target_path = str(target_path)
+
+        main = FolderRenderer(
+            self.source_path,
+            target_path,
+            self.context,
+            self.cache_dir,
+        )
+        main.render_file(
+            "requirements.template",
+            Path(target_path) / "requirements.txt",
+        )
+        main.render_file("conf.template", Path(target_path) / "conf.py")
+        files = 2
+        times = dict(main.times)
+
+        folders = iter_folders(self.context["folders"], self.context["depth"])
+        batches = _batches(folders, FOLDERS_PER_TASK)
+        if self.workers == 1:
+            for batch in batches:
+                batch_files, _ = main.render_folders(batch)
+                files += batch_files
+            times = main.times
+        else:
+            # Forking would copy locks held by other threads, e.g. of parallel runs
+            with ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.source_path, target_path, self.context, self.cache_dir),
+            ) as executor:
+                running = set()
+                for batch in batches:
+                    if len(running) >= self.workers * TASKS_PER_WORKER:
+                        done, running = wait(running, return_when=FIRST_COMPLETED)
+                        files += self._collect(done, times)
+                    running.add(executor.submit(_render_folders, batch))
+                files += self._collect(running, times)
+
+        duration = time.perf_counter() - start_time
+        pages = self.context["pages"] * folder_amount(
+            self.context["folders"],
+            self.context["depth"],
+        )
+        return {
+            "files": files,
+            "pages": pages,
+            "pages_per_second": pages / duration if duration else 0,
+            "compile": times["compile"],
+            "render": times["render"],
+            "duration": duration,
+        }
+
+    @staticmethod
+    def _collect(futures, times: dict) -> int:
+        files = 0
+        for future in futures:
+            batch_files, batch_times = future.result()
+            files += batch_files
+            for key, value in batch_times.items():
+                times[key] += value
+        return files
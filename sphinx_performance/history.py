@@ -0,0 +1,171 @@
+"""Shows the history of stored runs."""
+import datetime
+import sys
+import time
+from pathlib import Path
+
+import click
+import rich.table
+from rich import box
+from rich.style import Style
+
+from sphinx_performance.config import CACHE_DIR
+from sphinx_performance.resultstore import ResultStore
+from sphinx_performance.stats import OUTLIER_METHODS, summarize
+from sphinx_performance.utils import console
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+@click.command(
+    context_settings={
+        "help_option_names": ["-h", "--help"],
+    },
+)
+@click.option(
+    "--cache-dir",
+    default=str(CACHE_DIR),
+    type=str,
+    show_default=True,
+    help="Folder for the caches of sphinx-performance.",
+)
+@click.option(
+    "--results-db",
+    default=None,
+    type=str,
+    help=(
+        "SQLite database of sphinx-performance. Default: results.sqlite in --cache-dir."
+    ),
+)
+@click.option(
+    "--project",
+    default=None,
+    type=str,
+    help="Shows only runs of this project",
+)
+@click.option(
+    "--ref",
+    default=None,
+    type=str,
+    help="Shows only runs of this reference config",
+)
+@click.option(
+    "--builder",
+    default=None,
+    type=str,
+    help="Shows only runs of this builder",
+)
+@click.option(
+    "--parallel",
+    default=None,
+    type=int,
+    help="Shows only runs with this number of parallel processes",
+)
+@click.option(
+    "--host",
+    default=None,
+    type=str,
+    help="Shows only runs of the host with this fingerprint",
+)
+@click.option(
+    "--days",
+    default=90,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Shows only runs of the last days",
+)
+@click.option(
+    "--metric",
+    default="total",
+    type=str,
+    show_default=True,
+    help="Measured value to show, e.g. total, reading or writing",
+)
+@click.option(
+    "--outliers",
+    "outlier_method",
+    default="mad",
+    type=click.Choice(OUTLIER_METHODS),
+    help="Outlier detection for runs with repeated builds.",
+)
+def cli_history(
+    cache_dir,
+    results_db,
+    project,
+    ref,
+    builder,
+    parallel,
+    host,
+    days,
+    metric,
+    outlier_method,
+):
+    """CLI history handling."""
+    results_db = results_db or Path(cache_dir) / "results.sqlite"
+    if not Path(results_db).exists():
+        console.print(f"[bold red]Results database not found: {results_db}")
+        sys.exit(1)
+
+    runs = ResultStore(results_db).query(
+        project=project,
+        ref=ref,
+        builder=builder,
+        parallel=parallel,
+        host=host,
+        since=time.time() - days * SECONDS_PER_DAY,
+        metric=metric,
+    )
+    runs = [run for run in runs if run["values"]]
+    if not runs:
+        console.print("No stored runs found.")
+        return
+
+    table = rich.table.Table(
+        title=f"{metric} of {len(runs)} runs in the last {days} days",
+        box=box.ROUNDED,
+    )
+    table.add_column("date")
+    table.add_column("config")
+    table.add_column("git")
+    table.add_column("host")
+    table.add_column("n", justify="right")
+    table.add_column("median", justify="right", style=Style(color="red", bold=True))
+    table.add_column("mean ± stddev", justify="right")
+    table.add_column("Δ first", justify="right")
+
+    first_median = {}
+    configs = {}
+    for run in runs:
+        summary = summarize(run["values"], outlier_method)
+        first = first_median.setdefault(run["config_key"], summary["median"])
+        change = (summary["median"] - first) / first * 100 if first else 0
+        git = (run["git_sha"] or "-")[:10] + ("*" if run["git_dirty"] else "")
+        configs[run["config_key"]] = f"{run['project']}, " + ", ".join(
+            f"{key}: {value}" for key, value in run["config"].items()
+        )
+        created = datetime.datetime.fromtimestamp(
+            run["created"],
+            tz=datetime.timezone.utc,
+        ).astimezone()
+        table.add_row(
+            created.strftime("%Y-%m-%d %H:%M"),
+            run["config_key"][:8],
+            git,
+            run["host"][:8],
+            str(summary["n"]),
+            f"{summary['median']:.2f}",
+            f"{summary['mean']:.2f} ± {summary['stddev']:.3f}",
+            f"{change:+.1f} %",
+        )
+
+    console.print(table)
+    for key, config in configs.items():
+        console.print(f"[bold]{key[:8]}[/bold]:\t {config}")
+    console.print(
+        "Δ first: change of the median against the first shown run of the same config."
+        " Git commits with uncommitted changes are marked with *.",
+    )
+
+
+if __name__ == "__main__":
+    cli_history()
@@ -0,0 +1,462 @@
+"""
+Combine the memray captures of a build and its forked worker processes.
+
+``sphinx-build -j N`` forks worker processes for reading and writing. memray follows them with
+``follow_fork=True`` and writes one capture file per worker, named like the capture of the main
+process plus the pid of the worker, e.g. ``memray_all.prof.1234``.
+The captures get combined here, so the summary, stats and flamegraph cover the whole build.
+The allocations of all processes get merged at their high watermark, so the merged peak is the
+sum of the peaks of all processes. As not all workers run at the same time, it is an upper limit.
+"""
+from __future__ import annotations
+
+import bisect
+import contextlib
+import dataclasses
+import os
+from collections import Counter
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import memray
+import rich.table
+from memray import AllocatorType
+from memray.reporters.flamegraph import FlameGraphReporter
+from memray.reporters.summary import SummaryReporter
+from pyinstrument.frame import SELF_TIME_FRAME_IDENTIFIER, Frame
+from rich import box
+from rich.markup import escape
+from rich.style import Style
+
+from sphinx_performance.resources import MB
+from sphinx_performance.sphinx_events import extension_of, trampoline_event
+from sphinx_performance.timing import EVENT_PHASES
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from rich.console import Console
+
+# Records of these allocators free memory, all others allocate it
+DEALLOCATORS = {AllocatorType.FREE, AllocatorType.MUNMAP, AllocatorType.PYMALLOC_FREE}
+
+
+def capture_files(path: str | Path) -> list[Path]:
+    """Return the capture of the main process, followed by the captures of its workers."""
+    path = Path(path)
+    workers = [
+        capture
+        for capture in path.parent.glob(f"{path.name}.*")
+        if capture.suffix[1:].isdigit()
+    ]
+    workers.sort(key=lambda capture: int(capture.suffix[1:]))
+    return ([path] if path.exists() else []) + workers
+
+
+def remove_worker_captures(path: str | Path):
+    """Delete the worker captures of a former build, so they do not get merged."""
+    for capture in capture_files(path):
+        if capture != Path(path):
+            capture.unlink()
+
+
+@contextlib.contextmanager
+def open_captures(path: str | Path):
+    """Open the capture of the main process and of all its workers."""
+    with contextlib.ExitStack() as stack:
+        yield [
+            stack.enter_context(memray.FileReader(os.fspath(capture)))
+            for capture in capture_files(path)
+        ]
+
+
+def heap_timeline(readers: list[memray.FileReader]) -> list[memray.MemorySnapshot]:
+    """
+    Add up the memory snapshots of all processes over time.
+
+    The RSS of the workers contains the memory shared with the main process, so only the
+    heap is exact.
+    """
+    events = []
+    for index, reader in enumerate(readers):
+        snapshots = list(reader.get_memory_snapshots())
+        events += [
+            (snapshot.time, index, snapshot.rss, snapshot.heap)
+            for snapshot in snapshots
+        ]
+        if index and snapshots:  # The memory of a worker gets freed at its exit
+            events.append((snapshots[-1].time + 1, index, 0, 0))
+    events.sort()
+
+    current = {}
+    rss = heap = 0
+    timeline = []
+    for snapshot_time, index, process_rss, process_heap in events:
+        last_rss, last_heap = current.get(index, (0, 0))
+        current[index] = (process_rss, process_heap)
+        rss += process_rss - last_rss
+        heap += process_heap - last_heap
+        timeline.append(memray.MemorySnapshot(snapshot_time, rss, heap))
+    return timeline
+
+
+def allocation_timeline(readers: list[memray.FileReader]) -> list[tuple[int, int, int]]:
+    """
+    Return the time, number and bytes of the allocations of all processes, sorted by time.
+
+    memray assigns each allocation to the first memory snapshot after it, so its time is only
+    as exact as the interval of the snapshots.
+    """
+    timeline = []
+    for reader in readers:
+        times = [snapshot.time for snapshot in reader.get_memory_snapshots()]
+        if not times:
+            continue
+        snapshots = {}  # snapshot index: [number, bytes]
+        for record in reader.get_temporal_allocation_records(merge_threads=True):
+            for interval in record.intervals:
+                allocated = snapshots.setdefault(
+                    interval.allocated_before_snapshot,
+                    [0, 0],
+                )
+                allocated[0] += interval.n_allocations
+                allocated[1] += interval.n_bytes
+        timeline += [
+            (times[min(index, len(times) - 1)], count, size)
+            for index, (count, size) in snapshots.items()
+        ]
+    timeline.sort()
+    return timeline
+
+
+def memory_summary(path: str | Path, phases: dict | None = None) -> dict:
+    """
+    Summarize the peaks of the main process, its workers and the phases of the build.
+
+    :param path: capture of the main process
+    :param phases: dict of phase and its ``(start, end)`` as seconds since the epoch,
+        see :func:`~sphinx_performance.timing.phase_intervals`
+    :return: dict with a dict per process, the peaks in bytes and per phase the peak and the
+        growth of the heap of all processes, and the number and bytes of their allocations
+    """
+    with open_captures(path) as readers:
+        processes = [
+            {
+                "pid": reader.metadata.pid,
+                "worker": bool(index),
+                "peak": reader.metadata.peak_memory,
+                "allocations": reader.metadata.total_allocations,
+            }
+            for index, reader in enumerate(readers)
+        ]
+        timeline = heap_timeline(readers)
+        allocations = allocation_timeline(readers) if phases else []
+
+    worker_peaks = [process["peak"] for process in processes if process["worker"]]
+    summary = {
+        "processes": processes,
+        "workers": len(worker_peaks),
+        "main peak": processes[0]["peak"] if processes else 0,
+        "max worker peak": max(worker_peaks, default=0),
+        "sum of peaks": sum(process["peak"] for process in processes),
+        "peak heap": max((snapshot.heap for snapshot in timeline), default=0),
+        "allocations": sum(process["allocations"] for process in processes),
+        "phases": {},
+    }
+
+    times = [snapshot.time for snapshot in timeline]
+    allocation_times = [allocated[0] for allocated in allocations]
+
+    def heap_at(index: int) -> int:
+        return timeline[index - 1].heap if index else 0
+
+    for phase, _, _ in EVENT_PHASES:
+        if phase not in (phases or {}):
+            continue
+        start, end = (round(value * 1000) for value in phases[phase])
+        first = bisect.bisect_left(times, start)
+        last = bisect.bisect_right(times, end)
+        first_allocation = bisect.bisect_left(allocation_times, start)
+        last_allocation = bisect.bisect_right(allocation_times, end)
+        phase_allocations = allocations[first_allocation:last_allocation]
+        summary["phases"][phase] = {
+            "peak": max(
+                (snapshot.heap for snapshot in timeline[first:last]),
+                default=heap_at(last),
+            ),
+            "growth": heap_at(last) - heap_at(first),
+            "allocations": sum(count for _, count, _ in phase_allocations),
+            "allocated": sum(size for _, _, size in phase_allocations),
+        }
+    return summary
+
+
+def print_memory_summary(console: Console, summary: dict):
+    """Print the peaks of all processes and a table of the phases."""
+    if not summary["processes"]:
+        return
+    console.print(
+        f"[bold]Memory peak[/bold]:\t main {summary['main peak'] / MB:.0f} MB, max"
+        f" worker {summary['max worker peak'] / MB:.0f} MB, sum of"
+        f" {summary['workers'] + 1} processes {summary['sum of peaks'] / MB:.0f} MB,"
+        f" heap of all processes {summary['peak heap'] / MB:.0f} MB",
+    )
+    console.print(f"[bold]Allocations[/bold]:\t {summary['allocations']}")
+    if not summary["phases"]:
+        return
+
+    table = rich.table.Table(
+        title="Memory of all processes per phase",
+        box=box.ROUNDED,
+    )
+    table.add_column("#", justify="center", style=Style(bold=True))
+    for phase in summary["phases"]:
+        table.add_column(phase, justify="right")
+    table.add_row(
+        "peak",
+        *[f"{phase['peak'] / MB:.1f} MB" for phase in summary["phases"].values()],
+    )
+    table.add_row(
+        "growth",
+        *[f"{phase['growth'] / MB:+.1f} MB" for phase in summary["phases"].values()],
+    )
+    table.add_row(
+        "allocations",
+        *[str(phase["allocations"]) for phase in summary["phases"].values()],
+    )
+    table.add_row(
+        "allocated",
+        *[f"{phase['allocated'] / MB:.1f} MB" for phase in summary["phases"].values()],
+    )
+    console.print(table)
+
+
+def _high_watermark_records(
+    readers: list[memray.FileReader],
+) -> Iterator[memray.AllocationRecord]:
+    for reader in readers:
+        yield from reader.get_high_watermark_allocation_records(merge_threads=True)
+
+
+def _merged_metadata(readers: list[memray.FileReader]) -> memray.Metadata:
+    return dataclasses.replace(
+        readers[0].metadata,
+        total_allocations=sum(reader.metadata.total_allocations for reader in readers),
+        peak_memory=sum(reader.metadata.peak_memory for reader in readers),
+    )
+
+
+def write_flamegraph(path: str | Path, html_path: str | Path):
+    """Write the memray flamegraph of all processes, like ``memray flamegraph``."""
+    with open_captures(path) as readers:
+        reporter = FlameGraphReporter.from_snapshot(
+            _high_watermark_records(readers),
+            memory_records=heap_timeline(readers),
+            native_traces=readers[0].metadata.has_native_traces,
+        )
+        with Path(html_path).open("w") as html_file:
+            reporter.render(
+                outfile=html_file,
+                metadata=_merged_metadata(readers),
+                show_memory_leaks=False,
+                merge_threads=True,
+                inverted=False,
+            )
+
+
+def print_summary(path: str | Path, max_rows: int | None = None):
+    """Print the allocations of all processes per location, like ``memray summary``."""
+    with open_captures(path) as readers:
+        reporter = SummaryReporter.from_snapshot(
+            _high_watermark_records(readers),
+            native=readers[0].metadata.has_native_traces,
+        )
+    reporter.render(sort_column=1, max_rows=max_rows)
+
+
+def _location(record: memray.AllocationRecord) -> str:
+    frames = record.stack_trace(max_stacks=1)
+    if not frames:
+        return "<unknown>"
+    function, file_path, line_no = frames[0]
+    return f"{function} ({file_path}:{line_no})"
+
+
+def merged_stats(path: str | Path) -> dict:
+    """
+    Calculate the statistics of all processes, like ``memray stats``.
+
+    The allocation records of all captures are counted, so no locations get lost by merging
+    the largest ones of each process.
+
+    :return: dict with the number of allocations, the allocated bytes, the peak in bytes and
+        the number of allocations per size, per allocator and per location, and the
+        allocated bytes per location
+    """
+    stats = {
+        "allocations": 0,
+        "allocated": 0,
+        "peak": 0,
+        "by size": Counter(),  # smallest power of two, which is not smaller
+        "by allocator": Counter(),
+        "locations by size": Counter(),
+        "locations by count": Counter(),
+    }
+    with open_captures(path) as readers:
+        for reader in readers:
+            stats["peak"] += reader.metadata.peak_memory
+            locations = {}  # stack id: location of its innermost frame
+            for record in reader.get_allocation_records():
+                if record.allocator in DEALLOCATORS:
+                    continue
+                location = locations.get(record.stack_id)
+                if location is None:
+                    location = locations[record.stack_id] = _location(record)
+                count = record.n_allocations
+                stats["allocations"] += count
+                stats["allocated"] += record.size
+                stats["by size"][1 << max(record.size - 1, 0).bit_length()] += count
+                stats["by allocator"][
+                    AllocatorType(record.allocator).name.lower()
+                ] += count
+                stats["locations by size"][location] += record.size
+                stats["locations by count"][location] += count
+    return stats
+
+
+def _format_size(size: float) -> str:
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024:  # noqa: PLR2004
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def print_stats(console: Console, path: str | Path, num_largest: int = 10):
+    """Print the statistics of all processes, like ``memray stats``."""
+    stats = merged_stats(path)
+    console.print(
+        f"[bold]Allocations[/bold]:\t {stats['allocations']},"
+        f" {_format_size(stats['allocated'])} allocated, sum of peaks"
+        f" {_format_size(stats['peak'])}",
+    )
+
+    table = rich.table.Table(title="Allocations by size", box=box.ROUNDED)
+    table.add_column("size up to", justify="right")
+    table.add_column("allocations", justify="right")
+    for size, count in sorted(stats["by size"].items()):
+        table.add_row(_format_size(size), str(count))
+    console.print(table)
+
+    table = rich.table.Table(title="Allocations by allocator", box=box.ROUNDED)
+    table.add_column("allocator")
+    table.add_column("allocations", justify="right")
+    for allocator, count in stats["by allocator"].most_common():
+        table.add_row(allocator, str(count))
+    console.print(table)
+
+    for key, title, format_value in [
+        ("locations by size", "Locations by allocated memory", _format_size),
+        ("locations by count", "Locations by number of allocations", str),
+    ]:
+        table = rich.table.Table(title=title, box=box.ROUNDED)
+        table.add_column("location")
+        table.add_column(key.split()[-1], justify="right")
+        for location, value in stats[key].most_common(num_largest):
+            table.add_row(escape(location), format_value(value))
+        console.print(table)
+
+
+def _short_frame(function: str, file_path: str, line_no: int) -> tuple[str, str]:
+    """Return the short file path and the module of a frame, like pyinstrument names them."""
+    file_path_short = Frame(f"{function}\x00{file_path}\x00{line_no}").file_path_short
+    module = None
+    if file_path_short and file_path_short.endswith(".py"):
+        module = file_path_short[: -len(".py")].replace("\\", "/").replace("/", ".")
+        if module.endswith(".__init__"):
+            module = module[: -len(".__init__")]
+    return file_path_short or "", module
+
+
+def stack_events(
+    stack: list[tuple[str, str, int]],
+) -> list[tuple[str, str, str | None]]:
+    """
+    Find the emitted events and their called listeners in a memray stack trace.
+
+    The stack starts with the innermost frame. Each event is emitted by its own
+    ``EventManager.emit_<event>`` frame, see :func:`~sphinx_performance.sphinx_events.trampoline`.
+    Its inner frames are the emit of Sphinx and then the listener.
+
+    :return: list of event report name, listener name and module of the listener
+    """
+    events = []
+    for index, (function, file_path, _) in enumerate(stack):
+        if not file_path.endswith("sphinx_events.py"):
+            continue
+        event = trampoline_event(function)
+        if event is None:
+            continue
+        if index >= 2:  # noqa: PLR2004
+            listener_function, listener_path, line_no = stack[index - 2]
+        else:  # allocated by the emit functions themselves
+            listener_function, listener_path, line_no = stack[0]
+            listener_function = SELF_TIME_FRAME_IDENTIFIER
+        file_path_short, module = _short_frame(
+            listener_function,
+            listener_path,
+            line_no,
+        )
+        events.append(
+            (f"Event: {event}", f"{file_path_short}: {listener_function}", module),
+        )
+    return events
+
+
+def event_allocations(path: str | Path, extensions: list[str] | None = None) -> dict:
+    """
+    Attribute the memory allocations of a build to the Sphinx events and their listeners.
+
+    Allocated memory gets collected over the whole build and all worker processes. Retained
+    memory was still allocated, when the tracking of the main process ended. Worker processes
+    free all their memory, when they exit.
+    Like for runtimes, allocations of nested events are also part of the outer event.
+
+    :param path: capture of the main process, created with the patched ``EventManager``
+    :param extensions: loaded extensions, to assign the listeners to them
+    :return: dict of ``Event: <name>`` and per listener its extension, allocated bytes,
+        number of allocations and retained bytes
+    """
+    report = {}
+    cache = {}  # (capture, stack id): events of the stack
+
+    def listener_entries(capture: int, record: memray.AllocationRecord) -> list[dict]:
+        entries = cache.get((capture, record.stack_id))
+        if entries is None:
+            entries = []
+            for event, listener, module in stack_events(record.stack_trace()):
+                entry = report.setdefault(event, {}).get(listener)
+                if entry is None:
+                    entry = report[event][listener] = {
+                        "extension": extension_of(module, extensions or []),
+                        "allocated": 0,
+                        "allocations": 0,
+                        "retained": 0,
+                    }
+                entries.append(entry)
+            cache[(capture, record.stack_id)] = entries
+        return entries
+
+    with open_captures(path) as readers:
+        for capture, reader in enumerate(readers):
+            for record in reader.get_allocation_records():
+                if record.allocator in DEALLOCATORS:
+                    continue
+                for entry in listener_entries(capture, record):
+                    entry["allocated"] += record.size
+                    entry["allocations"] += record.n_allocations
+        if readers:
+            for record in readers[0].get_leaked_allocation_records(merge_threads=True):
+                for entry in listener_entries(0, record):
+                    entry["retained"] += record.size
+    return report
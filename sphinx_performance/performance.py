@@ -1,18 +1,43 @@
 """Execute several performance tests."""
+import contextlib
 import csv
+import functools
+import io
 import os.path
-import subprocess
+import sys
+import threading
 import time
+import uuid
 from pathlib import Path
 
 import click
 import rich.table
 from rich import box
+from rich.console import Console
 from rich.style import Style
 
 from sphinx_performance.call import Call
+from sphinx_performance.compare import (
+    compare_results,
+    has_regression,
+    print_comparison,
+)
+from sphinx_performance.config import CACHE_DIR, VENV_CACHE_SIZE
+from sphinx_performance.flamegraph import export_profile_areas
+from sphinx_performance.projectcache import ProjectCache
 from sphinx_performance.projectenv import ProjectEnv
+from sphinx_performance.resultstore import ResultStore, environment_info
+from sphinx_performance.scaling import (
+    complexity_analysis,
+    print_complexity,
+    sweep_values,
+)
+from sphinx_performance.scheduler import CoreBudget, run_ordered
+from sphinx_performance.speedup import parallel_scaling, print_scaling
+from sphinx_performance.stats import OUTLIER_METHODS
+from sphinx_performance.timing import write_docs_csv
 from sphinx_performance.utils import console
+from sphinx_performance.venvs import VenvPool
 
 PROJECTS = {
     "basic": Path(Path(__file__).parent) / "projects" / "basic",
@@ -21,6 +46,8 @@ PROJECTS = {
     "theme": Path(Path(__file__).parent) / "projects" / "theme",
 }
 
+REGRESSION_EXIT_CODE = 3  # Different from errors (1) and usage errors of click (2)
+
 
 @click.command(
     context_settings={
@@ -70,10 +97,12 @@ PROJECTS = {
     help="Opens the project in your browser",
 )
 @click.option(
+    "--flamegraph",
     "--snakeviz",
+    "snakeviz",
     is_flag=True,
     default=False,
-    help="Opens snakeviz view for measured profiles in browser",
+    help="Stores flamegraphs and folded stacks of the profiles of --profile",
 )
 @click.option(
     "--debug",
@@ -94,6 +123,198 @@ PROJECTS = {
     type=str,
     help="CSV file path, which shall store the results.",
 )
+@click.option(
+    "--jobs",
+    default=1,
+    type=int,
+    help="Number of test configurations to run at the same time.",
+)
+@click.option(
+    "--cores",
+    default=None,
+    type=int,
+    help=(
+        "Number of cores the concurrently running builds may use in total. Each build"
+        " counts with its --parallel value. Default: all cores of the machine."
+    ),
+)
+@click.option(
+    "--repeat",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of measured builds per test configuration.",
+)
+@click.option(
+    "--warmup",
+    default=0,
+    type=click.IntRange(min=0),
+    help="Number of builds per test configuration before the measured ones.",
+)
+@click.option(
+    "--outliers",
+    "outlier_method",
+    default="mad",
+    type=click.Choice(OUTLIER_METHODS),
+    help="Outlier detection for repeated builds: median absolute deviation or IQR.",
+)
+@click.option(
+    "--venv/--no-venv",
+    "use_venv",
+    default=True,
+    help=(
+        "Builds in cached virtual environments, one per set of project requirements."
+        " With --no-venv, the requirements get installed into the current environment."
+    ),
+)
+@click.option(
+    "--cache-dir",
+    default=str(CACHE_DIR),
+    type=str,
+    show_default=True,
+    help="Folder for the caches of sphinx-performance.",
+)
+@click.option(
+    "--venv-cache-size",
+    default=VENV_CACHE_SIZE,
+    type=int,
+    show_default=True,
+    help="Maximum size of all cached virtual environments in MB.",
+)
+@click.option(
+    "--project-cache/--no-project-cache",
+    "use_project_cache",
+    default=True,
+    help=(
+        "Reuses generated project sources of earlier runs with the same template"
+        " relevant config."
+    ),
+)
+@click.option(
+    "--generator-workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of processes, which generate the pages of a test project.",
+)
+@click.option(
+    "--store/--no-store",
+    "use_store",
+    default=True,
+    help="Appends each run to the results database, see --results-db.",
+)
+@click.option(
+    "--results-db",
+    default=None,
+    type=str,
+    help=(
+        "SQLite database, which stores all runs. Default: results.sqlite in"
+        " --cache-dir."
+    ),
+)
+@click.option(
+    "--label",
+    default=None,
+    type=str,
+    help="Stores the runs under this name, e.g. to use them as --baseline later.",
+)
+@click.option(
+    "--baseline",
+    default=None,
+    type=str,
+    help=(
+        "Compares the runs with the stored runs of this label or session ID and exits"
+        " with an error, if a measured value regressed."
+    ),
+)
+@click.option(
+    "--threshold",
+    default=5.0,
+    type=click.FloatRange(min=0),
+    show_default=True,
+    help="Allowed change against --baseline in percent, before it is a regression.",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help=(
+        "Measures incremental rebuilds after a full build, instead of full builds."
+        " Before each rebuild, the fraction --changed of all documents gets changed."
+    ),
+)
+@click.option(
+    "--changed",
+    default=[0.1],
+    type=click.FloatRange(min=0, max=1),
+    multiple=True,
+    show_default=True,
+    help="Fraction of documents to change before each incremental rebuild.",
+)
+@click.option(
+    "--slowest-docs",
+    default=10,
+    type=click.IntRange(min=0),
+    show_default=True,
+    help="Number of documents shown in the slowest documents table of each run.",
+)
+@click.option(
+    "--docs-csv",
+    "docs_csv_file",
+    default=None,
+    type=str,
+    help="CSV file path, which shall store the read and write time of each document.",
+)
+@click.option(
+    "--scale",
+    "scale_param",
+    default=None,
+    type=str,
+    help=(
+        "Project parameter to sweep geometrically, e.g. pages, needs, dummies or depth."
+        " Fits complexity models to the measured times."
+    ),
+)
+@click.option(
+    "--scale-start",
+    default=1,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="First value of the --scale sweep.",
+)
+@click.option(
+    "--scale-factor",
+    default=2.0,
+    type=click.FloatRange(min=1, min_open=True),
+    show_default=True,
+    help="Factor between two values of the --scale sweep.",
+)
+@click.option(
+    "--scale-steps",
+    default=5,
+    type=click.IntRange(min=3),
+    show_default=True,
+    help="Number of values of the --scale sweep.",
+)
+@click.option(
+    "--scale-target",
+    default=None,
+    type=click.IntRange(min=1),
+    help=(
+        "Number of documents, for which the build time of --scale gets extrapolated."
+        " If all runs have the same number of documents, a value of the --scale"
+        " parameter instead."
+    ),
+)
+@click.option(
+    "--sample-rate",
+    default=0,
+    type=click.IntRange(min=0),
+    show_default=True,
+    help=(
+        "Samples the call stacks of sphinx-build and its parallel workers this many"
+        " times per CPU second. The stacks of the measured builds get stored as folded"
+        " stacks. 0 deactivates sampling."
+    ),
+)
 @click.pass_context
 def cli_performance(
     ctx,
@@ -107,8 +328,48 @@ def cli_performance(
     debug,
     temp,
     csv_file,
+    jobs,
+    cores,
+    repeat,
+    warmup,
+    outlier_method,
+    use_venv,
+    cache_dir,
+    venv_cache_size,
+    use_project_cache,
+    generator_workers,
+    use_store,
+    results_db,
+    label,
+    baseline,
+    threshold,
+    incremental,
+    changed,
+    slowest_docs,
+    docs_csv_file,
+    scale_param,
+    scale_start,
+    scale_factor,
+    scale_steps,
+    scale_target,
+    sample_rate,
 ):
     """CLI performance handling."""
+    project_args = list(ctx.args)
+    if scale_param:
+        option = f"--{scale_param}"
+        if option in project_args:
+            console.print(f"Ignoring {option}, as it gets swept by --scale.")
+        # Project arguments are pairs of option and value, see Call
+        project_args = [
+            arg
+            for name, value in zip(project_args[::2], project_args[1::2])
+            if name != option
+            for arg in (name, value)
+        ]
+        for value in sweep_values(scale_start, scale_factor, scale_steps):
+            project_args += [option, str(value)]
+
     build_kwargs = {
         "builder": builder,
         "parallel": list(parallel),
@@ -116,54 +377,137 @@ def cli_performance(
         "browser": [browser],
         "snakeviz": [snakeviz],
         "debug": [debug],
+        "incremental": [incremental],
+        "changed": list(changed) if incremental else [0],
+        "sample_rate": [sample_rate],
     }
 
-    call = Call(projects, ctx.args, build_kwargs)
+    call = Call(projects, project_args, build_kwargs)
 
     profile_str = ",".join(profile)
     os.environ["NEEDS_PROFILING"] = profile_str
 
-    console.print(f"\nRunning {call.runs} test configurations.\n")
-    results = []
+    if jobs > 1 and debug:
+        console.print(
+            "[bold red]--debug prints the build output directly to the terminal."
+            " Ignoring --jobs.",
+        )
+        jobs = 1
 
     console.print(f"\nRunning {call.runs} test configurations.\n")
-    results = []
 
-    counter = 1
+    budget = CoreBudget(cores)
+    project_cache = None
+    if use_project_cache:
+        project_cache = ProjectCache(Path(cache_dir) / "projects")
+    venv_pool = None
+    if use_venv:
+        venv_pool = VenvPool(Path(cache_dir) / "venvs", venv_cache_size)
+    output_lock = threading.Lock()
+    result_store = None
+    baseline_runs = None
+    if use_store or baseline:
+        result_store = ResultStore(results_db or Path(cache_dir) / "results.sqlite")
+        session = uuid.uuid4().hex
+        environment = environment_info()
+    if baseline:
+        baseline_runs = result_store.baseline(baseline)
+        if not baseline_runs:
+            console.print(f"[bold red]No stored runs found for baseline {baseline}.")
+            sys.exit(1)
+        console.print(f"Baseline {baseline}: {len(baseline_runs)} stored configs.")
+    if not use_store:
+        result_store = None
+
+    def run_config(counter, project, build_config, project_config):
+        run_console = console
+        if jobs > 1:
+            # Concurrent runs must not mix their output, so each run gets printed
+            # as a whole after it has finished.
+            run_console = Console(
+                file=io.StringIO(),
+                width=console.width,
+                color_system=console.color_system,
+            )
+        try:
+            run_console.rule(f"[bold red]Run {counter}/{call.runs}")
+            project_obj = ProjectEnv(
+                project,
+                call.project_path[project],
+                {**build_config},
+                {**project_config},
+                temp,
+                console=run_console,
+                cache_dir=cache_dir,
+                generator_workers=generator_workers,
+            )
+            if not project_obj.config_is_valid():
+                run_console.print("Errors in configuration. Skipping this run.")
+                return None
+
+            with budget.reserve(generator_workers):
+                project_obj.prepare_project(project_cache)
+
+            if venv_pool is not None:
+                deps = project_obj.use_venv(venv_pool)
+            else:
+                # The installation modifies the used Python environment,
+                # so no other build is allowed to run meanwhile.
+                with budget.reserve_all():
+                    project_obj.install_dependencies()
+                deps = contextlib.nullcontext()
+
+            with deps, budget.reserve(project_obj.build_config["parallel"]):
+                result, extra_results, samples = project_obj.build_external(
+                    repeat,
+                    warmup,
+                    outlier_method,
+                    slowest_docs,
+                )
+
+            project_obj.post_processing()
+        finally:
+            if jobs > 1:
+                with output_lock:
+                    console.file.write(run_console.file.getvalue())
+                    console.file.flush()
+
+        config = {**project_obj.project_config}
+        config["parallel"] = project_obj.build_config["parallel"]
+        config["builder"] = project_obj.build_config["builder"]
+        if incremental:
+            config["changed"] = project_obj.build_config["changed"]
+        run_result = {
+            "project": project,
+            "result": result,
+            "config": config,
+            "info": project_obj.extra_info,
+            "extra": extra_results,
+            "samples": samples,
+            "docs": project_obj.doc_times,
+            "packages": project_obj.packages,
+        }
+        if result_store is not None:
+            result_store.add_run(run_result, session, environment, label)
+        return run_result
+
+    tasks = []
     for project in projects:
         for build_config in call.build_configs:
             for project_config in call.project_configs:
-                console.rule(f"[bold red]Run {counter}/{call.runs}")
-                project_obj = ProjectEnv(
-                    project,
-                    call.project_path[project],
-                    build_config,
-                    project_config,
-                    temp,
-                )
-                if not project_obj.config_is_valid():
-                    console.print("Errors in configuration. Skipping this run.")
-                    continue
-                project_obj.prepare_project()
-                project_obj.install_dependencies()
-
-                result, extra_results = project_obj.build_external()
-
-                project_obj.post_processing()
-
-                config = {**project_obj.project_config}
-                config["parallel"] = project_obj.build_config["parallel"]
-                config["builder"] = project_obj.build_config["builder"]
-                results.append(
-                    {
-                        "project": project,
-                        "result": result,
-                        "config": config,
-                        "info": project_obj.extra_info,
-                        "extra": extra_results,
-                    },
+                tasks.append(
+                    functools.partial(
+                        run_config,
+                        len(tasks) + 1,
+                        project,
+                        build_config,
+                        project_config,
+                    ),
                 )
-                counter += 1
+
+    start_time = time.time()
+    results = [result for result in run_ordered(tasks, jobs) if result is not None]
+    wall_time = time.time() - start_time
 
     console.rule("[bold red]RESULTS")
 
@@ -178,7 +522,7 @@ def cli_performance(
         found_keys = []
         for result in results:
             found_keys += result[key]
-        all_keys[key] = set(found_keys)
+        all_keys[key] = list(dict.fromkeys(found_keys))  # unique, but keep the order
 
     # Result matrix
     matrix = []
@@ -231,8 +575,28 @@ def cli_performance(
         table.add_row(*row, style=style)
 
     console.print(table)
-    overall_runtime = sum(x["result"] for x in results)
+    overall_runtime = sum(
+        sample["total"] for result in results for sample in result["samples"]
+    )
     console.print(f"\nOverall runtime: {overall_runtime:.2f} seconds.")
+    if jobs > 1:
+        console.print(f"Wall time with {jobs} jobs: {wall_time:.2f} seconds.")
+
+    scaling = parallel_scaling(results, outlier_method)
+    if scaling:
+        console.rule("[bold red]PARALLEL SCALING")
+        print_scaling(console, scaling)
+
+    if scale_param:
+        complexity = complexity_analysis(
+            results,
+            scale_param,
+            scale_target,
+            outlier_method,
+        )
+        if complexity:
+            console.rule("[bold red]SCALING")
+            print_complexity(console, complexity, scale_target)
 
     if csv_file:
         try:
@@ -245,18 +609,34 @@ def cli_performance(
         else:
             console.print(f"CSV file stored: {csv_file}")
 
+    if result_store is not None:
+        console.print(f"Results stored: {result_store.path} (session {session})")
+
+    if docs_csv_file:
+        docs_runs = [
+            (
+                {"run": run, "project": result["project"], **result["config"]},
+                result["docs"],
+            )
+            for run, result in enumerate(results, start=1)
+        ]
+        write_docs_csv(docs_csv_file, docs_runs)
+        console.print(f"Documents CSV file stored: {docs_csv_file}")
+
+    regression = False
+    if baseline_runs is not None:
+        console.rule("[bold red]COMPARISON")
+        comparisons = compare_results(results, baseline_runs, threshold, outlier_method)
+        print_comparison(console, comparisons, threshold, environment["host"])
+        regression = has_regression(comparisons)
+
     if snakeviz:
-        console.print("\nStarting snakeviz servers\n")
-        procs = []
-        for p in profile:
-            proc = subprocess.Popen(["snakeviz", f"profile/{p}.prof"])
-            procs.append(proc)
+        export_profile_areas(profile)
 
-        console.print(f"\nKilling snakeviz server in {len(procs)*5} secs.")
-        time.sleep(len(procs) * 5)
-        for proc in procs:
-            proc.kill()
+    if regression:
+        console.print(f"[bold red]Regression against baseline {baseline} found.")
+        sys.exit(REGRESSION_EXIT_CODE)
 
 
-if "main" in __name__:
+if __name__ == "__main__":
     cli_performance()
@@ -0,0 +1,102 @@
+"""
+Cache of generated test project sources.
+
+Generating big test projects can take longer than building them. As the generated sources only
+depend on the test project templates and some of the config values, later runs with the same
+values get a copy of the already generated sources.
+"""
+from __future__ import annotations
+
+import contextlib
+import os
+import shutil
+import sys
+import threading
+import uuid
+from pathlib import Path
+from typing import Callable
+
+COMPLETE_MARKER = ".sphinx-performance-complete"
+
+# Linux ioctl request to share the data blocks of two files (copy-on-write)
+FICLONE = 0x40049409
+
+
+class ProjectCache:
+    """
+    Store generated project sources by a key and materialize them into new folders.
+
+    The files of a cached project get reflinked into the target folder, if the file system
+    supports it. Otherwise they get hard linked, and only if this is also not possible, copied.
+    Hard linked files share their content with the cache, so they must not be modified in place.
+    """
+
+    def __init__(self, root: str | Path) -> None:
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._reflink_supported = sys.platform.startswith("linux")
+
+    def provide(self, key: str, generate: Callable[[Path], None]) -> tuple[Path, bool]:
+        """
+        Return the cached project sources for ``key``.
+
+        If they do not exist yet, ``generate`` gets called with an empty folder to fill.
+
+        :return: (path of the cached sources, True if the sources were already cached)
+        """
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        path = self.root / key
+        with key_lock:
+            if (path / COMPLETE_MARKER).exists():
+                return path, True
+
+            # Generate into a temporary folder, so that an aborted generation never
+            # leaves an incomplete project behind.
+            tmp_path = self.root / f"{key}.tmp-{uuid.uuid4().hex}"
+            tmp_path.mkdir()
+            try:
+                generate(tmp_path)
+                (tmp_path / COMPLETE_MARKER).touch()
+                shutil.rmtree(path, ignore_errors=True)
+                tmp_path.rename(path)
+            finally:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            return path, False
+
+    def materialize(self, path: Path, target: str | Path):
+        """Copy the cached project sources from ``path`` into the ``target`` folder."""
+        shutil.copytree(
+            path,
+            target,
+            dirs_exist_ok=True,
+            copy_function=self._link_file,
+            ignore=shutil.ignore_patterns(COMPLETE_MARKER),
+        )
+
+    def _link_file(self, src: str, dst: str):
+        if self._reflink_supported:
+            try:
+                _reflink(src, dst)
+            except OSError:
+                # Not supported by this file system, so do not try it again.
+                self._reflink_supported = False
+                with contextlib.suppress(FileNotFoundError):
+                    Path(dst).unlink()
+            else:
+                return
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+
+def _reflink(src: str, dst: str):
+    import fcntl  # only available on Unix
+
+    with Path(src).open("rb") as src_file, Path(dst).open("wb") as dst_file:
+        fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
@@ -1,30 +1,89 @@
 from __future__ import annotations
 
 import cProfile
+import hashlib
 import importlib
+import json
+import math
 import os.path
+import re
 import shutil
+import statistics
 import subprocess
 import sys
 import tempfile
 import time
 import webbrowser
-from contextlib import suppress
+from collections import Counter
+from contextlib import contextmanager, suppress
 from pathlib import Path
+from typing import TYPE_CHECKING
 from unittest.mock import patch
 
 import memray
-from jinja2 import Template
+import rich.table
+from jinja2 import meta
 from pyinstrument import Profiler
+from rich import box
+from rich.style import Style
 from sphinx.application import Sphinx
 
-from sphinx_performance.config import MEMORY_PROFILE, MEMRAY_PORT
-from sphinx_performance.sphinx_events import EventManager
-from sphinx_performance.utils import console
+from sphinx_performance import sampler_hook, timing_extension
+from sphinx_performance.buildoutput import PHASES, PhaseTimeline, read_lines
+from sphinx_performance.config import CACHE_DIR, MEMORY_PROFILE, MEMRAY_PORT
+from sphinx_performance.flamegraph import render_svg
+from sphinx_performance.folded import merge_folded, write_folded
+from sphinx_performance.generator import ProjectGenerator, template_environment
+from sphinx_performance.memory import (
+    event_allocations,
+    memory_summary,
+    remove_worker_captures,
+)
+from sphinx_performance.resources import (
+    MB,
+    RESOURCE_METRICS,
+    resource_metrics,
+    sample_process_tree,
+    wait_with_rusage,
+)
+from sphinx_performance.sphinx_events import (
+    EventManager,
+    ListenerTimingEventManager,
+    listener_report,
+)
+from sphinx_performance.stats import summarize
+from sphinx_performance.timing import (
+    doc_times,
+    event_phases,
+    load_records,
+    outdated_docs,
+    percentiles,
+    phase_intervals,
+)
+from sphinx_performance.utils import console as default_console
+from sphinx_performance.venvs import package_versions
+from sphinx_performance.worker_profiler import WorkerProfiler
+
+if TYPE_CHECKING:
+    from rich.console import Console
+
+    from sphinx_performance.projectcache import ProjectCache
+    from sphinx_performance.venvs import VenvPool
 
 NEED_CONFIG_DEFAULT = ["pages", "folders", "depth"]
 
-GLOBAL_PAGE_COUNTER = 0  # Needed for unique IDs in recursive creation functions
+STAT_METRICS = ["total", "reading", "writing"]  # Measured values with statistics
+COUNT_METRICS = ["outdated docs"]  # Measured values, which are no durations
+
+TIMING_EXTENSION = "sphinx_performance_timing"  # Module name inside the test projects
+TIMING_FILE = ".sphinx-performance-timing.jsonl"  # Recorded events of the last build
+SAMPLER_DIR = ".sphinx-performance-sampler"  # Injected sampler and its sampled stacks
+
+DOC_PERCENTILES = [10, 25, 50, 75, 90, 95, 99, 100]
+HISTOGRAM_WIDTH = 40  # Characters of the longest bar
+
+# Increase, if the generated sources change for the same config
+PROJECT_CACHE_VERSION = 2
 
 
 class ProjectEnv:
@@ -41,11 +100,15 @@ class ProjectEnv:
         build_config: str,
         project_config: str,
         temp: str | None = None,
+        console: Console | None = None,
+        cache_dir: str | Path = CACHE_DIR,
+        generator_workers: int = 1,
     ) -> None:
         if temp is not None and not Path.exists(temp):
             msg = f"Given temp folder does not exist: {temp}"
             raise ProjectException(msg)
 
+        self.console = console or default_console
         self.project = project
         self.project_path = project_path
         self.build_config = build_config
@@ -57,6 +120,7 @@ class ProjectEnv:
 
         self.target_path = tempfile.mkdtemp(dir=temp)
         self.target_build_path = Path(self.target_path) / "_build"
+        self.timing_path = Path(self.target_path) / TIMING_FILE
         self.target_index_path = Path(self.target_build_path) / "index.html"
         self.target_req_path = Path(self.target_path) / "requirements.txt"
 
@@ -75,6 +139,29 @@ class ProjectEnv:
 
         self.extra_info = {}
 
+        # Templates get loaded from the original project, so that the bytecode cache
+        # can identify them across runs.
+        self.jinja_cache_path = Path(cache_dir) / "jinja"
+        self.jinja_cache_path.mkdir(parents=True, exist_ok=True)
+        self.jinja_env = template_environment(
+            str(self.source_path),
+            str(self.jinja_cache_path),
+        )
+        self.generator_workers = generator_workers
+        self.generation_stats = None
+        self.doc_times = {}  # Read and write time per document of the last build
+        # Runtime per event and listener, see listener_report()
+        self.listener_times = {}
+        # Peaks of the main process and its workers, see memory_summary()
+        self.memory_summary = {}
+        # Allocations per event and listener, see event_allocations()
+        self.memory_events = {}
+        # Sampled stacks of the measured external builds, see sampler_hook
+        self.stack_samples = Counter()
+        self.sample_file = None
+        self._changes = 0  # Number of document changes for incremental builds
+        self.packages = {}  # Installed packages of the build environment
+
         # Some path checks
         if not Path(self.pip_path).exists:
             msg = f'Could not found "pip" in calculated path: {self.pip_path}'
@@ -88,7 +175,7 @@ class ProjectEnv:
 
     def config_is_valid(self) -> bool:
         if not Path(self.source_perf_conf_path).exists:
-            console.print("performance.py file not found")
+            self.console.print("performance.py file not found")
             return False
 
         try:
@@ -99,7 +186,7 @@ class ProjectEnv:
             per_conf = importlib.util.module_from_spec(spec)
             spec.loader.exec_module(per_conf)
         except ImportError:
-            console.print("performance.py file could not be imported: {e}")
+            self.console.print("performance.py file could not be imported: {e}")
             return False
 
         ref_params = per_conf.references
@@ -107,7 +194,7 @@ class ProjectEnv:
             try:
                 conf_params = ref_params[self.project_config["ref"]]
             except KeyError:
-                console.print(
+                self.console.print(
                     f"Reference '{self.project_config['ref']}' is unknown. "
                     f"Available for the project '{self.project}' are  "
                     f"{', '.join(ref_params.keys())}",
@@ -126,13 +213,13 @@ class ProjectEnv:
                 if default is not None:
                     self.project_config[param] = default
                 else:
-                    console.print("Missing parameter {param} in given config")
+                    self.console.print("Missing parameter {param} in given config")
                     passed = False
 
         # Check if the config we need to create files and folders are given.
         for needed_conf in NEED_CONFIG_DEFAULT:
             if needed_conf not in self.project_config:
-                console.print(
+                self.console.print(
                     f'Needed parameter "{needed_conf}" not provided by user and'
                     " test project default",
                 )
@@ -159,93 +246,18 @@ class ProjectEnv:
 
         return passed
 
-    def _render_file(
-        self,
-        source: str,
-        target: str,
-        has_folders=False,
-        **kwargs,
-    ) -> None:
-        """
-        Render a given template and store the result in a new file.
-
-        :param source: template path
-        :param target: target path
-        :param kwargs: any kind of keyword arguments, which shall be available in the template
-        :return: None
-
-        """
-        global GLOBAL_PAGE_COUNTER
-        GLOBAL_PAGE_COUNTER += 1
-
-        source_tmp_path = Path(self.target_path) / source
-        source_tmp_path_final = Path(self.target_path) / target
-        template = Template(Path(source_tmp_path).read_text())
-        rendered = template.render(
-            **self.project_config,
-            **self.build_config,
-            **self.internal_data,
-            has_folders=has_folders,
-            global_page=GLOBAL_PAGE_COUNTER,
-            **kwargs,
-        )
-        with Path(source_tmp_path_final).open(mode="w") as file:
-            file.write(rendered)
-
-    def _create_pages(self, folder: str = "", **kwargs):
-        for p in range(self.project_config["pages"]):
-            title = f"Page {p}"
-            file_path = Path(folder) / f"page_{p}.rst"
-
-            self._render_file("page.template", file_path, title=title, page=p, **kwargs)
-
-    def _create_folders(self, folder_root: str, current_depth: int = 1) -> None:
-        """
-        Create folders and needed rst-files in it.
-
-        Depending up on "depth", sub-folders will be created as well.
-
-        :param folder_root: The current folder path to deal with
-        :param current_depth: The currently reached depth of the folder structure
-        :return: None
-        """
-        current_folder_path = Path(self.target_path) / folder_root
-
-        for f in range(self.project_config["folders"]):
-            new_folder_path = Path(current_folder_path) / f"folder_{f}"
-            Path(new_folder_path).mkdir()
-            self._create_pages(new_folder_path, current_depth=current_depth)
-
-            index_path = Path(new_folder_path) / "index.rst"
-            self._render_file("index.template", index_path)
-
-            title = f"Index folder {f} depth {current_depth}"
-            if current_depth < self.project_config["depth"]:
-                self._render_file(
-                    "index.template",
-                    index_path,
-                    has_folders=True,
-                    title=title,
-                )
-                self._create_folders(new_folder_path, current_depth + 1)
-            else:
-                self._render_file(
-                    "index.template",
-                    index_path,
-                    has_folders=False,
-                    title=title,
-                )
-
-    def prepare_project(self):
+    def prepare_project(self, project_cache: ProjectCache | None = None):
         """
         Build a project environment in a temporary directory.
 
         Create the temporary source folder, copy all needed files and call Jinja2 for some of them.
+
+        :param project_cache: If given, generated sources get reused from and stored in it
         """
         # Calculate extra infos
         start_time = time.time()
         for name, result in self.extra_info.items():
-            template = Template(result)
+            template = self.jinja_env.from_string(result)
             self.extra_info[name] = template.render(
                 **self.project_config,
                 **self.build_config,
@@ -255,51 +267,115 @@ class ProjectEnv:
         conf_str = ", ".join(
             [f"{key}: {value}" for key, value in self.project_config.items()],
         )
-        console.print(f"[bold]Project[/bold]:\t {self.project}")
-        console.print(f"[bold]Core/s[/bold]:\t\t {self.build_config['parallel']}")
-        console.print(f"[bold]Builder[/bold]:\t {self.build_config['builder']}")
-        console.print(f"[bold]Config[/bold]:\t\t {conf_str}")
+        self.console.print(f"[bold]Project[/bold]:\t {self.project}")
+        self.console.print(f"[bold]Core/s[/bold]:\t\t {self.build_config['parallel']}")
+        self.console.print(f"[bold]Builder[/bold]:\t {self.build_config['builder']}")
+        self.console.print(f"[bold]Config[/bold]:\t\t {conf_str}")
         info_str = ", ".join(
             [f"{key}: {value}" for key, value in self.extra_info.items()],
         )
-        console.print(f"[bold]Info[/bold]:\t\t {info_str}")
-
-        console.print(f"\n[bold]Docs path[/bold]:\t {self.target_path}")
-        with console.status("Setting up documentation environment"):
-            shutil.copytree(self.source_path, self.target_path, dirs_exist_ok=True)
-
-            # Render files
-            self._render_file("requirements.template", "requirements.txt")
-            self._render_file("conf.template", "conf.py")
-
-            title = "Performance Test main index"
-            if self.project_config["folders"] > 0 and self.project_config["depth"] > 0:
-                self._render_file(
-                    "index.template",
-                    "index.rst",
-                    has_folders=True,
-                    title=title,
-                )
+        self.console.print(f"[bold]Info[/bold]:\t\t {info_str}")
+
+        self.console.print(f"\n[bold]Docs path[/bold]:\t {self.target_path}")
+        with self.console.status("Setting up documentation environment"):
+            if project_cache is None:
+                self._generate_project(self.target_path)
             else:
-                self._render_file(
-                    "index.template",
-                    "index.rst",
-                    has_folders=False,
-                    title=title,
+                cache_path, cached = project_cache.provide(
+                    self._source_key(),
+                    self._generate_project,
                 )
-
-            # Render and create pages on test project "root"
-            self._create_pages(current_depth=0)
-
-            self._create_folders("", 1)
+                project_cache.materialize(cache_path, self.target_path)
+                cache_str = "reused" if cached else "generated"
+                self.console.print(
+                    f"[bold]Docs cache[/bold]:\t {cache_str} {cache_path}",
+                )
+            self._inject_timing_extension()
         end_time = time.time()
         result_time = end_time - start_time
         file_data = self._calculate_file_numbers(self.target_path, [".md", ".rst"])
         size = file_data["size_kb"]
         file_data["max_size_kb"]
         data_str = f"{file_data['count']} rst files with {size:.2f} kB"
-        console.print(f"[bold]Docs files[/bold]:\t {data_str}")
-        console.print(f"[bold]Docs setup[/bold]:\t {result_time:.2f} s\n")
+        self.console.print(f"[bold]Docs files[/bold]:\t {data_str}")
+        if self.generation_stats:
+            stats = self.generation_stats
+            self.console.print(
+                f"[bold]Docs pages[/bold]:\t {stats['pages']} pages in"
+                f" {stats['duration']:.2f} s, {stats['pages_per_second']:.0f} pages/s"
+                f" with {self.generator_workers} worker/s",
+            )
+            self.console.print(
+                f"[bold]Docs setup[/bold]:\t {result_time:.2f} s (template compile"
+                f" {stats['compile']:.2f} s, render {stats['render']:.2f} s)\n",
+            )
+        else:
+            self.console.print(f"[bold]Docs setup[/bold]:\t {result_time:.2f} s\n")
+
+    def _generate_project(self, path: str | Path):
+        """Copy the test project to ``path`` and render all files of it."""
+        shutil.copytree(self.source_path, path, dirs_exist_ok=True)
+
+        generator = ProjectGenerator(
+            self.source_path,
+            {**self.project_config, **self.build_config, **self.internal_data},
+            self.jinja_cache_path,
+            self.generator_workers,
+        )
+        self.generation_stats = generator.generate(path)
+
+    def _inject_timing_extension(self):
+        """
+        Add the timing extension to the test project.
+
+        The extension gets copied next to ``conf.py`` and appended to its extensions.
+        ``conf.py`` may be linked to the project cache, so it gets replaced and not modified.
+        """
+        target_path = Path(self.target_path)
+        shutil.copyfile(
+            timing_extension.__file__,
+            target_path / f"{TIMING_EXTENSION}.py",
+        )
+
+        conf_path = target_path / "conf.py"
+        conf = conf_path.read_text()
+        conf += (
+            "\n\n# -- Added by sphinx-performance --\n"
+            "import sys as _sys\n"
+            "from pathlib import Path as _Path\n\n"
+            "_sys.path.insert(0, str(_Path(__file__).parent))\n"
+            f'extensions = [*globals().get("extensions", []), "{TIMING_EXTENSION}"]\n'
+        )
+        conf_path.unlink()
+        conf_path.write_text(conf)
+
+    def _source_key(self) -> str:
+        """
+        Identify the generated sources by the test project files and the used config values.
+
+        Config values not used by any template, like ``parallel`` or ``builder``, do not change
+        the generated sources, so they are not part of the key. The values read by
+        :class:`ProjectGenerator` and the internal data are always part of it, as they
+        define the generated folders and pages.
+        """
+        context = {**self.project_config, **self.build_config, **self.internal_data}
+        used_names = {*NEED_CONFIG_DEFAULT, *self.internal_data}
+
+        hasher = hashlib.sha256(f"{PROJECT_CACHE_VERSION}".encode())
+        for path in sorted(Path(self.source_path).rglob("*")):
+            if not path.is_file() or "__pycache__" in path.parts:
+                continue
+            content = path.read_bytes()
+            name = path.relative_to(self.source_path).as_posix()
+            hasher.update(f"{name}\0{len(content)}\0".encode())
+            hasher.update(content)
+            if path.suffix == ".template":
+                template_ast = self.jinja_env.parse(content.decode("utf8"))
+                used_names |= meta.find_undeclared_variables(template_ast)
+
+        values = {name: context[name] for name in sorted(used_names) if name in context}
+        hasher.update(json.dumps(values, sort_keys=True, default=str).encode())
+        return hasher.hexdigest()[:20]
 
     def _calculate_file_numbers(self, folder, file_types=None):
         if file_types is None:
@@ -343,82 +419,101 @@ class ProjectEnv:
         start_time = time.time()
 
         if self.build_config["debug"]:
-            console.rule("Installing dependencies START", style="blue")
+            self.console.rule("Installing dependencies START", style="blue")
             subprocess.call(dep_command)
-            console.rule("Installing dependencies FINISHED", style="blue")
+            self.console.rule("Installing dependencies FINISHED", style="blue")
         else:
-            with console.status("Installing dependencies"):
+            with self.console.status("Installing dependencies"):
                 subprocess.call(dep_command, stdout=subprocess.DEVNULL)
         end_time = time.time()
         result_time = end_time - start_time
-        console.print(f"[bold]Deps setup[/bold]:\t {result_time:.2f} s")
+        self.console.print(f"[bold]Deps setup[/bold]:\t {result_time:.2f} s")
+        self.packages = package_versions(sys.executable)
 
-    def build_external(self):
+    @contextmanager
+    def use_venv(self, venv_pool: VenvPool):
         """
-        Build copied Sphinx project via subprocess.
+        Use a cached virtual environment with the project requirements for the builds.
 
-        Mostly used by sphinx-performance cli command.
+        Alternative to :meth:`install_dependencies`, which installs the requirements into
+        the currently used Python environment.
         """
-        if self.build_config["browser"]:
-            self.build_config["keep"] = True
-
-        params = [
-            str(self.sphinx_path),
-            "-a",
-            "-E",
-            "-v",
-            "-j",
-            str(self.build_config["parallel"]),
-            "-b",
-            str(self.build_config["builder"]),
-            str(self.target_path),
-            str(self.target_build_path),
-        ]
-
-        if self.build_config["debug"]:
-            console.print(f'Call:\t\t {" ".join(params)} ')
-
         start_time = time.time()
-        if self.build_config["debug"]:
-            console.rule("Building documentation START", style="blue")
-            subprocess.run(params)
-            console.rule("Building documentation FINISHED", style="blue")
-        else:
-            status_str = "Building documentation"
-            status = console.status(status_str)
-            with status:
-                process = subprocess.Popen(params, stdout=subprocess.PIPE)
-
-                reading_start_time = None
-                reading_stop_time = None
+        with venv_pool.acquire(
+            Path(self.target_req_path).read_text(),
+            debug=self.build_config["debug"],
+            console=self.console,
+        ) as env:
+            if not env.sphinx_path.exists():
+                msg = (
+                    f'Could not find "sphinx-build" in virtual environment: {env.path}'
+                )
+                raise ProjectException(msg)
+            self.sphinx_path = env.sphinx_path
+            self.packages = env.packages
 
-                writing_start_time = None
-                writing_stop_time = None
+            end_time = time.time()
+            result_time = end_time - start_time
+            self.console.print(f"[bold]Deps setup[/bold]:\t {result_time:.2f} s")
+            self.console.print(f"[bold]Venv path[/bold]:\t {env.path}")
+            yield env
 
-                while True:
-                    # Measure reading and writing time
-                    line = process.stdout.readline()
-                    line = line.decode("utf8")
-                    if "reading sources" in line:
-                        if reading_start_time is None:
-                            reading_start_time = time.time()
-                        reading_stop_time = time.time()
+    def build_external(
+        self,
+        repeat: int = 1,
+        warmup: int = 0,
+        outlier_method="mad",
+        slowest_docs: int = 10,
+    ):
+        """
+        Build copied Sphinx project via subprocess.
 
-                    if "writing output" in line:
-                        if writing_start_time is None:
-                            writing_start_time = time.time()
-                        writing_stop_time = time.time()
+        Mostly used by sphinx-performance cli command.
 
-                    # Check if project has finished
-                    if process.poll() is not None:
-                        break
+        :param repeat: Number of measured builds
+        :param warmup: Number of builds before the measured ones, which results get ignored
+        :param outlier_method: Outlier detection for repeated builds, "mad" or "iqr"
+        :param slowest_docs: Number of documents to print in the slowest documents table
+        :return: (build time, formatted extra results, list of measured values per build)
 
-                    # Update build time counter
-                    current_time = time.time() - start_time
-                    status.update(f"{status_str} {current_time:.2f} s")
-                    time.sleep(0.005)
+        If ``incremental`` is set in the build config, a full build gets executed first.
+        Then each measured build is an incremental rebuild after changing the fraction
+        ``changed`` of all documents.
+        """
+        if self.build_config["browser"]:
+            self.build_config["keep"] = True
 
-        end_time = time.time()
+        incremental = self.build_config.get("incremental", False)
+        changed_docs = 0
+        if incremental:
+            full_sample, _ = self._build_external_once("Full build")
+
+        def build_once(label):
+            nonlocal changed_docs
+            if incremental:
+                changed_docs = self._change_docs(self.build_config["changed"])
+            return self._build_external_once(label, incremental=incremental)
+
+        for run in range(warmup):
+            build_once(f"Warmup {run + 1}/{warmup}")
+
+        samples = []
+        doc_samples = []
+        self.stack_samples.clear()  # Only the measured builds shall be sampled
+        for run in range(repeat):
+            label = f"Build {run + 1}/{repeat}" if repeat > 1 else ""
+            sample, docs = build_once(label)
+            samples.append(sample)
+            doc_samples.append(docs)
+        self.doc_times = {
+            docname: {
+                key: statistics.median(
+                    docs.get(docname, times)[key] for docs in doc_samples
+                )
+                for key in times
+            }
+            for docname, times in doc_samples[-1].items()
+        }
 
         file_data = self._calculate_file_numbers(self.target_build_path, [])
         size = file_data["size_kb"]
@@ -426,27 +521,19 @@ class ProjectEnv:
         min_size = file_data["min_size_kb"]
         data_str = f"{file_data['count']} files with {size:.2f} kB"
 
-        if not self.build_config["debug"]:
-            # Errors may happen here, if reading/writing could not be detected.
-            # Maybe because of different output based of other builders.
-            try:
-                reading_time = reading_stop_time - reading_start_time
-            except TypeError:
-                reading_time = 0
-            try:
-                writing_time = writing_stop_time - writing_start_time
-            except TypeError:
-                writing_time = 0
-        else:
-            reading_time = 0
-            writing_time = 0
+        summaries = {
+            metric: summarize([sample[metric] for sample in samples], outlier_method)
+            for metric in STAT_METRICS
+        }
+        result_time = summaries["total"]["median"]
+        reading_time = summaries["reading"]["median"]
+        writing_time = summaries["writing"]["median"]
 
-        result_time = end_time - start_time
-        console.print(f"\n[bold]Build files[/bold]:\t {data_str}")
-        console.print(
+        self.console.print(f"\n[bold]Build files[/bold]:\t {data_str}")
+        self.console.print(
             f"[bold]File max️[/bold]:\t  {max_size:.2f} kB by {file_data['max_file']}",
         )
-        console.print(
+        self.console.print(
             f"[bold]File min[/bold]:\t {min_size:.2f} kB by {file_data['min_file']}",
         )
 
@@ -457,34 +544,335 @@ class ProjectEnv:
             time_per_file = 0
             size_per_file = 0
 
-        console.print(
+        self.console.print(
             f"[bold]File Ø[/bold]:\t\t {size_per_file:.2f} kB ({time_per_file:.2f} s)",
         )
-        console.print(f"[bold]Reading time[/bold]:\t {reading_time:.2f} s")
-        console.print(f"[bold]Writing time[/bold]:\t {writing_time:.2f} s")
-        console.print(
+        if repeat > 1:
+            for metric, summary in summaries.items():
+                self.console.print(
+                    f"[bold]{metric.capitalize()} time[/bold]:\t"
+                    f" {self._format_summary(summary)}",
+                )
+        else:
+            self.console.print(f"[bold]Reading time[/bold]:\t {reading_time:.2f} s")
+            self.console.print(f"[bold]Writing time[/bold]:\t {writing_time:.2f} s")
+        # Phases depend on the available measurements, see _build_external_once()
+        phases = dict.fromkeys(key for sample in samples for key in sample)
+        phase_times = {
+            phase: statistics.median(sample.get(phase, 0) for sample in samples)
+            for phase in phases
+            if phase != "total"
+            and phase not in COUNT_METRICS
+            and phase not in RESOURCE_METRICS
+        }
+        phases_str = ", ".join(
+            f"{phase} {phase_time:.2f} s"
+            for phase, phase_time in phase_times.items()
+            if phase_time
+        )
+        self.console.print(f"[bold]Phases[/bold]:\t {phases_str or '-'}")
+        resources = {
+            metric: statistics.median(sample[metric] for sample in samples)
+            for metric in RESOURCE_METRICS
+            if all(metric in sample for sample in samples)
+        }
+        if "cpu user" in resources:
+            cpu_time = resources["cpu user"] + resources["cpu system"]
+            self.console.print(
+                f"[bold]CPU time[/bold]:\t {cpu_time:.2f} s"
+                f" (user {resources['cpu user']:.2f} s,"
+                f" system {resources['cpu system']:.2f} s,"
+                f" Ø {cpu_time / result_time:.2f} cores)",
+            )
+        if "peak rss" in resources:
+            self.console.print(
+                f"[bold]Memory[/bold]:\t peak {resources['peak rss']:.0f} MB,"
+                f" Ø {resources['avg rss']:.0f} MB,"
+                f" largest worker {resources['worker peak rss']:.0f} MB"
+                f" ({resources['worker cpu']:.2f} s CPU)",
+            )
+        if incremental:
+            outdated = statistics.median(sample["outdated docs"] for sample in samples)
+            env_load_time = phase_times.get("loading", 0)
+            self.console.print(
+                f"[bold]Full build[/bold]:\t {full_sample['total']:.2f} s",
+            )
+            self.console.print(
+                f"[bold]Changed docs[/bold]:\t {changed_docs}, outdated {outdated:.0f}",
+            )
+            self.console.print(f"[bold]Env load time[/bold]:\t {env_load_time:.2f} s")
+        self.console.print(
             f"[bold red]Build Duration[/bold red]:\t [bold red]{result_time:.2f} s",
         )
 
+        if self.stack_samples:
+            self.sample_file = Path(f"stacks_{self._run_name()}.folded")
+            write_folded(self.stack_samples, self.sample_file)
+            svg_file = self.sample_file.with_suffix(".svg")
+            svg_file.write_text(
+                render_svg(self.stack_samples, self._run_name(), unit="samples"),
+                encoding="utf8",
+            )
+            self.console.print(
+                f"[bold]Stack samples[/bold]:\t {sum(self.stack_samples.values())}"
+                f" stored in {self.sample_file}, flamegraph {svg_file}",
+            )
+
+        self.print_slowest_docs(slowest_docs)
+
+        self._cleanup()
+
+        extra_results = {}
+        if repeat > 1:
+            for metric, summary in summaries.items():
+                extra_results.update(
+                    {
+                        f"{metric} min": f"{summary['min']:.2f} s",
+                        f"{metric} median": f"{summary['median']:.2f} s",
+                        f"{metric} mean": f"{summary['mean']:.2f} s",
+                        f"{metric} stddev": f"{summary['stddev']:.3f} s",
+                        f"{metric} 95% CI": (
+                            f"{summary['ci_low']:.2f} - {summary['ci_high']:.2f} s"
+                        ),
+                        f"{metric} outliers": (
+                            f"{len(summary['outliers'])}/{summary['n']}"
+                        ),
+                    },
+                )
+        else:
+            extra_results.update(
+                {
+                    "reading time": f"{reading_time:.2f} s",
+                    "writing time": f"{writing_time:.2f} s",
+                },
+            )
+        if incremental:
+            extra_results.update(
+                {
+                    "full build time": f"{full_sample['total']:.2f} s",
+                    "changed docs": f"{changed_docs}",
+                    "outdated docs": f"{outdated:.0f}",
+                },
+            )
+        extra_results.update(
+            {
+                f"{phase} time": f"{phase_time:.2f} s"
+                for phase, phase_time in phase_times.items()
+                if phase not in STAT_METRICS and phase_time
+            },
+        )
+        extra_results.update(
+            {
+                metric: f"{value:.2f} s" if "cpu" in metric else f"{value:.0f} MB"
+                for metric, value in resources.items()
+            },
+        )
+        if self.sample_file is not None:
+            extra_results["stack samples"] = str(self.sample_file)
+        extra_results.update(
+            {
+                "folder size": f"{size:.2f} kB",
+                "# files": f'{file_data["count"]}',
+                "avg file time": f"{time_per_file:.2f} s",
+                "avg file size": f"{size_per_file:.2f} kB",
+                "max file size": f"{max_size:.2f} kB",
+                "min file size": f"{min_size:.2f} kB",
+            },
+        )
+
+        if self.doc_times:
+            doc_totals = {
+                docname: times["read"] + times["write"]
+                for docname, times in self.doc_times.items()
+            }
+            doc_percentiles = percentiles(list(doc_totals.values()), [50, 95])
+            slowest_doc = max(doc_totals, key=doc_totals.get)
+            extra_results.update(
+                {
+                    "doc time p50": f"{doc_percentiles[50]:.3f} s",
+                    "doc time p95": f"{doc_percentiles[95]:.3f} s",
+                    "slowest doc": f"{slowest_doc} ({doc_totals[slowest_doc]:.3f} s)",
+                },
+            )
+
+        return result_time, extra_results, samples
+
+    @staticmethod
+    def _format_summary(summary: dict) -> str:
+        outliers = ""
+        if summary["outliers"]:
+            outliers = (
+                f", [bold yellow]{len(summary['outliers'])} outlier/s[/bold yellow]"
+            )
+        return (
+            f"median {summary['median']:.2f} s, min {summary['min']:.2f} s,"
+            f" mean {summary['mean']:.2f} s ± {summary['stddev']:.3f} s,"
+            f" 95% CI {summary['ci_low']:.2f} - {summary['ci_high']:.2f} s{outliers}"
+        )
+
+    def _change_docs(self, fraction: float) -> int:
+        """
+        Change the given fraction of all documents, so that an incremental build reads them.
+
+        The documents get picked evenly distributed over the project and each call appends
+        a new comment to them. Files may be linked to the project cache, so they get
+        replaced and not modified.
+
+        :return: Number of changed documents
+        """
+        docs = sorted(
+            path
+            for path in Path(self.target_path).rglob("*.rst")
+            if self.target_build_path not in path.parents
+        )
+        amount = min(len(docs), math.ceil(fraction * len(docs)))
+        self._changes += 1
+        for i in range(amount):
+            path = docs[i * len(docs) // amount]
+            content = path.read_text()
+            content += f"\n\n.. sphinx-performance change {self._changes}\n"
+            path.unlink()
+            path.write_text(content)
+        return amount
+
+    def _build_external_once(
+        self,
+        label: str = "",
+        *,
+        incremental: bool = False,
+    ) -> tuple[dict, dict]:
+        """
+        Execute a single sphinx-build call and measure it.
+
+        The phase durations get calculated from the events recorded by the timing extension.
+        If no events got recorded, e.g. as the build failed early, the phases get detected
+        from the output of sphinx-build.
+
+        :param label: Printed in front of the measured time, e.g. to name the repetition
+        :param incremental: Reuse the build folder and environment of the last build
+        :return: (dict of measured values, read and write time per document)
+        """
+        params = [str(self.sphinx_path)]
+        if not incremental:
+            # Each full build shall start from the same, empty build folder
+            shutil.rmtree(self.target_build_path, ignore_errors=True)
+            params += ["-a", "-E"]
+        params += [
+            "-v",
+            "-j",
+            str(self.build_config["parallel"]),
+            "-b",
+            str(self.build_config["builder"]),
+            str(self.target_path),
+            str(self.target_build_path),
+        ]
+
+        if self.build_config["debug"]:
+            self.console.print(f'Call:\t\t {" ".join(params)} ')
+
+        self.timing_path.unlink(missing_ok=True)
+        env = {**os.environ, timing_extension.TIMING_FILE_ENV: str(self.timing_path)}
+        sample_rate = self.build_config.get("sample_rate")
+        if sample_rate:
+            env.update(self._sampler_env(sample_rate))
+
+        # Phases can not be detected, if the output is not captured
+        durations = {phase: 0.0 for phase, _ in PHASES}
+        start_time = time.perf_counter()
+        if self.build_config["debug"]:
+            self.console.rule("Building documentation START", style="blue")
+            process = subprocess.Popen(params, env=env)
+            with sample_process_tree(process.pid) as sampler:
+                return_code, rusage = wait_with_rusage(process)
+            self.console.rule("Building documentation FINISHED", style="blue")
+        else:
+            status_str = f"{label} Building documentation".strip()
+            status = self.console.status(status_str)
+            with status:
+                process = subprocess.Popen(
+                    params,
+                    stdout=subprocess.PIPE,
+                    env=env,
+                )
+                timeline = PhaseTimeline(start_time)
+                with sample_process_tree(process.pid) as sampler:
+                    for timestamp, line in read_lines(process):
+                        if line is not None:
+                            timeline.add_line(timestamp, line)
+                        # Update build time counter
+                        current_time = timestamp - start_time
+                        status.update(
+                            f"{status_str} {current_time:.2f} s ({timeline.current})",
+                        )
+                    return_code, rusage = wait_with_rusage(process)
+            if return_code:
+                self.console.print(
+                    f"[bold red]sphinx-build failed with exit code {return_code}",
+                )
+
+        end_time = time.perf_counter()
+        if not self.build_config["debug"]:
+            durations = timeline.durations(end_time)
+
+        # The phases by the recorded events are exact, so they get used if available
+        records = load_records(self.timing_path)
+        event_durations = event_phases(records, start_time, end_time)
+        if event_durations:
+            durations = event_durations
+
+        result_time = end_time - start_time
+        if label:
+            self.console.print(f"[bold]{label}[/bold]:\t {result_time:.2f} s")
+
+        if sample_rate:
+            stacks_path = Path(self.target_path) / SAMPLER_DIR / "stacks"
+            self.stack_samples.update(
+                merge_folded(sorted(stacks_path.glob("*.folded"))),
+            )
+
+        sample = {
+            "total": result_time,
+            **durations,
+            "outdated docs": outdated_docs(records),
+            **resource_metrics(sampler, rusage),
+        }
+        return sample, doc_times(records)
+
+    def _sampler_env(self, rate: int) -> dict:
+        """
+        Inject the stack sampler into sphinx-build and its workers, see :mod:`.sampler_hook`.
+
+        :param rate: Samples per second of consumed CPU time
+        :return: Environment variables for the build
+        """
+        sampler_path = Path(self.target_path) / SAMPLER_DIR
+        shutil.rmtree(sampler_path, ignore_errors=True)
+        (sampler_path / "stacks").mkdir(parents=True)
+        shutil.copyfile(sampler_hook.__file__, sampler_path / "sitecustomize.py")
+        python_paths = [str(sampler_path), os.environ.get("PYTHONPATH")]
+        return {
+            "PYTHONPATH": os.pathsep.join(path for path in python_paths if path),
+            sampler_hook.SAMPLER_DIR_ENV: str(sampler_path / "stacks"),
+            sampler_hook.SAMPLER_RATE_ENV: str(rate),
+        }
+
+    def _run_name(self) -> str:
+        """Return a file name part, which identifies the project, its config and -j."""
+        parts = [
+            self.project,
+            *(f"{key}-{value}" for key, value in self.project_config.items()),
+            f"j{self.build_config['parallel']}",
+        ]
+        return re.sub(r"[^\w.-]", "-", "_".join(parts))
+
+    def _cleanup(self):
+        """Delete the temporary project, if it shall not be kept."""
         if not self.build_config["keep"]:
             if self.build_config["debug"]:
-                console.print(f"\nDeleting project {self.target_build_path}")
+                self.console.print(f"\nDeleting project {self.target_build_path}")
             shutil.rmtree(self.target_build_path)
             shutil.rmtree(self.target_path)
 
-        extra_results = {
-            "reading time": f"{reading_time:.2f} s",
-            "writing time": f"{writing_time:.2f} s",
-            "folder size": f"{size:.2f} kB",
-            "# files": f'{file_data["count"]}',
-            "avg file time": f"{time_per_file:.2f} s",
-            "avg file size": f"{size_per_file:.2f} kB",
-            "max file size": f"{max_size:.2f} kB",
-            "min file size": f"{min_size:.2f} kB",
-        }
-
-        return result_time, extra_results
-
     def build_internal(
         self,
         use_memray=False,
@@ -503,10 +891,21 @@ class ProjectEnv:
         if self.build_config["browser"]:
             self.build_config["keep"] = True
 
+        timing_env = {timing_extension.TIMING_FILE_ENV: str(self.timing_path)}
         start_time = time.time()
+        perf_start_time = time.perf_counter()
+
+        apps = []
 
         def init_sphinx_and_start_wrap():
+            # Several profilers build one after another, only the last build counts
+            self.timing_path.unlink(missing_ok=True)
+
             def init_sphinx_and_start():
+                with patch.dict(os.environ, timing_env):
+                    return start_sphinx()
+
+            def start_sphinx():
                 app = Sphinx(
                     srcdir=self.target_path,
                     confdir=self.target_path,
@@ -515,11 +914,25 @@ class ProjectEnv:
                     buildername=str(self.build_config["builder"]),
                     parallel=int(self.build_config["parallel"]),
                 )
+                apps.append(app)
                 return app.build()
 
-            if use_sphinx_events:
+            if use_sphinx_events and (use_pyinstrument or use_memray):
                 with patch("sphinx.application.EventManager", EventManager):
                     return init_sphinx_and_start()
+            elif use_sphinx_events:
+                # Without a profiler, the listeners measure their runtime on their own
+                with tempfile.TemporaryDirectory() as dump_dir, patch(
+                    "sphinx.application.EventManager",
+                    ListenerTimingEventManager,
+                ), patch.object(ListenerTimingEventManager, "dump_dir", dump_dir):
+                    status_code = init_sphinx_and_start()
+                    app = apps[-1]
+                    self.listener_times = listener_report(
+                        app.events.measured_times(),
+                        list(app.extensions),
+                    )
+                    return status_code
             else:
                 return init_sphinx_and_start()
 
@@ -529,12 +942,14 @@ class ProjectEnv:
 
         status_code = 0
         if use_memray:
+            # Each forked worker writes its own capture, named MEMORY_PROFILE.<pid>
+            remove_worker_captures(MEMORY_PROFILE)
             memray_file = memray.FileDestination(path=MEMORY_PROFILE, overwrite=True)
-            with memray.Tracker(destination=memray_file):
+            with memray.Tracker(destination=memray_file, follow_fork=True):
                 status_code = init_sphinx_and_start_wrap()
 
         if use_memray_live:
-            console.print(
+            self.console.print(
                 "Sphinx-Performance if waiting for a memray-listener.\n[bold]Now"
                 f" it's time to execute '[red]memray live {MEMRAY_PORT}[/red]' in"
                 " another terminal.",
@@ -543,18 +958,169 @@ class ProjectEnv:
             with memray.Tracker(destination=memray_port):
                 status_code = init_sphinx_and_start_wrap()
 
+        if not any((use_runtime, use_memray, use_memray_live, use_pyinstrument)):
+            status_code = init_sphinx_and_start_wrap()
+
         if use_pyinstrument:
             profiler = Profiler()
             import inspect
 
             profiler.start(caller_frame=inspect.currentframe().f_back)
-            status_code = init_sphinx_and_start_wrap()
-            profile = profiler.stop()  # Returns a pyinstrument session
+            # Parallel workers get forked and profiled by their own profilers
+            with tempfile.TemporaryDirectory() as dump_dir:
+                worker_profiler = WorkerProfiler(profiler, dump_dir)
+                status_code = init_sphinx_and_start_wrap()
+                profile = worker_profiler.combine(profiler.stop())
 
         end_time = time.time()
+        perf_end_time = time.perf_counter()
         build_time = end_time - start_time
+        records = load_records(self.timing_path)
+        self.doc_times = doc_times(records)
+        if use_memray:
+            # memray uses the system time, the timing records the monotonic clock
+            offset = end_time - perf_end_time
+            phases = {
+                phase: (phase_start + offset, phase_end + offset)
+                for phase, (phase_start, phase_end) in phase_intervals(
+                    records,
+                    perf_start_time,
+                    perf_end_time,
+                ).items()
+            }
+            self.memory_summary = memory_summary(MEMORY_PROFILE, phases)
+            if use_sphinx_events and apps:
+                self.memory_events = event_allocations(
+                    MEMORY_PROFILE,
+                    list(apps[-1].extensions),
+                )
         return status_code, build_time, profile
 
+    def print_slowest_docs(self, amount: int = 10):
+        """
+        Print the slowest documents of the last build and the percentiles of all documents.
+
+        :param amount: Number of documents to print, 0 prints nothing
+        """
+        if not amount or not self.doc_times:
+            return
+
+        doc_totals = {
+            docname: times["read"] + times["write"]
+            for docname, times in self.doc_times.items()
+        }
+        slowest = sorted(doc_totals, key=doc_totals.get, reverse=True)[:amount]
+
+        table = rich.table.Table(
+            title=f"Slowest documents ({len(slowest)} of {len(doc_totals)})",
+            box=box.ROUNDED,
+        )
+        table.add_column("#", justify="right")
+        table.add_column("document")
+        table.add_column("read", justify="right")
+        table.add_column("write", justify="right")
+        table.add_column("total", justify="right", style=Style(bold=True))
+        for position, docname in enumerate(slowest, start=1):
+            times = self.doc_times[docname]
+            table.add_row(
+                str(position),
+                docname,
+                f"{times['read']:.3f} s",
+                f"{times['write']:.3f} s",
+                f"{doc_totals[docname]:.3f} s",
+            )
+        self.console.print(table)
+
+        # Percentile histogram of the read + write time of all documents
+        doc_percentiles = percentiles(list(doc_totals.values()), DOC_PERCENTILES)
+        max_time = doc_percentiles[100] or 1
+        self.console.print("[bold]Document time percentiles[/bold]:")
+        for point, value in doc_percentiles.items():
+            bar = "█" * max(1, round(value / max_time * HISTOGRAM_WIDTH))
+            self.console.print(f"  p{point:<3}\t {value:.3f} s\t {bar}")
+
+    def print_slowest_listeners(self, amount: int = 10):
+        """
+        Print the event listeners with the highest total runtime of the last build.
+
+        :param amount: Number of listeners to print, 0 prints nothing
+        """
+        if not amount or not self.listener_times:
+            return
+
+        listeners = [
+            (event, name, measured)
+            for event, event_listeners in self.listener_times.items()
+            for name, measured in event_listeners.items()
+        ]
+        listeners.sort(key=lambda listener: listener[2]["total"], reverse=True)
+
+        table = rich.table.Table(
+            title=(
+                f"Slowest event listeners ({min(amount, len(listeners))} of"
+                f" {len(listeners)})"
+            ),
+            box=box.ROUNDED,
+        )
+        table.add_column("event")
+        table.add_column("listener")
+        table.add_column("extension")
+        table.add_column("calls", justify="right")
+        table.add_column("mean", justify="right")
+        table.add_column("max", justify="right")
+        table.add_column("total", justify="right", style=Style(bold=True))
+        for event, name, measured in listeners[:amount]:
+            table.add_row(
+                event.split(": ", 1)[-1],
+                name,
+                measured["extension"],
+                str(measured["calls"]),
+                f"{measured['mean'] * 1000:.3f} ms",
+                f"{measured['max'] * 1000:.3f} ms",
+                f"{measured['total']:.3f} s",
+            )
+        self.console.print(table)
+
+    def print_largest_listener_allocations(self, amount: int = 10):
+        """
+        Print the event listeners, which allocated the most memory in the last build.
+
+        :param amount: Number of listeners to print, 0 prints nothing
+        """
+        if not amount or not self.memory_events:
+            return
+
+        listeners = [
+            (event, name, measured)
+            for event, event_listeners in self.memory_events.items()
+            for name, measured in event_listeners.items()
+        ]
+        listeners.sort(key=lambda listener: listener[2]["allocated"], reverse=True)
+
+        table = rich.table.Table(
+            title=(
+                f"Largest allocating event listeners ({min(amount, len(listeners))} of"
+                f" {len(listeners)})"
+            ),
+            box=box.ROUNDED,
+        )
+        table.add_column("event")
+        table.add_column("listener")
+        table.add_column("extension")
+        table.add_column("allocations", justify="right")
+        table.add_column("retained", justify="right")
+        table.add_column("allocated", justify="right", style=Style(bold=True))
+        for event, name, measured in listeners[:amount]:
+            table.add_row(
+                event.split(": ", 1)[-1],
+                name,
+                measured["extension"],
+                str(measured["allocations"]),
+                f"{measured['retained'] / MB:.2f} MB",
+                f"{measured['allocated'] / MB:.2f} MB",
+            )
+        self.console.print(table)
+
     def post_processing(self):
         if self.build_config["browser"]:
             with suppress(Exception):
@@ -1,30 +1,44 @@
 """Overwrite pyinstrument HTMLRenderer so it accepts a JSON object."""
+from __future__ import annotations
 
+import functools
 import inspect
+import json
 from pathlib import Path
+from typing import TYPE_CHECKING
 
+from pyinstrument.frame import Frame
+from pyinstrument.frame_info import frame_info_get_identifier
 from pyinstrument.renderers.html import HTMLRenderer
 
+if TYPE_CHECKING:
+    from pyinstrument.session import Session
 
-class HTMLRendererFromJson(HTMLRenderer):
-    def render(self, session_json: str):
-        path_html_renderer = inspect.getfile(HTMLRenderer)
-        resources_dir = Path(path_html_renderer).parent / "html_resources"
 
-        js_file = resources_dir / "app.js"
-        css_file = resources_dir / "app.css"
+@functools.lru_cache(maxsize=None)
+def app_resources() -> tuple[str, str]:
+    """Return the JavaScript and CSS of pyinstrument's HTML view, read only once."""
+    path_html_renderer = inspect.getfile(HTMLRenderer)
+    resources_dir = Path(path_html_renderer).parent / "html_resources"
 
-        if not js_file.exists() or not css_file.exists():
-            msg = (
-                "Could not find app.js / app.css. Perhaps you need to run"
-                " bin/build_js_bundle.py?"
-            )
-            raise RuntimeError(
-                msg,
-            )
+    js_file = resources_dir / "app.js"
+    css_file = resources_dir / "app.css"
+
+    if not js_file.exists() or not css_file.exists():
+        msg = (
+            "Could not find app.js / app.css. Perhaps you need to run"
+            " bin/build_js_bundle.py?"
+        )
+        raise RuntimeError(
+            msg,
+        )
 
-        js = js_file.read_text()
-        css = css_file.read_text()
+    return js_file.read_text(encoding="utf-8"), css_file.read_text(encoding="utf-8")
+
+
+class HTMLRendererFromJson(HTMLRenderer):
+    def render(self, session_json: str):
+        js, css = app_resources()
 
         return f"""<!DOCTYPE html>
             <html>
@@ -44,3 +58,185 @@ class HTMLRendererFromJson(HTMLRenderer):
             </body>
             </html>
         """
+
+
+def _package(file_path_short: str | None) -> str:
+    """Return the top level package of a frame, e.g. ``docutils`` or ``importlib``."""
+    if not file_path_short:
+        return ""
+    if file_path_short.startswith("<frozen "):
+        return file_path_short[len("<frozen ") : -1].split(".")[0]
+    return file_path_short.split("/")[0].split(".")[0]
+
+
+class ScalableHTMLRenderer:
+    """
+    Render the tree view of big pyinstrument sessions, which would crash the browser.
+
+    Unlike :class:`HTMLRendererFromJson`, the tree gets pruned while it is built from the
+    samples, so neither pyinstrument's frame tree nor its JSON get created for the whole
+    session. The tree is streamed as compact JSON into a data file next to the HTML file,
+    which loads it after the page is shown. The data file is a script, as browsers block
+    loading other files from pages opened via ``file://``.
+
+    :param filter_threshold: remove frames with a smaller share of the total time, e.g.
+        ``0.01``. Their time stays in their parent.
+    :param max_depth: remove frames deeper in the tree, ``0`` keeps all of them
+    :param collapse: top level packages, e.g. ``docutils``. Frames of these packages called
+        by each other get merged into the first one, frames of other packages called by
+        them are kept.
+    """
+
+    def __init__(
+        self,
+        filter_threshold: float = 0.0,
+        max_depth: int = 0,
+        collapse: list[str] | None = None,
+    ) -> None:
+        self.filter_threshold = filter_threshold
+        self.max_depth = max_depth
+        self.collapse = set(collapse or [])
+
+    def build_tree(self, session: Session) -> list:
+        """
+        Return the pruned tree of the session.
+
+        A node is a list of its time, its children by identifier and the frame info of its
+        first sample. The root node has no frame info and contains the top frames.
+        """
+        root = [0.0, {}, None]
+        packages = {}  # frame info: (identifier, collapsed)
+        # The frames, which started the profiler, are the same for all samples
+        stem = [
+            frame_info_get_identifier(info) for info in session.start_call_stack[:-1]
+        ]
+
+        for frame_info_stack, time in session.frame_records:
+            prefix = map(frame_info_get_identifier, frame_info_stack[: len(stem)])
+            start = len(stem) if stem and list(prefix) == stem else 0
+            node = root
+            node[0] += time
+            depth = 0
+            parent_collapsed = False
+            for frame_info in frame_info_stack[start:]:
+                details = packages.get(frame_info)
+                if details is None:
+                    frame = Frame(frame_info)
+                    details = packages[frame_info] = (
+                        frame.identifier,
+                        _package(frame.file_path_short) in self.collapse,
+                    )
+                identifier, collapsed = details
+                if collapsed and parent_collapsed:
+                    continue
+                if self.max_depth and depth >= self.max_depth:
+                    break
+                parent_collapsed = collapsed
+                depth += 1
+                child = node[1].get(identifier)
+                if child is None:
+                    child = node[1][identifier] = [0.0, {}, frame_info]
+                child[0] += time
+                node = child
+        return root
+
+    def _frame_json(self, node: list) -> str:
+        frame = Frame(node[2])
+        properties = {
+            "function": frame.function,
+            "file_path_short": frame.file_path_short or "",
+            "file_path": frame.file_path or "",
+            "line_no": frame.line_no or 0,
+            "time": node[0],
+            "await_time": 0.0,
+            "is_application_code": frame.is_application_code,
+        }
+        if frame.class_name:
+            properties["class_name"] = frame.class_name
+        # The children get written after it
+        return json.dumps(properties, separators=(",", ":"))[:-1] + ',"children":['
+
+    def write_tree(self, session: Session, root: list, data_file) -> None:
+        """
+        Write the tree as compact JSON in the format of pyinstrument's ``JSONRenderer``.
+
+        The frames get written one by one, without recursion, as the tree can be deeper
+        than the recursion limit of Python.
+        """
+        top_frames = list(root[1].values())
+        if len(top_frames) == 1:
+            root = top_frames[0]
+        elif top_frames:
+            root = [root[0], root[1], "[root]\x00\x000"]
+        min_time = root[0] * self.filter_threshold
+        # pyinstrument renamed program to target_description in 4.6
+        description = getattr(session, "target_description", None) or session.program
+        session_data = {
+            "start_time": session.start_time,
+            "duration": session.duration,
+            "sample_count": session.sample_count,
+            "target_description": description,
+            "program": description,
+            "cpu_time": session.cpu_time or 0.0,
+        }
+        data_file.write(json.dumps(session_data, separators=(",", ":"))[:-1])
+        if not top_frames:
+            data_file.write(',"root_frame":null}')
+            return
+
+        data_file.write(',"root_frame":')
+        pending = ["}", root]
+        while pending:
+            item = pending.pop()
+            if isinstance(item, str):
+                data_file.write(item)
+                continue
+            data_file.write(self._frame_json(item))
+            pending.append("]}")
+            children = sorted(
+                (child for child in item[1].values() if child[0] >= min_time),
+                key=lambda child: child[0],
+            )
+            for index, child in enumerate(children):
+                pending.append(child)
+                if index < len(children) - 1:
+                    pending.append(",")
+
+    def render_to_file(self, session: Session, path: str | Path) -> Path:
+        """
+        Write the HTML file and its data file ``<name>.data.js`` next to it.
+
+        :return: path of the data file
+        """
+        path = Path(path)
+        data_path = path.with_name(f"{path.stem}.data.js")
+        root = self.build_tree(session)
+        with data_path.open("w", encoding="utf-8") as data_file:
+            data_file.write("window.sessionData = ")
+            self.write_tree(session, root, data_file)
+            data_file.write(";\n")
+
+        js, css = app_resources()
+        with path.open("w", encoding="utf-8") as html_file:
+            html_file.write(
+                '<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+                f"<style>{css}</style>\n</head>\n<body>\n"
+                '<div id="app">Loading the profile ...</div>\n<script>',
+            )
+            html_file.write(js)
+            html_file.write(
+                "</script>\n<script>\n"
+                "const app = document.getElementById('app');\n"
+                "const data = document.createElement('script');\n"
+                f"data.src = {json.dumps(data_path.name)};\n"
+                "data.onload = () => {\n"
+                "    app.textContent = '';\n"
+                "    pyinstrumentHTMLRenderer.render(app, window.sessionData);\n"
+                "};\n"
+                "data.onerror = () => {\n"
+                "    app.textContent = 'Could not load ' + data.src;\n"
+                "};\n"
+                "document.body.appendChild(data);\n"
+                "</script>\n</body>\n</html>\n",
+            )
+        return data_path
@@ -0,0 +1,185 @@
+"""
+Measure the CPU time and memory of a process and all its child processes.
+
+``sphinx-build -j N`` forks worker processes, which are not visible in the resource usage of
+the main process. So the whole process tree gets sampled via ``/proc`` while the build is
+running, and the exact CPU time of the tree gets taken from ``os.wait4()`` after it finished.
+Both are only available on Linux, respectively Unix. On other systems no values get reported.
+"""
+from __future__ import annotations
+
+import contextlib
+import os
+import statistics
+import sys
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import subprocess
+
+SAMPLE_INTERVAL = 0.05  # seconds between two samples of the process tree
+PROC_SUPPORTED = Path("/proc/self/stat").exists()
+
+MB = 1024 * 1024
+
+# Measured values, which get added to the samples of a build
+RESOURCE_METRICS = [
+    "cpu user",
+    "cpu system",
+    "peak rss",
+    "avg rss",
+    "worker peak rss",
+    "worker cpu",
+]
+
+
+def _read_process(pid: int) -> dict | None:
+    """Return the current and peak RSS in bytes and the CPU time of a process."""
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+        status = Path(f"/proc/{pid}/status").read_text()
+    except OSError:  # already finished
+        return None
+
+    # The process name may contain spaces and brackets, so split after its end
+    fields = stat[stat.rindex(")") + 2 :].split()
+    clock_ticks = os.sysconf("SC_CLK_TCK")
+    cpu = (int(fields[11]) + int(fields[12])) / clock_ticks  # utime + stime
+    rss = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+
+    peak_rss = rss
+    for line in status.splitlines():
+        if line.startswith("VmHWM:"):
+            peak_rss = max(peak_rss, int(line.split()[1]) * 1024)
+            break
+    return {"rss": rss, "peak_rss": peak_rss, "cpu": cpu}
+
+
+def _children(pid: int) -> list[int]:
+    """Return the IDs of the direct child processes."""
+    children = []
+    try:
+        tasks = list(Path(f"/proc/{pid}/task").iterdir())
+    except OSError:
+        return children
+    for task in tasks:
+        with contextlib.suppress(OSError):
+            children += [
+                int(child) for child in (task / "children").read_text().split()
+            ]
+    return children
+
+
+class ProcessTreeSampler:
+    """
+    Sample the RSS and CPU time of a process and all its descendants in a background thread.
+
+    Use :func:`sample_process_tree`, to run it while the process is running.
+    """
+
+    def __init__(self, pid: int, interval: float = SAMPLE_INTERVAL) -> None:
+        self.pid = pid
+        self.interval = interval
+        self.tree_rss = []  # Summed RSS of all processes, per sample
+        self.processes = {}  # pid: {"peak_rss": bytes, "cpu": seconds}
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """Start sampling in the background, if ``/proc`` is available."""
+        if PROC_SUPPORTED:
+            self._thread.start()
+
+    def stop(self):
+        """Stop sampling and wait for the last sample."""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def _tree(self) -> list[int]:
+        pids = [self.pid]
+        for pid in pids:  # pids grows while iterating, so all levels get visited
+            pids += _children(pid)
+        return pids
+
+    def sample(self):
+        total_rss = 0
+        for pid in self._tree():
+            values = _read_process(pid)
+            if values is None:
+                continue
+            total_rss += values["rss"]
+            process = self.processes.setdefault(pid, {"peak_rss": 0, "cpu": 0.0})
+            process["peak_rss"] = max(process["peak_rss"], values["peak_rss"])
+            process["cpu"] = values["cpu"]
+        if total_rss:
+            self.tree_rss.append(total_rss)
+
+
+@contextlib.contextmanager
+def sample_process_tree(pid: int, interval: float = SAMPLE_INTERVAL):
+    """Sample the process tree of ``pid`` in the background, until the context exits."""
+    sampler = ProcessTreeSampler(pid, interval)
+    sampler.start()
+    try:
+        yield sampler
+    finally:
+        sampler.stop()
+
+
+def wait_with_rusage(process: subprocess.Popen) -> tuple[int, object | None]:
+    """
+    Wait for the process to finish and return its exit code and resource usage.
+
+    The resource usage contains the process and all its descendants, which it waited for.
+    So it is exact for this process only, even if other builds run at the same time.
+    """
+    if not hasattr(os, "wait4"):  # Windows
+        return process.wait(), None
+    try:
+        _, status, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError:  # already reaped by someone else
+        return process.wait(), None
+
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    return process.returncode, rusage
+
+
+def resource_metrics(sampler: ProcessTreeSampler, rusage: object | None) -> dict:
+    """
+    Calculate the resource usage of a build.
+
+    :return: dict with CPU times in seconds and RSS in MB, empty if nothing got measured
+    """
+    metrics = {}
+    max_rss = 0
+    if rusage is not None:
+        metrics["cpu user"] = rusage.ru_utime
+        metrics["cpu system"] = rusage.ru_stime
+        # Peak RSS of the largest single process of the tree, macOS reports bytes
+        max_rss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+    if sampler.tree_rss:
+        metrics["peak rss"] = max(sampler.tree_rss) / MB
+        metrics["avg rss"] = statistics.fmean(sampler.tree_rss) / MB
+    if sampler.processes:
+        worker = max(
+            sampler.processes.values(),
+            key=lambda process: process["peak_rss"],
+        )
+        metrics["worker peak rss"] = max(worker["peak_rss"], max_rss) / MB
+        metrics["worker cpu"] = worker["cpu"]
+    elif max_rss:
+        metrics["worker peak rss"] = max_rss / MB
+    return metrics
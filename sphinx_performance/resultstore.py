@@ -0,0 +1,308 @@
+"""
+Persistent store of all measured runs.
+
+Each run of **sphinx-performance** gets appended to a SQLite database, together with its
+full config, the installed packages, the git commit and the host it was measured on.
+The measured values are stored as numbers per build, so trends can be queried later.
+"""
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import time
+from importlib import metadata
+from pathlib import Path
+
+SCHEMA_VERSION = 1
+# Shorter names of a baseline only match labels, not the first characters of a session
+MIN_SESSION_PREFIX = 6
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    session TEXT NOT NULL,
+    label TEXT,
+    project TEXT NOT NULL,
+    ref TEXT,
+    builder TEXT NOT NULL,
+    parallel INTEGER NOT NULL,
+    config_key TEXT NOT NULL,
+    config TEXT NOT NULL,
+    info TEXT NOT NULL,
+    packages TEXT NOT NULL,
+    git_sha TEXT,
+    git_dirty INTEGER,
+    host TEXT NOT NULL,
+    host_info TEXT NOT NULL,
+    python TEXT NOT NULL,
+    version TEXT
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    sample INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_project ON runs(project, ref, parallel, created);
+CREATE INDEX IF NOT EXISTS runs_config ON runs(config_key, created);
+CREATE INDEX IF NOT EXISTS runs_session ON runs(session);
+CREATE INDEX IF NOT EXISTS runs_label ON runs(label, created);
+CREATE INDEX IF NOT EXISTS samples_run ON samples(run_id, metric);
+"""
+
+
+def config_key(project: str, config: dict) -> str:
+    """Identify a test configuration, so that runs of it can be found again."""
+    data = json.dumps({"project": project, **config}, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()[:16]
+
+
+def host_info() -> dict:
+    """Return the properties of the host, which influence the measured times."""
+    info = {
+        "node": platform.node(),
+        "system": platform.system(),
+        "release": platform.release(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "memory": None,
+    }
+    with contextlib.suppress(ValueError, OSError, AttributeError):
+        info["memory"] = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    return info
+
+
+def git_state(path: str | Path = ".") -> tuple[str | None, bool | None]:
+    """Return the commit SHA of the git repository at ``path`` and if it has changes."""
+    try:
+        sha = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=path,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=path,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return sha, bool(status)
+
+
+def environment_info() -> dict:
+    """Collect the values, which are the same for all runs of a call."""
+    host = host_info()
+    git_sha, git_dirty = git_state()
+    try:
+        version = metadata.version("sphinx-performance")
+    except metadata.PackageNotFoundError:
+        version = None
+    return {
+        "host": hashlib.sha256(
+            json.dumps(host, sort_keys=True).encode(),
+        ).hexdigest()[:16],
+        "host_info": host,
+        "git_sha": git_sha,
+        "git_dirty": git_dirty,
+        "python": platform.python_version(),
+        "version": version,
+    }
+
+
+class ResultStore:
+    """
+    Append runs to a SQLite database and query them.
+
+    Each call opens its own connection, so the store can be used from several threads.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        # SQLite ignores ON DELETE CASCADE of the samples unless enabled per connection
+        connection.execute("PRAGMA foreign_keys = ON")
+        try:
+            with connection:  # commits or rolls back
+                yield connection
+        finally:
+            connection.close()
+
+    def add_run(
+        self,
+        result: dict,
+        session: str,
+        environment: dict,
+        label: str | None = None,
+    ) -> int:
+        """
+        Store a single run.
+
+        :param result: run result of sphinx-performance, with project, config, info,
+            packages and the measured samples
+        :param session: identifies all runs of the same call
+        :param environment: see :func:`environment_info`
+        :param label: name of the run set, e.g. to use it as baseline later
+        :return: id of the stored run
+        """
+        config = result["config"]
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "INSERT INTO runs (created, session, label, project, ref, builder,"
+                " parallel, config_key, config, info, packages, git_sha, git_dirty,"
+                " host, host_info, python, version)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    time.time(),
+                    session,
+                    label,
+                    str(result["project"]),
+                    config.get("ref"),
+                    str(config["builder"]),
+                    int(config["parallel"]),
+                    config_key(result["project"], config),
+                    json.dumps(config, sort_keys=True, default=str),
+                    json.dumps(result["info"], sort_keys=True, default=str),
+                    json.dumps(result.get("packages", {}), sort_keys=True),
+                    environment["git_sha"],
+                    environment["git_dirty"],
+                    environment["host"],
+                    json.dumps(environment["host_info"], sort_keys=True),
+                    environment["python"],
+                    environment["version"],
+                ),
+            )
+            run_id = cursor.lastrowid
+            connection.executemany(
+                "INSERT INTO samples (run_id, sample, metric, value)"
+                " VALUES (?, ?, ?, ?)",
+                [
+                    (run_id, index, metric, float(value))
+                    for index, sample in enumerate(result["samples"])
+                    for metric, value in sample.items()
+                ],
+            )
+        return run_id
+
+    def query(
+        self,
+        *,
+        project: str | None = None,
+        ref: str | None = None,
+        builder: str | None = None,
+        parallel: int | None = None,
+        host: str | None = None,
+        session: str | None = None,
+        label: str | None = None,
+        since: float | None = None,
+        metric: str = "total",
+    ) -> list[dict]:
+        """
+        Return all runs matching the given filters, the oldest first.
+
+        :param since: Unix timestamp of the oldest run to return
+        :param metric: measured values of this metric get returned as ``values``
+        :return: list of runs with all stored columns, config, info and packages as dict
+        """
+        filters = {
+            "project = ?": project,
+            "ref = ?": ref,
+            "builder = ?": builder,
+            "parallel = ?": parallel,
+            "host = ?": host,
+            "session = ?": session,
+            "label = ?": label,
+            "created >= ?": since,
+        }
+        conditions = [key for key, value in filters.items() if value is not None]
+        params = [value for value in filters.values() if value is not None]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT * FROM runs {where} ORDER BY created",  # noqa: S608 fixed columns
+                params,
+            ).fetchall()
+            runs = []
+            for row in rows:
+                run = dict(row)
+                for column in ("config", "info", "packages", "host_info"):
+                    run[column] = json.loads(run[column])
+                run["values"] = [
+                    value
+                    for (value,) in connection.execute(
+                        "SELECT value FROM samples WHERE run_id = ? AND metric = ?"
+                        " ORDER BY sample",
+                        (run["id"], metric),
+                    )
+                ]
+                runs.append(run)
+        return runs
+
+    def samples(self, run_id: int) -> list[dict]:
+        """Return the measured values of each build of a run, like they got stored."""
+        samples = {}
+        with self._connect() as connection:
+            for sample, metric, value in connection.execute(
+                "SELECT sample, metric, value FROM samples WHERE run_id = ?"
+                " ORDER BY sample",
+                (run_id,),
+            ):
+                samples.setdefault(sample, {})[metric] = value
+        return list(samples.values())
+
+    def baseline(self, name: str) -> dict:
+        """
+        Return the newest run of each config of a baseline.
+
+        Labels are matched exactly. Only if no run has the label, the runs of the session
+        starting with the name are returned, if the name has at least
+        ``MIN_SESSION_PREFIX`` characters. ``session:<id>`` matches sessions only.
+
+        :param name: label of the runs, ``session:<id>``, or the first characters of the
+            ID of a session
+        :return: dict of config key and run, incl. its ``samples``
+        """
+        session = name[len("session:") :] if name.startswith("session:") else None
+        with self._connect() as connection:
+            rows = []
+            if session is None:
+                rows = connection.execute(
+                    "SELECT * FROM runs WHERE label = ? ORDER BY created",
+                    (name,),
+                ).fetchall()
+                if not rows and len(name) >= MIN_SESSION_PREFIX:
+                    session = name
+            if session:
+                rows = connection.execute(
+                    "SELECT * FROM runs WHERE substr(session, 1, ?) = ? ORDER BY"
+                    " created",
+                    (len(session), session),
+                ).fetchall()
+        runs = {}
+        for row in rows:
+            run = dict(row)
+            run["config"] = json.loads(run["config"])
+            runs[run["config_key"]] = run  # newer runs replace older ones
+        for run in runs.values():
+            run["samples"] = self.samples(run["id"])
+        return runs
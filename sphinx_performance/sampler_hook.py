@@ -0,0 +1,113 @@
+"""
+Statistical stack sampler, which gets injected into sphinx-build and its forked workers.
+
+It gets copied as ``sitecustomize.py`` into a folder on the ``PYTHONPATH`` of the build, so
+Python imports it on startup. The build runs in its own virtual environment, so this module
+must only use the standard library.
+
+Sampling is only active, if the environment variable ``SPHINX_PERFORMANCE_SAMPLER_DIR`` is set.
+A timer sends ``SIGPROF`` after each interval of consumed CPU time and the signal handler
+counts the current call stack. Timers are not inherited by forked processes, so each worker
+starts its own one. At exit each process writes its stacks into its own file in the given
+folder, in the folded format of Brendan Gregg's flamegraph tools.
+
+An existing ``sitecustomize`` of the build environment would be shadowed by this module, so
+it gets searched on the rest of ``sys.path`` and executed afterwards.
+"""
+from __future__ import annotations
+
+import atexit
+import importlib.machinery
+import importlib.util
+import os
+import signal
+import sys
+
+SAMPLER_DIR_ENV = "SPHINX_PERFORMANCE_SAMPLER_DIR"
+SAMPLER_RATE_ENV = "SPHINX_PERFORMANCE_SAMPLER_RATE"  # samples per CPU second
+DEFAULT_RATE = 100
+
+
+def frame_name(code) -> str:
+    """Name a frame in the folded format, which uses ``;`` to separate the frames."""
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({code.co_filename}:{code.co_firstlineno})".replace(";", ":")
+
+
+class StackSampler:
+    """Count the call stacks of the main thread, when the timer signal arrives."""
+
+    def __init__(self, folder: str, rate: int) -> None:
+        self.folder = folder
+        self.interval = 1 / rate
+        # Code objects of a stack, outermost first: number of samples
+        self.stacks = {}
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+
+    def sample(self, _signum, frame):
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        stack = tuple(reversed(codes))
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def after_fork(self):
+        """Start sampling the forked process from scratch."""
+        self.stacks = {}
+        self.start()
+        # Forked workers of multiprocessing exit without running atexit handlers
+        from multiprocessing.util import Finalize
+
+        Finalize(self, self.dump, exitpriority=0)
+
+    def dump(self):
+        self.stop()
+        names = {}
+        lines = []
+        for stack, count in self.stacks.items():
+            for code in stack:
+                if code not in names:
+                    names[code] = frame_name(code)
+            lines.append(f"{';'.join(names[code] for code in stack)} {count}\n")
+        path = os.path.join(self.folder, f"{os.getpid()}.folded")  # noqa: PTH118
+        with open(path, "w", encoding="utf8") as folded_file:  # noqa: PTH123
+            folded_file.writelines(lines)
+
+
+def install():
+    """Start sampling, if activated and supported by the system."""
+    folder = os.environ.get(SAMPLER_DIR_ENV)
+    if not folder or not hasattr(signal, "setitimer"):
+        return
+    rate = int(os.environ.get(SAMPLER_RATE_ENV) or DEFAULT_RATE)
+    sampler = StackSampler(folder, rate)
+    sampler.start()
+    atexit.register(sampler.dump)
+    os.register_at_fork(after_in_child=sampler.after_fork)
+
+
+def load_original_sitecustomize():
+    """Execute the ``sitecustomize`` module, which this module shadows, if there is one."""
+    folder = os.path.dirname(os.path.abspath(__file__))  # noqa: PTH100, PTH120
+    paths = [
+        path
+        for path in sys.path
+        if os.path.abspath(path or os.curdir) != folder  # noqa: PTH100
+    ]
+    spec = importlib.machinery.PathFinder.find_spec("sitecustomize", paths)
+    if spec is None or spec.loader is None:
+        return
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+
+if __name__ == "sitecustomize":
+    install()
+    load_original_sitecustomize()
@@ -0,0 +1,244 @@
+"""Analyse how the build time grows with the size of the project."""
+from __future__ import annotations
+
+import math
+import statistics
+from typing import TYPE_CHECKING
+
+import rich.table
+from rich import box
+from rich.style import Style
+
+from sphinx_performance.resultstore import config_key
+from sphinx_performance.stats import linear_fit, summarize
+from sphinx_performance.timing import EVENT_PHASES
+
+if TYPE_CHECKING:
+    from rich.console import Console
+
+SCALING_METRICS = ["total"] + [phase for phase, _, _ in EVENT_PHASES]
+
+# Complexity models, each gets fitted as ``t = a + b * model(n)``
+MODELS = {
+    "n": lambda n: n,
+    "n log n": lambda n: n * math.log(n),
+    "n²": lambda n: n * n,
+}
+
+MIN_POINTS = 3  # Each model has two parameters, so less points always fit perfectly
+QUADRATIC_EXPONENT = 1.5  # From here on, the growth gets marked
+MIN_R2 = 0.5  # A worse fit means, the phase does not grow with the size
+MIN_GROWTH = 0.1  # Smaller growth over the whole sweep is treated as noise
+CONSTANT = "constant"  # Name of the model of phases, which do not grow with the size
+MIN_SHARE = 0.05  # Phases with a smaller share of the total time are not shown
+MAX_EXPONENT = 4.0  # Highest growth exponent, which gets searched
+EXPONENT_STEP = 0.05  # Precision of the growth exponent
+
+
+def sweep_values(start: int, factor: float, steps: int) -> list[int]:
+    """Return ``steps`` geometrically growing values, duplicates by rounding get removed."""
+    values = [max(1, round(start * factor**step)) for step in range(steps)]
+    return list(dict.fromkeys(values))
+
+
+def fit_models(sizes: list[float], times: list[float]) -> dict:
+    """
+    Fit each complexity model of :data:`MODELS` to the measured times.
+
+    :return: dict of model name and fit, see :func:`~sphinx_performance.stats.linear_fit`
+    """
+    fits = {}
+    for name, model in MODELS.items():
+        fit = linear_fit([model(size) for size in sizes], times)
+        if fit is not None:
+            fits[name] = fit
+    return fits
+
+
+def growth_exponent(sizes: list[float], times: list[float]) -> float | None:
+    """
+    Return the exponent ``k`` of ``t = a + b * n^k``, which fits the measured times best.
+
+    The constant ``a``, e.g. the startup of Sphinx, would make the exponent of a plain power
+    law too small. So ``k`` gets searched in steps of :data:`EXPONENT_STEP`.
+
+    :return: exponent, None if the times do not grow with the size
+    """
+    best_exponent = None
+    best_r2 = MIN_R2
+    for step in range(1, round(MAX_EXPONENT / EXPONENT_STEP) + 1):
+        exponent = step * EXPONENT_STEP
+        fit = linear_fit([size**exponent for size in sizes], times)
+        if fit is not None and fit["slope"] > 0 and fit["r2"] > best_r2:
+            best_exponent, best_r2 = exponent, fit["r2"]
+    return best_exponent
+
+
+def predict(fit: dict, model: str, size: float) -> float:
+    """Return the time of a fitted model at the given size."""
+    return fit["intercept"] + fit["slope"] * MODELS[model](size)
+
+
+def complexity_analysis(
+    results: list[dict],
+    param: str,
+    target: int | None = None,
+    outlier_method: str = "mad",
+) -> list[dict]:
+    """
+    Group runs, which differ only in ``param``, and fit the complexity models per phase.
+
+    The size of a run is its number of read documents. If the number of documents is the
+    same for all runs of a group, e.g. for a sweep of ``needs`` per page, the value of
+    ``param`` is used.
+
+    :param results: run results of sphinx-performance
+    :param param: swept project parameter
+    :param target: size to extrapolate the times for, in the unit of each group:
+        documents, or a value of ``param``, if the number of documents does not change
+    :param outlier_method: see :func:`~sphinx_performance.stats.find_outliers`
+    :return: one dict per group with sizes, the unit of the sizes and per metric the
+        times, fits, best model, exponent and extrapolated time
+    """
+    groups = {}
+    for result in results:
+        if param not in result["config"]:
+            continue
+        config = {key: value for key, value in result["config"].items() if key != param}
+        groups.setdefault(config_key(result["project"], config), []).append(result)
+
+    analyses = []
+    for group in groups.values():
+        runs = sorted(group, key=lambda run: run["config"][param])
+        if len({run["config"][param] for run in runs}) < MIN_POINTS:
+            continue
+        documents = [len(run["docs"]) for run in runs]
+        if all(documents) and len(set(documents)) >= MIN_POINTS:
+            unit, sizes = "documents", documents
+        else:
+            unit, sizes = param, [run["config"][param] for run in runs]
+
+        analysis = {
+            "project": runs[0]["project"],
+            "config": {
+                key: value for key, value in runs[0]["config"].items() if key != param
+            },
+            "param": param,
+            "values": [run["config"][param] for run in runs],
+            "unit": unit,
+            "sizes": sizes,
+            "metrics": {},
+        }
+        for metric in SCALING_METRICS:
+            times = []
+            for run in runs:
+                values = [
+                    sample[metric] for sample in run["samples"] if metric in sample
+                ]
+                times.append(
+                    summarize(values, outlier_method)["median"] if values else 0,
+                )
+            if not all(times):
+                continue
+            fits = fit_models(sizes, times)
+            if not fits:
+                continue
+            best = max(fits, key=lambda model: fits[model]["r2"])
+            prediction = predict(fits[best], best, target) if target else None
+            exponent = growth_exponent(sizes, times)
+            if (
+                fits[best]["slope"] <= 0
+                or fits[best]["r2"] < MIN_R2
+                or times[-1] < times[0] * (1 + MIN_GROWTH)
+            ):
+                best = CONSTANT
+                exponent = None
+                prediction = statistics.median(times) if target else None
+            analysis["metrics"][metric] = {
+                "times": times,
+                "fits": fits,
+                "best": best,
+                "exponent": exponent,
+                "target": prediction,
+            }
+        if analysis["metrics"]:
+            analyses.append(analysis)
+    return analyses
+
+
+def print_complexity(console: Console, analyses: list[dict], target: int | None = None):
+    """Print a table per group of runs, one column per phase like the result table."""
+    topic_style = Style(bold=True)
+    for analysis in analyses:
+        config = ", ".join(
+            f"{key}: {value}" for key, value in analysis["config"].items()
+        )
+        table = rich.table.Table(
+            title=f"{analysis['project']}, {config}",
+            box=box.ROUNDED,
+        )
+        # Phases, which take nearly no time, would only show noise
+        max_total = max(analysis["metrics"]["total"]["times"], default=0)
+        metrics = {
+            metric: scaling
+            for metric, scaling in analysis["metrics"].items()
+            if max(scaling["times"]) >= max_total * MIN_SHARE
+        }
+
+        table.add_column("#", justify="center", style=topic_style)
+        for metric in metrics:
+            table.add_column(metric, justify="right")
+
+        for index, (size, value) in enumerate(
+            zip(analysis["sizes"], analysis["values"]),
+        ):
+            label = f"{size} {analysis['unit']}"
+            if analysis["unit"] != analysis["param"]:
+                label += f" ({analysis['param']} {value})"
+            table.add_row(
+                label,
+                *[f"{scaling['times'][index]:.2f} s" for scaling in metrics.values()],
+            )
+        table.add_section()
+        for model in MODELS:
+            table.add_row(
+                f"R² {model}",
+                *[
+                    (
+                        f"{scaling['fits'][model]['r2']:.3f}"
+                        if model in scaling["fits"]
+                        else "-"
+                    )
+                    for scaling in metrics.values()
+                ],
+            )
+
+        best_row = ["best fit"]
+        exponent_row = ["exponent"]
+        target_row = [f"at {target} {analysis['unit']}"]
+        for scaling in metrics.values():
+            best = scaling["best"]
+            best_row.append(f"[bold red]{best}" if best == "n²" else best)
+            exponent = scaling["exponent"]
+            if exponent is None:
+                exponent_row.append("-")
+            else:
+                style = "[bold red]" if exponent >= QUADRATIC_EXPONENT else ""
+                exponent_row.append(f"{style}{exponent:.2f}")
+            if target:
+                target_row.append(f"{scaling['target']:.2f} s")
+        table.add_section()
+        table.add_row(*best_row)
+        table.add_row(*exponent_row)
+        if target:
+            table.add_row(*target_row, style=Style(color="red", bold=True))
+
+        console.print(table)
+    console.print(
+        "R²: goodness of the fit of t = a + b * model(n), the best fit has the highest"
+        f" R². It is {CONSTANT}, if no model fits with R² {MIN_R2} or more or the time"
+        f" grows less than {MIN_GROWTH * 100:.0f} %. Exponent: k of t = a + b * n^k,"
+        " quadratic and worse growth gets marked.",
+    )
+    if target:
+        console.print(f"The time at {target} gets extrapolated by the best fit.")
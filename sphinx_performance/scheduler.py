@@ -0,0 +1,77 @@
+"""
+Run independent test configurations concurrently.
+
+Every run reserves as many cores as it passes to ``sphinx-build -j``, so concurrently running
+builds never use more cores than the configured budget and do not skew each other's timings.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class CoreBudget:
+    """
+    Hand out CPU cores to concurrently running builds.
+
+    Reservations are served in request order, so a build asking for many cores does not
+    get starved by a stream of builds asking for only a few.
+    """
+
+    def __init__(self, cores: int | None = None) -> None:
+        self.total = max(1, cores or os.cpu_count() or 1)
+        self.available = self.total
+        self._condition = threading.Condition()
+        self._queue = deque()
+
+    @contextmanager
+    def reserve(self, cores: int):
+        """
+        Block until ``cores`` cores are free and hold them for the duration of the context.
+
+        Requests bigger than the whole budget get clamped to it, so such a build simply runs
+        alone instead of waiting forever.
+        """
+        cores = min(max(1, cores), self.total)
+        ticket = object()
+        with self._condition:
+            self._queue.append(ticket)
+            self._condition.wait_for(
+                lambda: self._queue[0] is ticket and self.available >= cores,
+            )
+            self._queue.popleft()
+            self.available -= cores
+            self._condition.notify_all()
+        try:
+            yield cores
+        finally:
+            with self._condition:
+                self.available += cores
+                self._condition.notify_all()
+
+    @contextmanager
+    def reserve_all(self):
+        """Hold the complete budget, e.g. while the shared Python environment gets modified."""
+        with self.reserve(self.total) as cores:
+            yield cores
+
+
+def run_ordered(tasks: list, jobs: int = 1) -> list:
+    """
+    Execute the given callables with up to ``jobs`` threads.
+
+    The builds itself run as subprocesses, so threads are enough to keep them busy.
+
+    :param tasks: callables without arguments
+    :param jobs: amount of tasks to execute at the same time
+    :return: list of task results, in the same order as the given tasks
+    """
+    if jobs <= 1:
+        return [task() for task in tasks]
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(task) for task in tasks]
+        return [future.result() for future in futures]
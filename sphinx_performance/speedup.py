@@ -0,0 +1,189 @@
+"""Analyse how the build time scales with the number of parallel processes."""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import rich.table
+from rich import box
+from rich.style import Style
+
+from sphinx_performance.resultstore import config_key
+from sphinx_performance.stats import linear_fit, summarize
+
+if TYPE_CHECKING:
+    from rich.console import Console
+
+SPEEDUP_METRICS = ["total", "reading", "writing"]
+
+# Below this parallel efficiency, more cores are mostly wasted
+LOW_EFFICIENCY = 0.5
+# More cores are not worth it, if they reduce the time by less than this fraction
+MIN_GAIN = 0.1
+
+
+def amdahl_fit(parallels: list[int], times: list[float]) -> dict | None:
+    """
+    Fit Amdahl's law ``T(p) = T(1) * (s + (1 - s) / p)`` to the measured times.
+
+    It is a least squares fit of ``T(p) = a + b / p``, so the serial fraction is
+    ``s = a / (a + b)``, as ``T(1) = a + b``.
+
+    :param parallels: number of parallel processes of each measurement
+    :param times: measured time of each measurement
+    :return: dict with the serial fraction and the maximum possible speedup,
+        None if less than two different parallel values are given
+    """
+    fit = linear_fit([1 / parallel for parallel in parallels], times)
+    if fit is None:
+        return None
+    serial_time = fit["intercept"]
+    single_time = fit["intercept"] + fit["slope"]
+    if single_time <= 0:
+        return None
+    # Measurements do not follow the model exactly, e.g. if more processes slow it down
+    serial = min(max(serial_time / single_time, 0.0), 1.0)
+    return {
+        "serial": serial,
+        "max_speedup": 1 / serial if serial else float("inf"),
+    }
+
+
+def parallel_scaling(results: list[dict], outlier_method: str = "mad") -> list[dict]:
+    """
+    Group runs, which differ only in their ``parallel`` value, and analyse their speedup.
+
+    The speedup and efficiency of each run get calculated against the run with the fewest
+    processes of the same group. Groups with a single run get ignored.
+
+    :param results: run results of sphinx-performance
+    :param outlier_method: see :func:`~sphinx_performance.stats.find_outliers`
+    :return: one dict per group with its runs, sorted by ``parallel``, the Amdahl fit per
+        metric and the recommended number of processes
+    """
+    groups = {}
+    for result in results:
+        config = {
+            key: value for key, value in result["config"].items() if key != "parallel"
+        }
+        groups.setdefault(config_key(result["project"], config), []).append(result)
+
+    analyses = []
+    for group in groups.values():
+        if len({run["config"]["parallel"] for run in group}) < 2:  # noqa: PLR2004
+            continue
+        runs = sorted(group, key=lambda run: run["config"]["parallel"])
+        analysis = {
+            "project": runs[0]["project"],
+            "config": {
+                key: value
+                for key, value in runs[0]["config"].items()
+                if key != "parallel"
+            },
+            "parallels": [run["config"]["parallel"] for run in runs],
+            "metrics": {},
+        }
+        for metric in SPEEDUP_METRICS:
+            times = []
+            for run in runs:
+                values = [
+                    sample[metric] for sample in run["samples"] if metric in sample
+                ]
+                times.append(
+                    summarize(values, outlier_method)["median"] if values else 0,
+                )
+            if not all(times):
+                continue
+            analysis["metrics"][metric] = _metric_scaling(analysis["parallels"], times)
+        if "total" in analysis["metrics"]:
+            analysis["recommended"] = _recommended_parallel(
+                analysis["parallels"],
+                analysis["metrics"]["total"]["times"],
+            )
+            analyses.append(analysis)
+    return analyses
+
+
+def _metric_scaling(parallels: list[int], times: list[float]) -> dict:
+    base_parallel, base_time = parallels[0], times[0]
+    speedups = [base_time / time for time in times]
+    return {
+        "times": times,
+        "speedups": speedups,
+        "efficiencies": [
+            speedup / (parallel / base_parallel)
+            for speedup, parallel in zip(speedups, parallels)
+        ],
+        "amdahl": amdahl_fit(parallels, times),
+    }
+
+
+def _recommended_parallel(parallels: list[int], times: list[float]) -> int:
+    """Return the fewest processes, after which more processes gain less than MIN_GAIN."""
+    recommended = parallels[0]
+    best_time = times[0]
+    for parallel, time in zip(parallels[1:], times[1:]):
+        if time < best_time * (1 - MIN_GAIN):
+            recommended = parallel
+            best_time = time
+    return recommended
+
+
+def print_scaling(console: Console, analyses: list[dict]):
+    """Print a table per group of runs, one column per number of processes."""
+    topic_style = Style(bold=True)
+    for analysis in analyses:
+        config = ", ".join(
+            f"{key}: {value}" for key, value in analysis["config"].items()
+        )
+        table = rich.table.Table(
+            title=f"{analysis['project']}, {config}",
+            box=box.ROUNDED,
+        )
+        table.add_column("#", justify="center", style=topic_style)
+        for parallel in analysis["parallels"]:
+            recommended = parallel == analysis["recommended"]
+            table.add_column(
+                f"-j {parallel}",
+                justify="center",
+                header_style="bold green" if recommended else None,
+            )
+        table.add_column("Amdahl fit", justify="center")
+
+        for metric, scaling in analysis["metrics"].items():
+            amdahl = scaling["amdahl"]
+            efficiencies = []
+            speedups = []
+            for speedup, efficiency in zip(
+                scaling["speedups"],
+                scaling["efficiencies"],
+            ):
+                style = "[bold yellow]" if efficiency < LOW_EFFICIENCY else ""
+                speedups.append(f"{style}{speedup:.2f}x")
+                efficiencies.append(f"{style}{efficiency * 100:.0f} %")
+            table.add_row(
+                f"{metric} time",
+                *[f"{time:.2f} s" for time in scaling["times"]],
+                "",
+            )
+            table.add_row(
+                f"{metric} speedup",
+                *speedups,
+                f"max {amdahl['max_speedup']:.1f}x" if amdahl else "-",
+            )
+            table.add_row(
+                f"{metric} efficiency",
+                *efficiencies,
+                f"serial {amdahl['serial'] * 100:.0f} %" if amdahl else "-",
+            )
+            table.add_row("")
+
+        console.print(table)
+        console.print(
+            f"[bold]Recommended[/bold]:\t -j {analysis['recommended']}, more processes"
+            f" reduce the total time by less than {MIN_GAIN * 100:.0f} %.",
+        )
+    console.print(
+        "Speedup and efficiency against the fewest processes, efficiencies below"
+        f" {LOW_EFFICIENCY * 100:.0f} % are marked. Serial: fraction of the time, which"
+        " does not run in parallel, by a fit of Amdahl's law.",
+    )
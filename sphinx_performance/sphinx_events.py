@@ -6,14 +6,79 @@ The goal is to enable extension specific profiling reports.
 
 from __future__ import annotations
 
+import functools
+import json
+import math
+import os
+import re
+import sys
+import time
+import tracemalloc
+import uuid
+from multiprocessing.util import Finalize, register_after_fork
 from pathlib import Path
 
+import click
+from pyinstrument.frame import SELF_TIME_FRAME_IDENTIFIER, Frame
+from pyinstrument.renderers import JSONRenderer
+from pyinstrument.session import Session
 from sphinx.events import EventManager as EventManagerOrig
 
+from sphinx_performance.utils import console
+
 # ruff: noqa: ANN002
 #             (missing-type-args - type depends on event, however emit is generic)
 
 
+# Generated emit function of each event, see EventManager
+TRAMPOLINES = {}
+# Name of each generated emit function and its event
+TRAMPOLINE_EVENTS = {}
+TRAMPOLINE_PREFIX = "emit_"
+
+
+def trampoline(event: str):
+    """
+    Return the emit function of the event, which gets created on its first use.
+
+    Each function has a unique name ``emit_<event>`` and only calls the original
+    ``EventManager.emit``, so it shows up as own frame in the call tree of a profiler.
+    """
+    function = TRAMPOLINES.get(event)
+    if function is None:
+        name = TRAMPOLINE_PREFIX + re.sub(r"\W", "_", event)
+        # e.g. for the events "a-b" and "a_b" or "firstresult" and emit_firstresult()
+        while name in TRAMPOLINE_EVENTS or hasattr(EventManagerOrig, name):
+            name += "_"
+        source = (
+            f"def {name}(self, *args, **kwargs):\n"
+            "    return emit(self, *args, **kwargs)\n"
+        )
+        namespace = {"emit": EventManagerOrig.emit}
+        # The source is fixed, only the name depends on the event
+        exec(compile(source, __file__, "exec"), namespace)  # noqa: S102
+        function = TRAMPOLINES.setdefault(event, namespace[name])
+        TRAMPOLINE_EVENTS[function.__name__] = event
+    return function
+
+
+def trampoline_event(function: str) -> str | None:
+    """
+    Return the event of an emit function created by :func:`trampoline`.
+
+    Profiles may have been recorded by another process, so unknown names get converted back.
+    This is ambiguous for events containing ``_`` and other non identifier characters.
+    """
+    if not function.startswith(TRAMPOLINE_PREFIX):
+        return None
+    if hasattr(EventManagerOrig, function):  # e.g. emit_firstresult()
+        return None
+    event = TRAMPOLINE_EVENTS.get(function)
+    if event is None:
+        event = function[len(TRAMPOLINE_PREFIX) :].replace("_", "-")
+    return event
+
+
 class EventManager(EventManagerOrig):
     """
     Overwrite sphinx.events.EventManager.emit() to call an event specific variant.
@@ -24,95 +89,189 @@ class EventManager(EventManagerOrig):
     got fired by EventManager.emit. Making the name event specific enables collection
     of runtime per extensions in a post processing step.
 
+    The event specific variants get created for each event on its registration or first
+    emit, so also events of extensions are supported. See :func:`trampoline`.
+
     The function is monkeypatched into sphinx.application.EventManager so it is used
     during Sphinx runtime without modifying Sphinx or extensions.
     """
 
-    def emit(self, *args, **kwargs) -> list:
-        """Overwritten method in super class."""
-        event: str = args[0]
-        event_identifier = event.replace("-", "_")
-        func_name = f"emit_{event_identifier}"
-        if hasattr(self, func_name):
-            return getattr(self, func_name)(*args, **kwargs)
-        msg = (
-            f"The method for event {event} is not yet implemented. Expected"
-            f" name: '{func_name}'"
-        )
-        raise NotImplementedError(msg)
-
-    def emit_config_inited(self, *args, **kwargs):
-        return super().emit(*args, **kwargs)
+    def add(self, name: str) -> None:
+        """Overwritten method in super class, to create the emit function upfront."""
+        super().add(name)
+        trampoline(name)
 
-    def emit_builder_inited(self, *args, **kwargs):
-        return super().emit(*args, **kwargs)
-
-    def emit_env_get_outdated(self, *args, **kwargs):
-        return super().emit(*args, **kwargs)
-
-    def emit_env_before_read_docs(self, *args, **kwargs):
-        return super().emit(*args, **kwargs)
-
-    def emit_env_purge_doc(self, *args, **kwargs):
-        return super().emit(*args, **kwargs)
-
-    def emit_source_read(self, *args, **kwargs):
-        return super().emit(*args, **kwargs)
-
-    def emit_doctree_read(self, *args, **kwargs):
-        return super().emit(*args, **kwargs)
-
-    def emit_env_merge_info(self, *args, **kwargs):
-        return super().emit(*args, **kwargs)
-
-    def emit_env_updated(self, *args, **kwargs):
-        return super().emit(*args, **kwargs)
+    def emit(self, name: str, *args, **kwargs) -> list:
+        """Overwritten method in super class."""
+        function = TRAMPOLINES.get(name) or trampoline(name)
+        return function(self, name, *args, **kwargs)
+
+
+def listener_name(callback) -> str:
+    """Name a listener like pyinstrument names its frame: ``<short file path>: <qualname>``."""
+    function = getattr(callback, "__func__", callback)  # bound methods
+    qualname = getattr(function, "__qualname__", None) or repr(callback)
+    code = getattr(function, "__code__", None)
+    if code is not None:
+        file_path, line_no = code.co_filename, code.co_firstlineno
+    else:  # e.g. callable classes
+        module = sys.modules.get(getattr(callback, "__module__", None) or "")
+        file_path, line_no = getattr(module, "__file__", None), 0
+    if not file_path:
+        return qualname
+    frame = Frame(f"{qualname}\x00{file_path}\x00{line_no}")
+    return f"{frame.file_path_short or ''}: {qualname}"
+
+
+class ListenerTimingEventManager(EventManagerOrig):
+    """
+    Measure the runtime of each listener of each event, without a profiler.
 
-    def emit_env_get_updated(self, *args, **kwargs):
-        return super().emit(*args, **kwargs)
+    Each connected listener gets wrapped, so it measures its own runtime by
+    ``time.perf_counter_ns()``. The time of a listener includes the time of events it emits.
 
-    def emit_env_check_consistency(self, *args, **kwargs):
-        return super().emit(*args, **kwargs)
+    Parallel builds fork worker processes, which measure their listeners on their own.
+    If :attr:`dump_dir` is set, each worker stores its times there when it exits.
+    :meth:`measured_times` merges them with the times of the main process.
+    """
 
-    def emit_missing_reference(self, *args, **kwargs):
-        return super().emit(*args, **kwargs)
+    dump_dir: Path | None = None
+
+    def __init__(self, app) -> None:
+        super().__init__(app)
+        # (event, listener name, module): [calls, total ns, max ns]
+        self.listener_times = {}
+        register_after_fork(self, ListenerTimingEventManager._after_fork)
+
+    def connect(self, name: str, callback, priority: int) -> int:
+        """Overwritten method in super class, to connect the measuring listener."""
+        return super().connect(name, self._timed_listener(name, callback), priority)
+
+    def _timed_listener(self, name: str, callback):
+        times = self.listener_times
+        key = (name, listener_name(callback), getattr(callback, "__module__", None))
+        perf_counter_ns = time.perf_counter_ns
+
+        @functools.wraps(callback)
+        def timed_listener(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                duration = perf_counter_ns() - start
+                measured = times.get(key)
+                if measured is None:
+                    times[key] = [1, duration, duration]
+                else:
+                    measured[0] += 1
+                    measured[1] += duration
+                    if duration > measured[2]:
+                        measured[2] = duration
+
+        return timed_listener
+
+    def _after_fork(self):
+        # The worker got a copy of the times of the main process. The listeners keep a
+        # reference to the dict, so it gets cleared instead of replaced.
+        self.listener_times.clear()
+        if self.dump_dir is not None:
+            Finalize(self, self._dump_times, exitpriority=0)
+
+    def _dump_times(self):
+        path = Path(self.dump_dir) / f"{os.getpid()}-{uuid.uuid4().hex}.json"
+        path.write_text(json.dumps(self._entries()))
+
+    def _entries(self) -> list[list]:
+        return [[*key, *measured] for key, measured in self.listener_times.items()]
+
+    def measured_times(self) -> list[list]:
+        """
+        Return the times of the main process and of all worker processes.
+
+        :return: list of ``[event, listener name, module, calls, total ns, max ns]``
+        """
+        entries = self._entries()
+        if self.dump_dir is not None:
+            for path in sorted(Path(self.dump_dir).glob("*.json")):
+                entries += json.loads(path.read_text())
+        return entries
+
+
+def listener_timing_overhead(calls: int = 100_000, repeat: int = 5) -> float:
+    """
+    Measure the overhead of :class:`ListenerTimingEventManager` per listener call.
 
-    def emit_warn_missing_reference(self, *args, **kwargs):
-        return super().emit(*args, **kwargs)
+    A listener, which does nothing, gets called directly and through the measuring wrapper
+    of the event manager. The fastest of ``repeat`` runs of each gets compared.
 
-    def emit_doctree_resolved(self, *args, **kwargs):
-        return super().emit(*args, **kwargs)
+    :return: additional seconds per listener call
+    """
 
-    def emit_html_page_context(self, *args, **kwargs):
-        return super().emit(*args, **kwargs)
+    def listener(_app):
+        pass
+
+    manager = ListenerTimingEventManager(None)
+    timed_listener = manager._timed_listener("benchmark", listener)  # noqa: SLF001
+    durations = [float("inf"), float("inf")]
+    # Alternating runs are influenced by the same load of the machine
+    for _ in range(repeat):
+        for index, function in enumerate([listener, timed_listener]):
+            start = time.perf_counter()
+            for _ in range(calls):
+                function(None)
+            durations[index] = min(durations[index], time.perf_counter() - start)
+    return max(durations[1] - durations[0], 0.0) / calls
+
+
+def extension_of(module: str | None, extensions: list[str]) -> str:
+    """Return the loaded extension, which contains the module, or its top level package."""
+    if not module:
+        return "unknown"
+    matches = [
+        extension
+        for extension in extensions
+        if module == extension or module.startswith(f"{extension}.")
+    ]
+    if matches:
+        return max(matches, key=len)
+    return module.split(".")[0]
 
-    def emit_html_collect_pages(self, *args, **kwargs):
-        return super().emit(*args, **kwargs)
 
-    def emit_build_finished(self, *args, **kwargs):
-        return super().emit(*args, **kwargs)
+def listener_report(entries: list[list], extensions: list[str]) -> dict:
+    """
+    Merge the measured times of all processes per event and listener.
 
+    :param entries: see :meth:`ListenerTimingEventManager.measured_times`
+    :param extensions: names of the loaded extensions, to attribute the listeners
+    :return: dict of ``Event: <name>`` and per listener its extension, calls and
+        the total, mean and max time in seconds
+    """
+    merged = {}
+    for event, name, module, calls, total, maximum in entries:
+        measured = merged.setdefault((event, name, module), [0, 0, 0])
+        measured[0] += calls
+        measured[1] += total
+        measured[2] = max(measured[2], maximum)
+
+    report = {}
+    for (event, name, module), (calls, total, maximum) in merged.items():
+        report.setdefault(f"Event: {event}", {})[name] = {
+            "extension": extension_of(module, extensions),
+            "calls": calls,
+            "total": total / 1e9,
+            "mean": total / calls / 1e9,
+            "max": maximum / 1e9,
+        }
+    return report
+
+
+def event_runtime(report: dict) -> dict:
+    """Return the total time per event and listener, like :func:`aggregate_event_runtime`."""
+    return {
+        event: {name: measured["total"] for name, measured in listeners.items()}
+        for event, listeners in report.items()
+    }
 
-EVENTS = [
-    "builder-inited",
-    "config-inited",
-    "env-get-outdated",
-    "env-purge-doc",
-    "env-before-read-docs",
-    "source-read",
-    "object-description-transform",
-    "doctree-read",
-    "missing-reference",
-    "warn-missing-reference",
-    "doctree-resolved",
-    "env-merge-info",
-    "env-updated",
-    "env-check-consistency",
-    "html-collect-pages",
-    "html-page-context",
-    "linkcheck-process-uri",
-    "build-finished",
-]
 
 # Custom frames that shall also be collected. Any pyinstrument tree nodes can be added
 # here, so the JSON can be used to get quick information for any Sphinx build step.
@@ -128,15 +287,167 @@ CUSTOM_FRAMES_BY_REPORT_NAME = {
 }
 
 
+def frames_by_report_name() -> dict[str, list[str]]:
+    """
+    Return the frame sequence of each custom frame, which shall be reported.
+
+    Events get discovered from the recorded frames, see :func:`trampoline_event`.
+    """
+    return dict(CUSTOM_FRAMES_BY_REPORT_NAME)
+
+
+def _event_frames(frame_key: tuple[str | None, str]) -> tuple | None:
+    """Return the report name and frame sequence, if the frame emits an event."""
+    class_name, function = frame_key
+    if class_name != "EventManager":
+        return None
+    event = trampoline_event(function)
+    if event is None:
+        return None
+    return f"Event: {event}", [f"{class_name}.{function}", "EventManager.emit"]
+
+
+def _frame_key(qualifier: str) -> tuple[str | None, str]:
+    """Split a qualifier like ``EventManager.emit`` into class name and function."""
+    class_name, _, function = qualifier.rpartition(".")
+    return class_name or None, function
+
+
+def aggregate_session_events(session: Session) -> dict:
+    """
+    Aggregate the runtime of Sphinx events directly from a pyinstrument session.
+
+    The result is the same as of :func:`aggregate_event_runtime`, but neither the frame
+    tree nor its JSON get created. See :func:`aggregate_frame_records`.
+    """
+    return aggregate_frame_records(session.frame_records, frames_by_report_name())
+
+
+def aggregate_frame_records(
+    frame_records: list[tuple[list[str], float]],
+    frames_by_event: dict[str, list],
+) -> dict:
+    """
+    Add up the time of all frames called by an event, sample by sample.
+
+    Each sample of pyinstrument is a call stack with a time. The frame sequences of the
+    events get matched like by a prefix automaton: the partial matches after each frame
+    of the stack are stored per depth as tuple of ``(event, position)``. Events are
+    added to the sequences, when their emit frame shows up first. Consecutive
+    samples share most of their stack, so only the frames after the common prefix get
+    matched again. The memory is bounded by the depth of the stacks.
+    """
+    sequences = {
+        report_name: tuple(_frame_key(frame) for frame in frames)
+        for report_name, frames in frames_by_event.items()
+    }
+    starts = {}  # frame key: events, whose sequence starts with it
+    for event, sequence in sequences.items():
+        starts.setdefault(sequence[0], []).append(event)
+
+    infos = {}  # frame info: (identifier, frame key, reported name)
+    infos_by_identifier = {}
+
+    def frame_details(frame_info: str) -> tuple:
+        info = infos.get(frame_info)
+        if info is None:
+            frame = Frame(frame_info)
+            info = infos_by_identifier.get(frame.identifier)
+            if info is None:
+                key = (frame.class_name or None, frame.function)
+                event_frames = _event_frames(key)
+                if event_frames is not None and event_frames[0] not in sequences:
+                    report_name, frames = event_frames
+                    sequences[report_name] = tuple(_frame_key(f) for f in frames)
+                    starts.setdefault(key, []).append(report_name)
+                if frame.class_name:
+                    qualifier = f"{frame.class_name}.{frame.function}"
+                else:
+                    qualifier = frame.function
+                info = (
+                    frame.identifier,
+                    key,
+                    f"{frame.file_path_short or ''}: {qualifier}",
+                    f"{frame.file_path_short or ''}: {SELF_TIME_FRAME_IDENTIFIER}",
+                    frame.is_synthetic_leaf,
+                )
+                infos_by_identifier[frame.identifier] = info
+            infos[frame_info] = info
+        return info
+
+    out_obj = {}
+    no_match = ()
+    stack = []  # frame details of the current call stack
+    states = [
+        no_match,
+    ]  # partial matches after each depth, the first one before the root
+    completions = []  # (depth, events), whose sequence got completed at this depth
+    for frame_info_stack, sample_time in frame_records:
+        depth = 0
+        common = min(len(frame_info_stack), len(stack))
+        while depth < common and frame_details(frame_info_stack[depth]) is stack[depth]:
+            depth += 1
+        del stack[depth:]
+        del states[depth + 1 :]
+        while completions and completions[-1][0] >= depth:
+            completions.pop()
+
+        for frame_info in frame_info_stack[depth:]:
+            info = frame_details(frame_info)
+            key = info[1]
+            active = states[-1]
+            if active:
+                # Partial matches continue only, if the frame is the next of the sequence
+                active = tuple(
+                    (event, position + 1)
+                    for event, position in active
+                    if sequences[event][position] == key
+                )
+            if key in starts:
+                active_events = {event for event, _ in active}
+                active += tuple(
+                    (event, 1) for event in starts[key] if event not in active_events
+                )
+            if active:
+                completed = [
+                    event
+                    for event, position in active
+                    if position == len(sequences[event])
+                ]
+                if completed:
+                    completions.append((len(stack), completed))
+                    active = (
+                        tuple(
+                            (event, position)
+                            for event, position in active
+                            if position != len(sequences[event])
+                        )
+                        or no_match
+                    )
+            stack.append(info)
+            states.append(active)
+
+        for event_depth, events in completions:
+            if event_depth + 1 < len(stack):
+                reported = stack[event_depth + 1][2]
+            elif not stack[event_depth][4]:
+                reported = stack[event_depth][3]  # time spent in the event frame itself
+            else:
+                continue
+            for event in events:
+                report = out_obj.setdefault(event, {})
+                report[reported] = report.get(reported, 0) + sample_time
+    return out_obj
+
+
 def aggregate_event_runtime(json_render_data):
-    """Filter JSON tree for Sphinx events and add up the consumption time of subpackages."""
-    event_functions_frames = {}
-    for event in EVENTS:
-        event_functions_frames[event] = [
-            f"EventManager.emit_{event.replace('-', '_')}",
-            "EventManager.emit",
-        ]
-    event_functions_frames.update(CUSTOM_FRAMES_BY_REPORT_NAME)
+    """
+    Filter JSON tree for Sphinx events and add up the consumption time of subpackages.
+
+    Needs the session rendered by the ``JSONRenderer`` and parsed again. For big profiles
+    :func:`aggregate_session_events` is much faster and needs less memory.
+    """
+    event_functions_frames = frames_by_report_name()
     out_obj = {}
     active_events = {}
     filter_frame_tree(
@@ -157,6 +468,7 @@ def filter_frame_tree(
     """
     Recursively walk the JSON tree looking for event related functions.
 
+    Events get added to ``frames_by_event`` on their first emit frame.
     All sub-package (extension) invocations are aggregated for the event.
     """
     if "class_name" in data_obj:
@@ -176,6 +488,10 @@ def filter_frame_tree(
             pass
     active_events = active_events_new
 
+    event_frames = _event_frames(_frame_key(data_obj_qualifier))
+    if event_frames is not None:
+        frames_by_event.setdefault(*event_frames)
+
     for event, frames in frames_by_event.items():
         if event not in active_events and data_obj_qualifier == frames[0]:
             active_events[event] = frames[1:]
@@ -183,8 +499,7 @@ def filter_frame_tree(
     collect_events = [
         event for event, frames in active_events.items() if len(frames) == 0
     ]
-    for event in collect_events:
-        key = f"Event: {event}" if event in EVENTS else event
+    for key in collect_events:
         if key not in out_obj:
             out_obj[key] = {}
         for child in data_obj["children"]:
@@ -198,7 +513,92 @@ def filter_frame_tree(
                 out_obj[key][full_qualifier] = 0
             out_obj[key][full_qualifier] += child["time"]
         # event is handled, delete it
-        del active_events[event]
+        del active_events[key]
 
     for child in data_obj["children"]:
         filter_frame_tree(child, frames_by_event, active_events, out_obj)
+
+
+def benchmark_aggregation(session: Session, repeat: int = 3) -> dict:
+    """
+    Measure the runtime and peak memory of both aggregations on the same session.
+
+    :return: dict of variant name and its best runtime in seconds, peak memory in bytes
+        and result. Memory gets measured by an additional run with tracemalloc.
+    """
+    variants = {
+        "json": lambda: aggregate_event_runtime(
+            json.loads(JSONRenderer(show_all=True).render(session)),
+        ),
+        "session": lambda: aggregate_session_events(session),
+    }
+    measurements = {}
+    for name, variant in variants.items():
+        runtimes = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            result = variant()
+            runtimes.append(time.perf_counter() - start_time)
+        tracemalloc.start()
+        variant()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        measurements[name] = {
+            "runtime": min(runtimes),
+            "memory": peak_memory,
+            "result": result,
+        }
+    return measurements
+
+
+@click.command(
+    context_settings={
+        "help_option_names": ["-h", "--help"],
+    },
+)
+@click.argument("session_file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--repeat",
+    default=3,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Number of measured aggregations per variant.",
+)
+def cli_benchmark_aggregation(session_file, repeat):
+    """Benchmark the event aggregations on a pyinstrument session, saved as JSON."""
+    session = Session.load(session_file)
+    console.print(f"Session: {session_file} with {session.sample_count} samples")
+    measurements = benchmark_aggregation(session, repeat)
+    for name, measurement in measurements.items():
+        console.print(
+            f"[bold]{name}[/bold]:\t {measurement['runtime']:.3f} s,"
+            f" peak memory {measurement['memory'] / 1024 / 1024:.1f} MB",
+        )
+
+    # The JSON rounds times to microseconds, so the results differ slightly. The JSON
+    # tree also drops the self time of frames, which have no other children.
+    def comparable(result):
+        return {
+            event: {
+                frame: value
+                for frame, value in frames.items()
+                if not frame.endswith(SELF_TIME_FRAME_IDENTIFIER)
+            }
+            for event, frames in result.items()
+        }
+
+    json_result = comparable(measurements["json"]["result"])
+    session_result = comparable(measurements["session"]["result"])
+    equal = json_result.keys() == session_result.keys() and all(
+        json_result[event].keys() == session_result[event].keys()
+        and all(
+            math.isclose(value, session_result[event][frame], abs_tol=1e-3)
+            for frame, value in json_result[event].items()
+        )
+        for event in json_result
+    )
+    console.print(f"[bold]Same results[/bold]:\t {'yes' if equal else '[red]no'}")
+
+
+if __name__ == "__main__":
+    cli_benchmark_aggregation()
@@ -0,0 +1,173 @@
+"""Statistics for repeated measurements."""
+from __future__ import annotations
+
+import math
+import statistics
+
+# Two-sided 95% quantiles of the Student's t-distribution by degrees of freedom.
+T_95 = {
+    1: 12.706,
+    2: 4.303,
+    3: 3.182,
+    4: 2.776,
+    5: 2.571,
+    6: 2.447,
+    7: 2.365,
+    8: 2.306,
+    9: 2.262,
+    10: 2.228,
+    11: 2.201,
+    12: 2.179,
+    13: 2.160,
+    14: 2.145,
+    15: 2.131,
+    16: 2.120,
+    17: 2.110,
+    18: 2.101,
+    19: 2.093,
+    20: 2.086,
+    21: 2.080,
+    22: 2.074,
+    23: 2.069,
+    24: 2.064,
+    25: 2.060,
+    26: 2.056,
+    27: 2.052,
+    28: 2.048,
+    29: 2.045,
+    30: 2.042,
+    40: 2.021,
+    60: 2.000,
+    120: 1.980,
+}
+T_95_INFINITE = 1.960
+
+OUTLIER_METHODS = ["mad", "iqr"]
+
+MAD_THRESHOLD = 3.5  # Iglewicz and Hoaglin: modified z-score above it is an outlier
+IQR_FACTOR = 1.5  # Tukey fences
+
+MIN_OUTLIER_SAMPLES = 3  # With less samples, nothing can be called an outlier
+
+
+def t_critical(degrees_of_freedom: float) -> float:
+    """Return the two-sided 95% t-quantile, rounded down to the next known degree of freedom."""
+    if degrees_of_freedom < 1:
+        return math.inf
+    if degrees_of_freedom > max(T_95):
+        return T_95_INFINITE
+    return T_95[max(df for df in T_95 if df <= degrees_of_freedom)]
+
+
+def find_outliers(values: list[float], method: str = "mad") -> list[int]:
+    """
+    Return the indexes of all outliers in ``values``.
+
+    ``mad`` uses the modified z-score based on the median absolute deviation,
+    ``iqr`` the Tukey fences of the inter quartile range.
+    """
+    if len(values) < MIN_OUTLIER_SAMPLES:
+        return []
+
+    if method == "mad":
+        median = statistics.median(values)
+        mad = statistics.median([abs(value - median) for value in values])
+        if mad == 0:
+            return []
+        return [
+            i
+            for i, value in enumerate(values)
+            if 0.6745 * abs(value - median) / mad > MAD_THRESHOLD
+        ]
+
+    if method == "iqr":
+        q1, _, q3 = statistics.quantiles(values, n=4, method="inclusive")
+        iqr = q3 - q1
+        low = q1 - IQR_FACTOR * iqr
+        high = q3 + IQR_FACTOR * iqr
+        return [i for i, value in enumerate(values) if value < low or value > high]
+
+    msg = f"Unknown outlier method '{method}'. Supported: {', '.join(OUTLIER_METHODS)}"
+    raise ValueError(msg)
+
+
+def summarize(values: list[float], outlier_method: str = "mad") -> dict:
+    """
+    Calculate the statistics of repeated measurements.
+
+    Outliers get flagged and are not used for the calculated statistics.
+
+    :param values: measured values
+    :param outlier_method: see :func:`find_outliers`
+    :return: dict with n, min, median, mean, stddev, ci_low, ci_high and outliers
+    """
+    outliers = find_outliers(values, outlier_method)
+    used = [value for i, value in enumerate(values) if i not in outliers]
+
+    mean = statistics.fmean(used)
+    stddev = statistics.stdev(used) if len(used) > 1 else 0.0
+    ci_delta = t_critical(len(used) - 1) * stddev / math.sqrt(len(used))
+    if math.isnan(ci_delta):  # only one value
+        ci_delta = math.inf
+
+    return {
+        "n": len(values),
+        "min": min(used),
+        "median": statistics.median(used),
+        "mean": mean,
+        "stddev": stddev,
+        "ci_low": mean - ci_delta,
+        "ci_high": mean + ci_delta,
+        "outliers": outliers,
+        "values": used,
+    }
+
+
+def welch_test(values_a: list[float], values_b: list[float]) -> dict:
+    """
+    Test if the means of two measurements differ significantly by Welch's t-test.
+
+    The variances of both measurements do not need to be equal.
+    At least 2 values per measurement are needed, otherwise ``significant`` is None.
+
+    :return: dict with t, dof (Welch-Satterthwaite degrees of freedom) and significant (95%)
+    """
+    n_a, n_b = len(values_a), len(values_b)
+    if n_a < 2 or n_b < 2:  # noqa: PLR2004
+        return {"t": math.nan, "dof": math.nan, "significant": None}
+
+    var_a = statistics.variance(values_a) / n_a
+    var_b = statistics.variance(values_b) / n_b
+    diff = statistics.fmean(values_b) - statistics.fmean(values_a)
+    if var_a + var_b == 0:
+        # No variance at all, so every difference is significant
+        t = math.copysign(math.inf, diff) if diff else 0.0
+        return {"t": t, "dof": math.inf, "significant": diff != 0}
+
+    t = diff / math.sqrt(var_a + var_b)
+    dof = (var_a + var_b) ** 2 / (var_a**2 / (n_a - 1) + var_b**2 / (n_b - 1))
+    return {"t": t, "dof": dof, "significant": abs(t) > t_critical(dof)}
+
+
+def linear_fit(xs: list[float], ys: list[float]) -> dict | None:
+    """
+    Fit ``y = intercept + slope * x`` by least squares.
+
+    :return: dict with intercept, slope and r2 (coefficient of determination),
+        None if less than two different x values are given
+    """
+    if len(set(xs)) < 2:  # noqa: PLR2004
+        return None
+    mean_x = statistics.fmean(xs)
+    mean_y = statistics.fmean(ys)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sum(
+        (x - mean_x) ** 2 for x in xs
+    )
+    intercept = mean_y - slope * mean_x
+    total = sum((y - mean_y) ** 2 for y in ys)
+    residual = sum((y - intercept - slope * x) ** 2 for x, y in zip(xs, ys))
+    return {
+        "intercept": intercept,
+        "slope": slope,
+        "r2": 1 - residual / total if total else 1.0,
+    }
@@ -0,0 +1,166 @@
+"""
+Evaluate the event times recorded by :mod:`sphinx_performance.timing_extension`.
+
+The phases of a build are calculated from the events of the main Sphinx process, so they are
+exact for every builder and do not depend on the printed output of sphinx-build.
+Read and write durations get calculated per document.
+"""
+from __future__ import annotations
+
+import csv
+import json
+import math
+from pathlib import Path
+
+# Phase name, event starting it and event ending it.
+# ``None`` stands for the start and the end of the sphinx-build process.
+EVENT_PHASES = [
+    ("startup", None, "config-inited"),
+    ("loading", "config-inited", "builder-inited"),  # pickled environment and builder
+    ("initializing", "builder-inited", "env-before-read-docs"),
+    ("reading", "env-before-read-docs", "env-updated"),
+    ("consistency", "env-updated", "env-check-consistency"),  # incl. pickling
+    ("writing", "env-check-consistency", "build-finished"),
+    ("finishing", "build-finished", None),
+]
+
+
+def load_records(path: str | Path) -> list[dict]:
+    """Return the recorded events, sorted by time. A missing file has no events."""
+    path = Path(path)
+    if not path.exists():
+        return []
+    records = []
+    with path.open() as file:
+        for line in file:
+            line = line.strip()  # noqa: PLW2901
+            if line:
+                records.append(json.loads(line))
+    records.sort(key=lambda record: record["time"])
+    return records
+
+
+def phase_intervals(records: list[dict], start_time: float, end_time: float) -> dict:
+    """
+    Return the start and end time of each phase in :data:`EVENT_PHASES`.
+
+    :param records: recorded events, see :func:`load_records`
+    :param start_time: start of the sphinx-build process, by ``time.perf_counter()``
+    :param end_time: end of the sphinx-build process
+    :return: dict of phase and ``(start, end)``, phases without recorded events are missing.
+        Empty if the build did not get initialized.
+    """
+    main_pid = next(
+        (record["pid"] for record in records if record["event"] == "builder-inited"),
+        None,
+    )
+    if main_pid is None:
+        return {}
+
+    event_times = {None: start_time}
+    for record in records:
+        if record["pid"] == main_pid:
+            event_times.setdefault(record["event"], record["time"])
+
+    intervals = {}
+    for phase, start_event, end_event in EVENT_PHASES:
+        phase_start = event_times.get(start_event)
+        phase_end = end_time if end_event is None else event_times.get(end_event)
+        # Build aborted or phase not supported by the used Sphinx version
+        if phase_start is not None and phase_end is not None:
+            intervals[phase] = (phase_start, phase_end)
+    return intervals
+
+
+def event_phases(records: list[dict], start_time: float, end_time: float) -> dict:
+    """
+    Calculate the duration of each phase in :data:`EVENT_PHASES`.
+
+    :param records: recorded events, see :func:`load_records`
+    :param start_time: start of the sphinx-build process, by ``time.perf_counter()``
+    :param end_time: end of the sphinx-build process
+    :return: dict of phase durations in seconds, empty if the build did not get initialized
+    """
+    intervals = phase_intervals(records, start_time, end_time)
+    if not intervals:
+        return {}
+    durations = {}
+    for phase, _, _ in EVENT_PHASES:
+        if phase in intervals:
+            phase_start, phase_end = intervals[phase]
+            durations[phase] = max(0.0, phase_end - phase_start)
+        else:
+            durations[phase] = 0.0
+    return durations
+
+
+def outdated_docs(records: list[dict]) -> int:
+    """Return the amount of documents, which Sphinx had to read."""
+    return sum(
+        record.get("docs", 0)
+        for record in records
+        if record["event"] == "env-before-read-docs"
+    )
+
+
+def doc_times(records: list[dict]) -> dict:
+    """
+    Calculate the read and write duration of each document.
+
+    Reading lasts from ``source-read`` till ``doctree-read`` in the same process.
+    Writing is the sum of resolving and writing the doctree, which may happen in different
+    processes for parallel builds.
+
+    :param records: recorded events, see :func:`load_records`
+    :return: dict of docname and its dict with ``read`` and ``write`` duration in seconds
+    """
+    times = {}
+    read_starts = {}
+    for record in records:
+        docname = record.get("docname")
+        if docname is None:
+            continue
+        doc = times.setdefault(docname, {"read": 0.0, "write": 0.0})
+        key = (record["pid"], docname)
+        if record["event"] == "source-read":
+            read_starts[key] = record["time"]
+        elif record["event"] == "doctree-read" and key in read_starts:
+            doc["read"] += record["time"] - read_starts.pop(key)
+        elif record["event"] in ("resolve-doc", "write-doc"):
+            doc["write"] += record["duration"]
+    return times
+
+
+def percentiles(values: list[float], points: list[int]) -> dict:
+    """Return the given percentiles of ``values`` by the nearest-rank method."""
+    values = sorted(values)
+    if not values:
+        return {point: 0.0 for point in points}
+    return {
+        point: values[max(0, math.ceil(point / 100 * len(values)) - 1)]
+        for point in points
+    }
+
+
+def write_docs_csv(path: str | Path, runs: list[tuple[dict, dict]]):
+    """
+    Store the durations of all documents of all runs in a CSV file.
+
+    :param path: CSV file, gets overwritten
+    :param runs: list of (run values, like the project config, and the document durations)
+    """
+    columns = list(dict.fromkeys(key for run, _ in runs for key in run))
+    with Path(path).open("w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow([*columns, "docname", "read", "write"])
+        for run, docs in runs:
+            run_values = [run.get(column, "") for column in columns]
+            for docname, times in docs.items():
+                writer.writerow(
+                    [
+                        *run_values,
+                        docname,
+                        f"{times['read']:.6f}",
+                        f"{times['write']:.6f}",
+                    ],
+                )
@@ -0,0 +1,138 @@
+"""
+Sphinx extension, which records the time of the core build events.
+
+It gets copied into each test project and added to its ``conf.py``. The build runs in its own
+virtual environment, so this module must only use the standard library.
+
+Recording is only active, if the environment variable ``SPHINX_PERFORMANCE_TIMING_FILE`` is set.
+Each event gets appended as a JSON line to this file. Appending single lines is atomic, so
+also the forked processes of parallel builds can write into the same file.
+Timestamps come from the system wide monotonic clock, so they can be compared between the
+processes.
+
+Resolving and writing of documents do not have start and end events, so the related methods
+of the builder and the environment get wrapped to record their duration per document.
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+
+# ruff: noqa: ARG002, ANN002
+#             (unused-method-argument - listener signatures are given by Sphinx)
+#             (missing-type-args - wrapped methods have different arguments)
+
+TIMING_FILE_ENV = "SPHINX_PERFORMANCE_TIMING_FILE"
+
+# Listeners of start events shall run before, of end events after all other listeners.
+FIRST = 0
+LAST = 1000
+
+
+class TimingRecorder:
+    """Append the time of Sphinx events to a JSON lines file."""
+
+    def __init__(self, path: str) -> None:
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def record(
+        self,
+        event: str,
+        docname: str | None = None,
+        start_time: float | None = None,
+        **fields,
+    ):
+        """
+        Append a single event.
+
+        :param event: name of the event
+        :param docname: document the event belongs to
+        :param start_time: if given, the event lasted from this time till now
+        :param fields: further values to store
+        """
+        now = time.perf_counter()
+        record = {"event": event, "time": now, "pid": os.getpid(), **fields}
+        if docname is not None:
+            record["docname"] = docname
+        if start_time is not None:
+            record["time"] = start_time
+            record["duration"] = now - start_time
+        os.write(self.fd, (json.dumps(record) + "\n").encode("utf8"))
+
+    def timed(self, event: str, func):
+        """Wrap ``func``, which gets the docname as first argument, to record its duration."""
+
+        def wrapper(docname, *args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return func(docname, *args, **kwargs)
+            finally:
+                self.record(event, docname, start_time)
+
+        return wrapper
+
+    def config_inited(self, app, config):
+        self.record("config-inited")
+
+    def builder_inited(self, app):
+        self.record("builder-inited")
+        app.builder.write_doc = self.timed("write-doc", app.builder.write_doc)
+
+    def env_before_read_docs(self, app, env, docnames):
+        self.record("env-before-read-docs", docs=len(docnames))
+
+    def source_read(self, app, docname, source):
+        self.record("source-read", docname)
+
+    def doctree_read(self, app, doctree):
+        self.record("doctree-read", app.env.docname)
+
+    def env_updated(self, app, env):
+        self.record("env-updated")
+
+    def env_check_consistency(self, app, env):
+        self.record("env-check-consistency")
+        # The environment already got pickled, which would fail with the wrapper
+        env.get_and_resolve_doctree = self.timed(
+            "resolve-doc",
+            env.get_and_resolve_doctree,
+        )
+
+    def doctree_resolved(self, app, doctree, docname):
+        self.record("doctree-resolved", docname)
+
+    def build_finished(self, app, exception):
+        self.record("build-finished")
+        app.env.__dict__.pop("get_and_resolve_doctree", None)
+        os.close(self.fd)
+
+
+def setup(app):
+    """Connect the recorder to the events, if recording is activated."""
+    path = os.environ.get(TIMING_FILE_ENV)
+    if path:
+        recorder = TimingRecorder(path)
+        app.connect("config-inited", recorder.config_inited, priority=LAST)
+        app.connect("builder-inited", recorder.builder_inited, priority=FIRST)
+        app.connect(
+            "env-before-read-docs",
+            recorder.env_before_read_docs,
+            priority=FIRST,
+        )
+        app.connect("source-read", recorder.source_read, priority=FIRST)
+        app.connect("doctree-read", recorder.doctree_read, priority=LAST)
+        app.connect("env-updated", recorder.env_updated, priority=LAST)
+        app.connect(
+            "env-check-consistency",
+            recorder.env_check_consistency,
+            priority=LAST,
+        )
+        app.connect("doctree-resolved", recorder.doctree_resolved, priority=FIRST)
+        app.connect("build-finished", recorder.build_finished, priority=FIRST)
+
+    return {
+        "version": "1.0",
+        "parallel_read_safe": True,
+        "parallel_write_safe": True,
+    }
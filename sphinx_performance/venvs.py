@@ -0,0 +1,224 @@
+"""
+Cache of virtual environments for the test project requirements.
+
+Each environment is identified by the hash of the rendered requirements and the used Python
+version. So it gets created once and reused by all later runs with the same requirements,
+without modifying the Python environment sphinx-performance is running in.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import venv
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from sphinx_performance.utils import console as default_console
+
+if TYPE_CHECKING:
+    from rich.console import Console
+
+METADATA_FILE = "sphinx-performance-venv.json"
+
+# Prints the versions of all installed distributions as JSON
+PACKAGES_SCRIPT = (
+    "import json, importlib.metadata as m;"
+    " print(json.dumps({d.metadata['Name']: d.version for d in m.distributions()}))"
+)
+
+
+def package_versions(python_path: str | Path) -> dict:
+    """Return the installed packages and their versions of a Python environment."""
+    try:
+        output = subprocess.run(
+            [str(python_path), "-c", PACKAGES_SCRIPT],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {}
+    return json.loads(output)
+
+
+class Venv:
+    """A single, ready to use virtual environment of the pool."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.metadata_path = path / METADATA_FILE
+        if os.name == "nt":
+            self.bin_path = path / "Scripts"
+            self.python_path = self.bin_path / "python.exe"
+            self.sphinx_path = self.bin_path / "sphinx-build.exe"
+        else:
+            self.bin_path = path / "bin"
+            self.python_path = self.bin_path / "python"
+            self.sphinx_path = self.bin_path / "sphinx-build"
+
+    @property
+    def is_complete(self) -> bool:
+        return self.metadata_path.exists()
+
+    @property
+    def metadata(self) -> dict:
+        return json.loads(self.metadata_path.read_text())
+
+    @property
+    def last_used(self) -> float:
+        return self.metadata_path.stat().st_mtime
+
+    @property
+    def packages(self) -> dict:
+        """Installed packages and their versions, stored at creation time."""
+        packages = self.metadata.get("packages")
+        if packages is None:  # Created by an older version
+            packages = package_versions(self.python_path)
+        return packages
+
+    def touch(self):
+        os.utime(self.metadata_path)
+
+
+class VenvPool:
+    """
+    Create and hand out virtual environments for given requirements.
+
+    Least recently used environments get deleted, if the pool gets bigger than ``max_size_mb``.
+    Environments in use by a run of this process never get deleted.
+    """
+
+    def __init__(self, root: str | Path, max_size_mb: int = 5000) -> None:
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size_mb * 1024 * 1024
+
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._in_use = {}
+
+    @staticmethod
+    def key(requirements: str) -> str:
+        """Identify an environment by the requirements and the Python version."""
+        requirements = "\n".join(
+            line.strip() for line in requirements.splitlines() if line.strip()
+        )
+        python = (
+            f"{platform.python_implementation()} {platform.python_version()}"
+            f" {sys.platform} {platform.machine()}"
+        )
+        return hashlib.sha256(f"{python}\n{requirements}".encode()).hexdigest()[:20]
+
+    @contextmanager
+    def acquire(
+        self,
+        requirements: str,
+        *,
+        debug: bool = False,
+        console: Console | None = None,
+    ):
+        """
+        Provide a virtual environment with the given requirements installed.
+
+        The environment gets created, if it does not exist yet.
+        It can not be evicted, as long as the context is active.
+        """
+        console = console or default_console
+        key = self.key(requirements)
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+        try:
+            with key_lock:
+                env = Venv(self.root / key)
+                created = not env.is_complete
+                if created:
+                    self._create(env, requirements, debug=debug, console=console)
+                env.touch()
+            if created:
+                self.evict(console)
+            yield env
+        finally:
+            with self._lock:
+                self._in_use[key] -= 1
+
+    def _create(self, env: Venv, requirements: str, *, debug: bool, console: Console):
+        # A folder without metadata is a leftover of an aborted creation
+        shutil.rmtree(env.path, ignore_errors=True)
+
+        req_path = self.root / f"{env.path.name}.requirements.txt"
+        req_path.write_text(requirements)
+        dep_command = [
+            str(env.python_path),
+            "-m",
+            "pip",
+            "install",
+            "-r",
+            str(req_path),
+        ]
+        try:
+            if debug:
+                console.rule("Creating virtual environment START", style="blue")
+                venv.create(env.path, with_pip=True)
+                subprocess.run(dep_command, check=True)
+                console.rule("Creating virtual environment FINISHED", style="blue")
+            else:
+                with console.status(f"Creating virtual environment {env.path}"):
+                    venv.create(env.path, with_pip=True)
+                    subprocess.run(
+                        dep_command,
+                        stdout=subprocess.DEVNULL,
+                        check=True,
+                    )
+        except (OSError, subprocess.CalledProcessError):
+            shutil.rmtree(env.path, ignore_errors=True)
+            raise
+        finally:
+            req_path.unlink()
+
+        metadata = {
+            "requirements": requirements,
+            "python": platform.python_version(),
+            "created": time.time(),
+            "size": _folder_size(env.path),
+            "packages": package_versions(env.python_path),
+        }
+        env.metadata_path.write_text(json.dumps(metadata, indent=2))
+
+    def evict(self, console: Console | None = None):
+        """Delete least recently used environments, till the pool fits into its size limit."""
+        console = console or default_console
+        with self._lock:
+            envs = [Venv(path) for path in self.root.iterdir() if path.is_dir()]
+            envs = [env for env in envs if env.is_complete]
+            total_size = sum(env.metadata["size"] for env in envs)
+
+            for env in sorted(envs, key=lambda env: env.last_used):
+                if total_size <= self.max_size:
+                    break
+                if self._in_use.get(env.path.name):
+                    continue
+                console.print(
+                    f"Deleting least recently used virtual environment {env.path}",
+                )
+                total_size -= env.metadata["size"]
+                shutil.rmtree(env.path, ignore_errors=True)
+
+
+def _folder_size(folder: Path) -> int:
+    size = 0
+    for dirpath, _dirnames, filenames in os.walk(folder):
+        for f in filenames:
+            fp = Path(dirpath) / f
+            if not fp.is_symlink():
+                size += fp.stat().st_size
+    return size
@@ -0,0 +1,55 @@
+"""
+Profile the forked worker processes of a parallel Sphinx build with pyinstrument.
+
+With ``parallel`` bigger than 1, Sphinx reads and writes the documents in forked processes.
+A profiler of the main process only sees it waiting for them. So each worker starts its own
+profiler and saves its session at exit, and the sessions get combined with the one of the
+main process afterwards.
+"""
+from __future__ import annotations
+
+import inspect
+import os
+import uuid
+from multiprocessing.util import Finalize, register_after_fork
+from pathlib import Path
+
+from pyinstrument import Profiler
+from pyinstrument.session import Session
+
+
+class WorkerProfiler:
+    """
+    Start a pyinstrument profiler in each process, which gets forked by multiprocessing.
+
+    :param profiler: running profiler of the main process, its settings get reused
+    :param dump_dir: folder, which collects the sessions of the workers
+    """
+
+    def __init__(self, profiler: Profiler, dump_dir: str | Path) -> None:
+        self.profiler = profiler
+        self.dump_dir = Path(dump_dir)
+        register_after_fork(self, WorkerProfiler._after_fork)
+
+    def _after_fork(self):
+        # The copied profiler of the main process would record the worker into its session,
+        # which is never used. Its async context also allows no second profiler.
+        if self.profiler.is_running:
+            self.profiler.stop()
+        worker_profiler = Profiler(
+            interval=self.profiler.interval,
+            async_mode=self.profiler.async_mode,
+        )
+        worker_profiler.start(caller_frame=inspect.currentframe())
+        # Workers exit without running atexit handlers, but with multiprocessing finalizers
+        Finalize(self, self._save, args=(worker_profiler,), exitpriority=0)
+
+    def _save(self, worker_profiler: Profiler):
+        session = worker_profiler.stop()
+        session.save(self.dump_dir / f"{os.getpid()}-{uuid.uuid4().hex}.json")
+
+    def combine(self, session: Session) -> Session:
+        """Return the session of the main process, combined with the ones of all workers."""
+        for path in sorted(self.dump_dir.glob("*.json")):
+            session = Session.combine(session, Session.load(path))
+        return session
@@ -0,0 +1,44 @@
+import subprocess
+import sys
+import time
+
+from sphinx_performance.buildoutput import LineSplitter, PhaseTimeline, read_lines
+
+# Prints the phases like Sphinx' progress_message, which ends the line after the phase
+FAKE_BUILD = """
+import sys, time
+print("reading sources... [100%] index", flush=True)
+time.sleep(0.2)
+sys.stdout.write("pickling environment... ")
+sys.stdout.flush()
+time.sleep(1)
+print("done", flush=True)
+print("build succeeded.", flush=True)
+"""
+
+
+def test_line_splitter_uses_arrival_of_first_bytes():
+    splitter = LineSplitter()
+    assert splitter.feed(1.0, b"reading sources\npickling environment... ") == [
+        (1.0, "reading sources"),
+    ]
+    assert splitter.feed(2.0, b"done\nbuild") == [(1.0, "pickling environment... done")]
+    assert splitter.feed(3.0, b" succeeded.\n") == [(2.0, "build succeeded.")]
+    assert splitter.flush() == []
+
+
+def test_phase_without_newline_starts_at_its_first_output():
+    start_time = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-c", FAKE_BUILD],
+        stdout=subprocess.PIPE,
+    )
+    timeline = PhaseTimeline(start_time)
+    for timestamp, line in read_lines(process):
+        if line is not None:
+            timeline.add_line(timestamp, line)
+    process.wait()
+    durations = timeline.durations(time.perf_counter())
+
+    assert 0.9 < durations["pickling"] < 1.5
+    assert durations["reading"] < 0.7